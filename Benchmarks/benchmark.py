@@ -0,0 +1,344 @@
+# benchmark.py
+#
+# End to end benchmarks for makePCB/KiCadParser
+#
+# This is free software with no warranty whatsoever
+# You may modify but you may not sell it as your own work.
+#
+# Builds every Examples/*/*.pos and a set of generated boards and reports
+# the time taken, the peak memory used and the size of the output. The
+# example outputs are also compared with the kicad_pcb files checked in
+# next to them (line endings are ignored because those were made on
+# Windows).
+#
+# Generated boards come in three sizes, 1x, 10x and 100x:-
+#
+#   ring     RING of LED/CAP groups, 10,000 LEDs at 100x
+#   grid     REPEAT of a REPEAT of LEDs, 100 x 100 at 100x
+#   uselist  USELIST of segments, 100,000 rows at 100x
+#   donut    DONUT zone with Smooth 36,000 at 100x
+#
+# Usage:-
+#
+#   python Benchmarks/benchmark.py [-s 1,10,100] [-r N] [-k NAME] [--no-save]
+#       runs the benchmarks and adds the results to Benchmarks/history.json
+#
+#   python Benchmarks/benchmark.py --compare [-t 10]
+#       compares the last two runs in the history and lists any board which
+#       got slower or used more memory by more than the threshold percentage,
+#       whose output changed size or which no longer matches its checked-in
+#       kicad_pcb. Exits with status 1 if there were any.
+#
+# Each board is built in a scratch directory holding copies of the templates
+# and components so the position data files work unchanged.
+
+import os
+import sys
+import glob
+import json
+import time
+import shutil
+import platform
+import argparse
+import tempfile
+import tracemalloc
+
+try:
+    from io import StringIO
+except ImportError:
+    from StringIO import StringIO
+
+root=os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0,root)
+
+import makePCB
+from KiCadParser import KiCadParser, numpy
+
+historyFile=os.path.join(os.path.dirname(os.path.abspath(__file__)),"history.json")
+
+# the templates every generated board loads
+boardHeader="""ASIS,HEADER,templates\\Header.txt
+TEMPLATE,SEGMENT,templates\\Segment.txt
+TEMPLATE,GRTEXT,templates\\Text.txt
+TEMPLATE,ZONE,templates\\Zone.txt
+TEMPLATE,WS2812B,components\\WS2812B.txt
+TEMPLATE,CAP,components\\Capacitors SMD.txt
+HEADER
+ORIGIN,0,190
+SETDIRECTION,1,-1
+"""
+
+ledGroup="""DEFGROUP,LED_CAP
+WS2812B,L,0,0,0,F.Cu
+CAP,C,-90,6,0,F.Cu
+SEGMENT,LINE,-2.5,2,-2.5,5,1,F.Cu,0
+SEGMENT,LINE,-2.5,-2,-2.5,0,.1,F.Cu,0
+SEGMENT,LINE,2.5,2,2.5,0,.1,F.Cu,0
+SEGMENT,LINE,2.5,-2,2.5,-5,1,F.Cu,0
+ENDGROUP
+"""
+
+#########################################################################################
+#
+# generated boards
+#
+# each generator returns the position data and a dictionary of any list
+# files it needs, keyed by file name
+#
+#########################################################################################
+
+def ringBoard(scale):
+    count=100*scale
+    pos=boardHeader+ledGroup+"""DEFRING,LEDS
+GROUP,LED_CAP,0,0,0
+ENDRING
+RING,LEDS,100,100,%d,-90,0,%d,%s
+""" % (count,count,repr(360.0/count))
+    return pos,{}
+
+def gridBoard(scale):
+    side=int(round(10*scale**0.5))
+    pos=boardHeader+"""DEFREPEAT,ROW
+WS2812B,L,0,0,0,F.Cu
+SEGMENT,LINE,2.5,0,7.5,0,.1,F.Cu,0
+ENDREPEAT
+DEFREPEAT,GRID
+REPEAT,ROW,0,0,0,%d,10,0,0
+ENDREPEAT
+REPEAT,GRID,10,10,0,%d,0,10,0
+""" % (side,side)
+    return pos,{}
+
+def useListBoard(scale):
+    rows=1000*scale
+    lines=[]
+    for i in range(rows):
+        x=i*0.01
+        lines.append("%s#%s#%s#%s" % (repr(x),repr((i%100)*0.1),repr(x+0.01),repr(((i+1)%100)*0.1)))
+    pos=boardHeader+"""LIST,ROWS,#,Rows.txt
+USELIST,ROWS
+SEGMENT,LINE,%0%,%1%,%2%,%3%,0.01,F.Cu,0
+ENDUSELIST
+"""
+    return pos,{"Rows.txt":"\n".join(lines)+"\n"}
+
+def donutBoard(scale):
+    pos=boardHeader+"""ZONE,DONUT,120,120,20,25,0,360,%d,0,,F.Cu,full,0.508,0.508,0.254,16,0.508,.508
+""" % (360*scale)
+    return pos,{}
+
+generators=[("ring",ringBoard),("grid",gridBoard),("uselist",useListBoard),("donut",donutBoard)]
+
+#########################################################################################
+#
+# building
+#
+#########################################################################################
+
+# makeWorkDir
+#
+# creates a scratch directory with the templates and components in it.
+# The position data files name them like templates\Segment.txt so on
+# anything but Windows a copy with the backslash in its name is made too
+
+def makeWorkDir():
+    work=tempfile.mkdtemp(prefix="makePCB-bench-")
+    for folder in ("templates","components"):
+        os.mkdir(os.path.join(work,folder))
+        for name in os.listdir(os.path.join(root,folder)):
+            src=os.path.join(root,folder,name)
+            shutil.copy(src,os.path.join(work,folder,name))
+            if os.sep!="\\":
+                shutil.copy(src,os.path.join(work,folder+"\\"+name))
+    return work
+
+# buildOnce
+#
+# builds work/board.pos and returns (seconds,peak,outputBytes,ok)
+# peak is the tracemalloc peak in bytes or None if memory wasn't traced
+
+def buildOnce(work,board,traceMemory):
+    cwd=os.getcwd()
+    stdout=sys.stdout
+    os.chdir(work)
+    sys.stdout=StringIO()
+    peak=None
+    try:
+        Parser=KiCadParser()
+        if traceMemory: tracemalloc.start()
+        start=time.perf_counter()
+        ok=makePCB.buildBoard(board,Parser)
+        seconds=time.perf_counter()-start
+        if traceMemory:
+            peak=tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+        ok=ok and Parser.numErrors==0
+    finally:
+        sys.stdout=stdout
+        os.chdir(cwd)
+    return seconds,peak,os.path.getsize(os.path.join(work,board+".kicad_pcb")),ok
+
+# bench
+#
+# times the best of repeats builds then builds once more under tracemalloc
+# for the peak memory, which would otherwise distort the timings
+
+def bench(work,board,repeats):
+    best=None
+    for i in range(repeats):
+        seconds,unused,outputBytes,ok=buildOnce(work,board,False)
+        if best is None or seconds<best: best=seconds
+    unused,peak,unused2,unused3=buildOnce(work,board,True)
+    return {"seconds":best,"peak":peak,"bytes":outputBytes,"ok":ok}
+
+# checkedIn
+#
+# finds the kicad_pcb next to an example - the case of the names
+# doesn't always match the .pos file
+
+def checkedIn(pos):
+    folder=os.path.dirname(pos)
+    want=os.path.basename(pos)[:-4].lower()+".kicad_pcb"
+    for name in os.listdir(folder):
+        if name.lower()==want: return os.path.join(folder,name)
+    return None
+
+def sameOutput(fileA,fileB):
+    with open(fileA,"rb") as a, open(fileB,"rb") as b:
+        return a.read().replace(b"\r\n",b"\n")==b.read().replace(b"\r\n",b"\n")
+
+def runExamples(work,repeats,keep,results):
+    for pos in sorted(glob.glob(os.path.join(root,"Examples","*","*.pos"))):
+        board=os.path.basename(pos)[:-4]
+        name="example/"+board
+        if keep and not any(k in name for k in keep): continue
+
+        shutil.copy(pos,work)
+        for listFile in glob.glob(os.path.join(os.path.dirname(pos),"*.txt")):
+            shutil.copy(listFile,work)
+
+        result=bench(work,board,repeats)
+        expected=checkedIn(pos)
+        result["identical"]=None if expected is None else sameOutput(os.path.join(work,board+".kicad_pcb"),expected)
+        results[name]=result
+        report(name,result)
+
+def runGenerated(work,scales,repeats,keep,results):
+    for kind,generator in generators:
+        for scale in scales:
+            name="%s/%dx" % (kind,scale)
+            if keep and not any(k in name for k in keep): continue
+
+            pos,lists=generator(scale)
+            board="gen-%s-%d" % (kind,scale)
+            with open(os.path.join(work,board+".pos"),"w") as file:
+                file.write(pos)
+            for listName,text in lists.items():
+                with open(os.path.join(work,listName),"w") as file:
+                    file.write(text)
+
+            result=bench(work,board,repeats)
+            result["identical"]=None
+            results[name]=result
+            report(name,result)
+
+#########################################################################################
+#
+# reporting and history
+#
+#########################################################################################
+
+def report(name,result):
+    identical={None:"",True:"same",False:"DIFFERS"}[result["identical"]]
+    line="%-28s %9.3fs %9.1fMB %11d  %-7s" % (name,result["seconds"],result["peak"]/1048576.0,result["bytes"],identical)
+    if not result["ok"]: line=line+" ERRORS"
+    print(line)
+
+def loadHistory(filename):
+    if not os.path.exists(filename): return []
+    with open(filename) as file:
+        return json.load(file)
+
+def saveHistory(filename,history):
+    with open(filename,"w") as file:
+        json.dump(history,file,indent=1,sort_keys=True)
+
+# compareRuns
+#
+# returns a list of messages describing how new is worse than old
+# times and peaks only count if they grew by more than threshold percent
+
+def compareRuns(old,new,threshold):
+    problems=[]
+    limit=1.0+threshold/100.0
+    for name in sorted(new["results"]):
+        if name not in old["results"]: continue
+        a=old["results"][name]
+        b=new["results"][name]
+        if b["seconds"]>a["seconds"]*limit:
+            problems.append("%s time %.3fs -> %.3fs (+%.0f%%)" % (name,a["seconds"],b["seconds"],100.0*(b["seconds"]/a["seconds"]-1)))
+        if a["peak"] and b["peak"]>a["peak"]*limit:
+            problems.append("%s peak memory %.1fMB -> %.1fMB (+%.0f%%)" % (name,a["peak"]/1048576.0,b["peak"]/1048576.0,100.0*(b["peak"]/float(a["peak"])-1)))
+        if b["bytes"]!=a["bytes"]:
+            problems.append("%s output size %d -> %d bytes" % (name,a["bytes"],b["bytes"]))
+        if a["identical"] and not b["identical"]:
+            problems.append("%s no longer matches its checked-in kicad_pcb" % name)
+        if a["ok"] and not b["ok"]:
+            problems.append("%s now has errors" % name)
+    return problems
+
+def compare(args):
+    history=loadHistory(args.history)
+    if len(history)<2:
+        print("Need at least two runs in",args.history,"to compare.")
+        sys.exit(1)
+    old,new=history[-2],history[-1]
+    print("Comparing run of",new["date"],"with",old["date"],"threshold",str(args.threshold)+"%")
+    problems=compareRuns(old,new,args.threshold)
+    for p in problems:
+        print("REGRESSION",p)
+    if len(problems)==0:
+        print("No regressions.")
+    sys.exit(1 if problems else 0)
+
+def run(args):
+    scales=[int(s) for s in args.scales.split(",") if s.strip()!=""]
+    keep=args.keep or []
+
+    print("%-28s %10s %11s %11s  %s" % ("Board","Time","Peak","Bytes","Checked-in"))
+    results={}
+    work=makeWorkDir()
+    try:
+        if not args.no_examples: runExamples(work,args.repeat,keep,results)
+        runGenerated(work,scales,args.repeat,keep,results)
+    finally:
+        shutil.rmtree(work,ignore_errors=True)
+
+    if args.no_save: return
+    history=loadHistory(args.history)
+    history.append({
+        "date":time.strftime("%Y-%m-%d %H:%M:%S"),
+        "python":platform.python_version(),
+        "numpy":numpy is not None,
+        "repeat":args.repeat,
+        "results":results})
+    saveHistory(args.history,history)
+    print("Results added to",args.history)
+
+
+if __name__=="__main__":
+    argParser=argparse.ArgumentParser(description="Benchmark makePCB on the examples and generated boards.")
+    argParser.add_argument("-s","--scales",default="1,10,100",help="comma separated sizes of the generated boards (default: 1,10,100)")
+    argParser.add_argument("-r","--repeat",type=int,default=3,help="time the best of this many builds (default: 3)")
+    argParser.add_argument("-k","--keep",action="append",help="only run boards whose name contains this, can be repeated")
+    argParser.add_argument("--no-examples",action="store_true",help="skip the Examples boards")
+    argParser.add_argument("--no-save",action="store_true",help="don't add the results to the history")
+    argParser.add_argument("--history",default=historyFile,help="history file (default: Benchmarks/history.json)")
+    argParser.add_argument("--compare",action="store_true",help="compare the last two runs in the history")
+    argParser.add_argument("-t","--threshold",type=float,default=10.0,help="percentage slowdown or memory growth counted as a regression (default: 10)")
+    args=argParser.parse_args()
+
+    if args.compare:
+        compare(args)
+    else:
+        run(args)
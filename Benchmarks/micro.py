@@ -0,0 +1,293 @@
+# micro.py
+#
+# Microbenchmarks for the KiCadParser helpers which run on every
+# iteration of every RING, REPEAT and USELIST
+#
+# This is free software with no warranty whatsoever
+# You may modify but you may not sell it as your own work.
+#
+# Each benchmark calls one helper with fixed inputs. The time per call is
+# divided by the time of a plain python calibration loop run at the same
+# time so a baseline taken on one machine is still useful on another.
+#
+# Usage:-
+#
+#   python Benchmarks/micro.py
+#       runs the benchmarks and compares them with Benchmarks/micro_baseline.json
+#       exits with status 1 if any helper is slower than its baseline by more
+#       than the threshold percentage (25% unless the baseline entry has
+#       its own "threshold")
+#
+#   python Benchmarks/micro.py --save
+#       runs the benchmarks and makes the results the new baseline
+#
+#   -k NAME only runs benchmarks whose name contains NAME
+#   -t N    sets the default threshold percentage
+
+import os
+import sys
+import json
+import time
+import timeit
+import platform
+import argparse
+
+try:
+    from io import StringIO
+except ImportError:
+    from StringIO import StringIO
+
+root=os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0,root)
+
+from KiCadParser import KiCadParser
+
+baselineFile=os.path.join(os.path.dirname(os.path.abspath(__file__)),"micro_baseline.json")
+
+clock=getattr(time,"perf_counter",time.time)
+
+# the board every benchmark runs against - some variables, a saveXY
+# variable and the templates used by the rendering benchmarks
+setupLines=[
+    "TEMPLATE,SEGMENT,"+os.path.join(root,"templates","Segment.txt"),
+    "TEMPLATE,WS2812B,"+os.path.join(root,"components","WS2812B.txt"),
+    "ORIGIN,20,190",
+    "SETDIRECTION,1,-1",
+    "SETG,PITCH,2.54",
+    "SETG,OFFSET,1.5",
+    "SAVEXY,DIN,7.5,0",
+    ]
+
+def makeParser():
+    Parser=KiCadParser()
+    messages=StringIO()
+    stdout=sys.stdout
+    sys.stdout=messages
+    try:
+        for cmd in Parser.compileLines(setupLines):
+            Parser.execute(cmd)
+    finally:
+        sys.stdout=stdout
+    if Parser.numErrors or Parser.numWarnings:
+        sys.stdout.write(messages.getvalue())
+        raise Exception("benchmark set up failed, see the messages above")
+    return Parser
+
+#########################################################################################
+#
+# benchmarks
+#
+# each one takes a parser and returns a function of no arguments which
+# calls the helper once. Helpers which return a BoardItem render it too
+# so the time includes writing it out
+#
+#########################################################################################
+
+def calibrate(P):
+    values=[1.5,2.5,3.5,4.5]
+    def f():
+        total=0.0
+        for v in values: total=total+v*2.0
+        return total
+    return f
+
+def evalNumber(P):
+    return lambda: P.evalNumericParam("12.5")
+
+def evalExpression(P):
+    return lambda: P.evalNumericParam("PITCH-OFFSET+10")
+
+def resolveCoords(P):
+    return lambda: P.resolveCoords("10.5","-20.25")
+
+def resolveSaveXY(P):
+    return lambda: P.resolveCoords("DIN_X","DIN_Y+2")
+
+def transformXY(P):
+    return lambda: P.transformXY(10.5,-20.25)
+
+def getAngleRadiusXY(P):
+    return lambda: P.getAngleRadiusXY(3.0,4.0)
+
+def strFloat(P):
+    return lambda: P.strFloat(123.456789)
+
+def varContainsSaveXYVar(P):
+    return lambda: P.varContainsSaveXYVar("DIN_X+1")
+
+def varContainsNoSaveXYVar(P):
+    return lambda: P.varContainsSaveXYVar("PITCH+1")
+
+def useListHelper(P):
+    row=["0.001851852","0.610480053","0.003703704","0.608175728"]
+    return lambda: P.useListHelper("LINE,%0%,%1%,%2%,%3%,0.01,F.Cu,0",row)
+
+def pushPopState(P):
+    def f():
+        P.pushState()
+        P.popState()
+    return f
+
+def segmentLineHelper(P):
+    template=P.getTemplate("SEGMENT")
+    return lambda: P.segment_line_helper(1.0,2.0,3.0,4.0,0.25,"F.Cu",0.0,template).render(P)
+
+def component(P):
+    args=["L","0","10.5","-20.25","F.Cu"]
+    return lambda: P.component("WS2812B",args).render(P)
+
+benchmarks=[
+    ("calibrate",calibrate),
+    ("evalNumericParam/number",evalNumber),
+    ("evalNumericParam/expression",evalExpression),
+    ("resolveCoords",resolveCoords),
+    ("resolveCoords/saveXY",resolveSaveXY),
+    ("transformXY",transformXY),
+    ("getAngleRadiusXY",getAngleRadiusXY),
+    ("strFloat",strFloat),
+    ("varContainsSaveXYVar/yes",varContainsSaveXYVar),
+    ("varContainsSaveXYVar/no",varContainsNoSaveXYVar),
+    ("useListHelper",useListHelper),
+    ("pushState+popState",pushPopState),
+    ("segment_line_helper",segmentLineHelper),
+    ("component",component),
+    ]
+
+#########################################################################################
+#
+# running
+#
+#########################################################################################
+
+# runNumber
+#
+# returns how many calls of the timer's function take about 0.2s - a
+# helper taking a few microseconds timed over a shorter run is too
+# noisy for the threshold
+
+def runNumber(timer):
+    number=1
+    while True:
+        seconds=timer.timeit(number)
+        if seconds>=0.2: return number
+        # jump most of the way there once the run is long enough to go by
+        if seconds>=0.01: number=int(number*0.22/seconds)+1
+        else: number=number*10
+
+# runAll
+#
+# the calibration loop is timed again alongside each benchmark so
+# the machine slowing down part way through doesn't skew the results
+# returns the fastest calibration time and the results
+
+def runAll(keep,repeats):
+    P=makeParser()
+    results={}
+    fastest=None
+    for name,make in benchmarks:
+        if name=="calibrate": continue
+        if keep and not any(k in name for k in keep): continue
+        calibration,results[name]=runOne(P,make,repeats)
+        if fastest is None or calibration<fastest: fastest=calibration
+    return fastest,results
+
+# runOne
+#
+# times repeats runs of the calibration loop and of the helper taking
+# turns, so each helper run is divided by a calibration run done under
+# the same machine load, and returns the best calibration time and
+# the helper's best time with the median of those ratios. timeit
+# switches the garbage collector off while it times so a collection
+# landing in one run doesn't count
+
+def runOne(P,make,repeats):
+    calibration=timeit.Timer(calibrate(P),timer=clock)
+    helper=timeit.Timer(make(P),timer=clock)
+    calibrationNumber=runNumber(calibration)
+    helperNumber=runNumber(helper)
+    fastest=seconds=None
+    ratios=[]
+    for r in range(repeats):
+        c=calibration.timeit(calibrationNumber)/calibrationNumber
+        h=helper.timeit(helperNumber)/helperNumber
+        ratios.append(h/c)
+        if fastest is None or c<fastest: fastest=c
+        if seconds is None or h<seconds: seconds=h
+    ratios.sort()
+    return fastest,{"seconds":seconds,"relative":ratios[len(ratios)//2]}
+
+def loadBaseline(filename):
+    if not os.path.exists(filename): return None
+    with open(filename) as file:
+        return json.load(file)
+
+# check
+#
+# prints each result against the baseline and returns the names
+# of the helpers that have slowed down too much. A helper which
+# looks slower is timed again up to retries times in case the
+# machine was just busy
+
+def check(results,baseline,threshold,repeats,retries=2):
+    slower=[]
+    makers=dict(benchmarks)
+    P=None
+    print("%-30s %10s %10s %8s" % ("Helper","us/call","baseline","change"))
+    for name in sorted(results):
+        r=results[name]
+        old=baseline["results"].get(name) if baseline else None
+        if old is not None:
+            limit=old.get("threshold",threshold)
+            for retry in range(retries):
+                if 100.0*(r["relative"]/old["relative"]-1)<=limit: break
+                if P is None: P=makeParser()
+                again=runOne(P,makers[name],repeats)[1]
+                if again["relative"]<r["relative"]: r=results[name]=again
+        line="%-30s %10.3f" % (name,r["seconds"]*1e6)
+        if old is not None:
+            change=100.0*(r["relative"]/old["relative"]-1)
+            line=line+" %10.3f %+7.1f%%" % (old["relative"]*baseline["calibration"]*1e6,change)
+            if change>limit:
+                line=line+"  SLOWER than "+str(limit)+"%"
+                slower.append(name)
+        print(line)
+    return slower
+
+def save(filename,calibration,results,baseline):
+    # keep any thresholds set by hand
+    if baseline is not None:
+        for name,r in results.items():
+            old=baseline["results"].get(name)
+            if old is not None and "threshold" in old: r["threshold"]=old["threshold"]
+    with open(filename,"w") as file:
+        json.dump({
+            "date":time.strftime("%Y-%m-%d %H:%M:%S"),
+            "python":platform.python_version(),
+            "calibration":calibration,
+            "results":results},file,indent=1,sort_keys=True)
+        file.write("\n")
+
+
+if __name__=="__main__":
+    argParser=argparse.ArgumentParser(description="Microbenchmark the KiCadParser helpers.")
+    argParser.add_argument("-k","--keep",action="append",help="only run benchmarks whose name contains this, can be repeated")
+    argParser.add_argument("-r","--repeat",type=int,default=5,help="time this many runs of each helper (default: 5)")
+    argParser.add_argument("-t","--threshold",type=float,default=25.0,help="percentage slowdown counted as a regression (default: 25)")
+    argParser.add_argument("--baseline",default=baselineFile,help="baseline file (default: Benchmarks/micro_baseline.json)")
+    argParser.add_argument("--save",action="store_true",help="make this run the new baseline")
+    args=argParser.parse_args()
+
+    calibration,results=runAll(args.keep,args.repeat)
+    baseline=loadBaseline(args.baseline)
+    slower=check(results,baseline,args.threshold,args.repeat)
+
+    if args.save:
+        save(args.baseline,calibration,results,baseline)
+        print("Baseline saved to",args.baseline)
+        sys.exit(0)
+
+    if baseline is None:
+        print("No baseline in",args.baseline,"- run with --save to make one.")
+    elif slower:
+        print(len(slower),"helper(s) slower than the baseline.")
+        sys.exit(1)
@@ -11,18 +11,50 @@
 #
 
 import copy
+import hashlib
+import json
+import locale
 import math
+import mmap
+import os
 import re
+import time
 import traceback
 import sys
+from array import array
+
+# NumPy is optional. If it is installed the coordinates of a ZONE POLYLIST
+# are scaled and offset as whole arrays, see scaleOffset
+try:
+    import numpy
+except ImportError:
+    numpy=None
+
+# tracemalloc is only used by enableMemoryProfile and isn't in python 2
+try:
+    import tracemalloc
+except ImportError:
+    tracemalloc=None
 
 #
 #
 # This class is just a list of variables which are pushed onto a stack (list)
 # when executing methods which may be re-entered
 #
+# pushing is cheap: the new frame shares the lists and the localVars
+# dictionary with the frame below it and only copies one of them when
+# it needs to change it - see own()
+#
 
 class StateVars():
+    __slots__=("groupList","repeatList","ringList","groupId","repeatId","ringId",
+               "ringX","ringY","ringCx","ringCy","ringRad","ringAngle",
+               "xOrigin","yOrigin","angleOrigin","repeatX","repeatY","repeatAngle",
+               "groupX","groupY","groupAngle","localVars","shared","transform")
+
+    # the containers a new frame shares with the frame it was copied from
+    SHARED=frozenset(("groupList","repeatList","ringList","localVars"))
+
     def __init__(self):
         self.groupList=[]           # groups within groups is possible
         self.repeatList=[]          # nested repeats is possible
@@ -46,6 +78,1168 @@ class StateVars():
         self.groupY=0.0
         self.groupAngle=0.0
         self.localVars={}           # available in repeat loops etc
+        self.shared=frozenset()     # containers not yet copied by this frame
+        self.transform=None         # cached by KiCadParser.updateTransform
+
+    # copy
+    #
+    # returns a new frame with the same values. The cost doesn't depend
+    # on the size of the lists or the number of local variables because
+    # they are shared until the new frame changes them.
+    def copy(self):
+        frame=StateVars.__new__(StateVars)
+        for name in StateVars.__slots__:
+            setattr(frame,name,getattr(self,name))
+        frame.shared=StateVars.SHARED
+        return frame
+
+    # own
+    #
+    # returns the named container ready to be changed, copying it
+    # first if it is still shared with the frame below
+    def own(self,name):
+        value=getattr(self,name)
+        if name in self.shared:
+            value=copy.copy(value)
+            setattr(self,name,value)
+            self.shared=self.shared.difference((name,))
+        return value
+
+#
+# Command holds one compiled line from the position data file
+#
+# the parameters are split once, when the line is compiled, and the
+# handler is looked up once so the bodies of GROUP, REPEAT, RING and
+# USELIST can be executed many times without being re-tokenised
+#
+
+class Command():
+    __slots__=("srcLine","id","params","args","action")
+
+    def __init__(self,srcLine,id,params,args,action):
+        self.srcLine=srcLine        # line number in the .pos file
+        self.id=id                  # command or template Id, stripped
+        self.params=params          # raw parameter text (USELIST needs it)
+        self.args=args              # params split on commas, not stripped
+        self.action=action          # resolved handler
+
+#
+# NumericExpr is the compiled form of a numeric parameter string
+#
+# evalNumericParam compiles each distinct string once. The result is
+# a constant, a single variable lookup or a sum of pre-signed terms.
+# Terms are kept in their original order so the additions happen in
+# exactly the same order as the old token by token evaluation.
+#
+# each term is a tuple (kind,value)
+#   NUMBER  value is the signed float
+#   VAR     value is (varName,negate)
+#   BAD     value is the token which could not be resolved
+#   BADNUMBER value is a token which looks like a number but isn't
+#
+
+class NumericExpr():
+    __slots__=("kind","value","terms")
+
+    CONST=0     # value is the result, may be None
+    VAR=1       # value is (varName,negate)
+    SUM=2       # value is the folded leading constant or None, terms follow
+
+    NUMBER=0
+    BAD=2
+    BADNUMBER=3
+
+    def __init__(self,kind,value,terms=None):
+        self.kind=kind
+        self.value=value
+        self.terms=terms
+
+#
+# Template holds a template file compiled into literal text and
+# placeholder slots
+#
+# the text is split on %NAME% placeholders once when it is loaded.
+# parts holds the literal text with the placeholder names in the odd
+# numbered entries, rendering fills those entries and joins the lot
+# so the template is only copied once per item placed
+#
+
+class Template():
+    __slots__=("id","text","type","parts","slots","names")
+
+    rePlaceholder=re.compile('%([A-Z][A-Z0-9_]*)%')
+    reType=re.compile('^\s*\((\S+)[\s\(]')    # e.g. (module or (gr_text
+
+    def __init__(self,id,text):
+        self.id=id
+        self.text=text
+
+        # templates start (type .... so grab the text after the first (
+        lst=self.reType.findall(text)
+        if len(lst)>0:  self.type=lst[0]
+        else:           self.type=""
+
+        self.parts=self.rePlaceholder.split(text)
+        self.slots=[]
+        for i in range(1,len(self.parts),2):
+            self.slots.append((i,self.parts[i]))
+        self.names=set(name for i,name in self.slots)
+
+    # render
+    #
+    # values is a dictionary of placeholder name to string
+    # placeholders without a value are left empty
+    def render(self,values):
+        parts=self.parts[:]
+        for i,name in self.slots:
+            parts[i]=values.get(name,"")
+        return "".join(parts)
+
+    # bind
+    #
+    # returns a copy of the template with every placeholder filled in from
+    # values except those named in keep, which are left for render. Used
+    # to render the fixed parts of a group body once, see groupInstance
+    def bind(self,values,keep):
+        parts=[self.parts[0]]
+        for i in range(1,len(self.parts),2):
+            name=self.parts[i]
+            if name in keep:
+                parts.append(name)
+                parts.append(self.parts[i+1])
+            else:
+                parts[-1]=parts[-1]+values.get(name,"")+self.parts[i+1]
+
+        t=Template.__new__(Template)
+        t.id=self.id
+        t.text=self.text
+        t.type=self.type
+        t.parts=parts
+        t.slots=[(i,parts[i]) for i in range(1,len(parts),2)]
+        t.names=set(name for i,name in t.slots)
+        return t
+
+    # stream
+    #
+    # like render but a value can also be an iterable of strings, used
+    # for things like zone outlines which can be very long. Returns a
+    # generator. An iterable value can only be used once in the template
+    def stream(self,values):
+        text=[]
+        for i in range(len(self.parts)):
+            if i%2==0:
+                text.append(self.parts[i])
+                continue
+            value=values.get(self.parts[i],"")
+            if type(value) is str:
+                text.append(value)
+                continue
+            if len(text)>0:
+                yield "".join(text)
+                text=[]
+            for x in value: yield x
+        if len(text)>0: yield "".join(text)
+
+#
+# InstanceItem is a line of a GROUP body rendered once, see groupInstance
+#
+# only the placeholders of a MODULE's template which can change from one
+# copy of the group to the next are left: the reference, the position and
+# angle, which are transformed for each copy, and the layer, which could
+# be a variable. A SEGMENT has no template of its own, see Segment. values
+# holds what is needed to make each copy
+#   MODULE   (id,Ref,x,y,angle,Layer)
+#   SEGMENT  (x0,y0,x1,y1,Width,Layer,Net)
+# with the positions and angle in the group's own coordinates and the
+# segment's width and net already written as text.
+#
+
+class InstanceItem():
+    __slots__=("cmd","kind","template","values")
+
+    MODULE=0
+    SEGMENT=1
+
+    def __init__(self,cmd,kind,template,values):
+        self.cmd=cmd
+        self.kind=kind
+        self.template=template
+        self.values=values
+
+#
+# BoardItems are what the drawing handlers produce
+#
+# each holds the numbers as they were worked out, already transformed,
+# and the template it is written with. Nothing is formatted until the
+# item is written out by KiCadParser.output, which calls render with the
+# parser so the numbers are formatted exactly as the handlers used to.
+# Until then the board can be looked at, counted or tidied up without
+# reading back its own text.
+#
+# __slots__ keep them small, a Segment is 88 bytes plus 96 for its four
+# coordinates as the width and layer are shared. They are written as they
+# are produced so only a few are alive at once, SegmentMerge, which has
+# to hold on to all of them, keeps just their numbers in arrays
+#
+
+class BoardItem():
+    __slots__=()
+
+# Segment is always written with the SEGMENT template so, as there can be
+# millions of them, it doesn't keep its own reference to it
+class Segment(BoardItem):
+    __slots__=("x1","y1","x2","y2","width","layer","net")
+
+    def __init__(self,x1,y1,x2,y2,width,layer,net):
+        self.x1=x1
+        self.y1=y1
+        self.x2=x2
+        self.y2=y2
+        self.width=width
+        self.layer=layer
+        self.net=net
+
+    def render(self,parser):
+        Width=self.width
+        if type(Width) is str:
+            # a width which is already text is written as it is, see
+            # renderInstance and segment_rect
+            X1,Y1,X2,Y2=parser.strFloats(self.x1,self.y1,self.x2,self.y2)
+        else:
+            X1,Y1,X2,Y2,Width=parser.strFloats(self.x1,self.y1,self.x2,self.y2,Width)
+        return parser.template["SEGMENT"].render({
+            "XPOS1":X1,
+            "YPOS1":Y1,
+            "XPOS2":X2,
+            "YPOS2":Y2,
+            "LAYER":self.layer,
+            "WIDTH":Width,
+            "NET":parser.strInt(self.net)
+            })
+
+# TrackArc is an arc track, KiCad 6 and later, through three points
+class TrackArc(BoardItem):
+    __slots__=("template","x1","y1","xm","ym","x2","y2","width","layer","net")
+
+    def __init__(self,template,x1,y1,xm,ym,x2,y2,width,layer,net):
+        self.template=template
+        self.x1=x1
+        self.y1=y1
+        self.xm=xm
+        self.ym=ym
+        self.x2=x2
+        self.y2=y2
+        self.width=width
+        self.layer=layer
+        self.net=net
+
+    def render(self,parser):
+        X1,Y1,Xm,Ym,X2,Y2,Width=parser.strFloats(self.x1,self.y1,self.xm,self.ym,self.x2,self.y2,self.width)
+        return self.template.render({
+            "XPOS1":X1,
+            "YPOS1":Y1,
+            "XPOSMID":Xm,
+            "YPOSMID":Ym,
+            "XPOS2":X2,
+            "YPOS2":Y2,
+            "LAYER":self.layer,
+            "WIDTH":Width,
+            "NET":parser.strInt(self.net)
+            })
+
+class Via(BoardItem):
+    __slots__=("template","x","y","size","drill","layerF","layerB","net")
+
+    def __init__(self,template,x,y,size,drill,layerF,layerB,net):
+        self.template=template
+        self.x=x
+        self.y=y
+        self.size=size
+        self.drill=drill
+        self.layerF=layerF
+        self.layerB=layerB
+        self.net=net
+
+    def render(self,parser):
+        return self.template.render({
+            "XPOS":parser.strFloat(self.x),
+            "YPOS":parser.strFloat(self.y),
+            "SIZE":parser.strFloat(self.size),
+            "DRILL":parser.strFloat(self.drill),
+            "LAYERF":self.layerF,
+            "LAYERB":self.layerB,
+            "NET":parser.strInt(self.net)
+            })
+
+# Module is a user component, the template's id is the component id
+class Module(BoardItem):
+    __slots__=("template","ref","x","y","angle","layer")
+
+    def __init__(self,template,ref,x,y,angle,layer):
+        self.template=template
+        self.ref=ref
+        self.x=x
+        self.y=y
+        self.angle=angle
+        self.layer=layer
+
+    def render(self,parser):
+        Xpos,Ypos,Angle=parser.strFloats(self.x,self.y,self.angle)
+        return self.template.render({
+            "REF":self.ref,
+            "XPOS":Xpos,
+            "YPOS":Ypos,
+            "ANGLE":Angle,
+            "LAYER":self.layer
+            })
+
+class GrLine(BoardItem):
+    __slots__=("template","x1","y1","x2","y2","width","layer")
+
+    def __init__(self,template,x1,y1,x2,y2,width,layer):
+        self.template=template
+        self.x1=x1
+        self.y1=y1
+        self.x2=x2
+        self.y2=y2
+        self.width=width
+        self.layer=layer
+
+    def render(self,parser):
+        return self.template.render({
+            "XPOS1":parser.strFloat(self.x1),
+            "YPOS1":parser.strFloat(self.y1),
+            "XPOS2":parser.strFloat(self.x2),
+            "YPOS2":parser.strFloat(self.y2),
+            "WIDTH":parser.strFloat(self.width),
+            "LAYER":self.layer
+            })
+
+# GrArc is KiCad's centre, start point and clockwise angle
+class GrArc(BoardItem):
+    __slots__=("template","cx","cy","x","y","width","layer","angle")
+
+    def __init__(self,template,cx,cy,x,y,width,layer,angle):
+        self.template=template
+        self.cx=cx
+        self.cy=cy
+        self.x=x
+        self.y=y
+        self.width=width
+        self.layer=layer
+        self.angle=angle
+
+    def render(self,parser):
+        return self.template.render({
+            "XPOS1":parser.strFloat(self.cx),
+            "YPOS1":parser.strFloat(self.cy),
+            "XPOS2":parser.strFloat(self.x),
+            "YPOS2":parser.strFloat(self.y),
+            "WIDTH":parser.strFloat(self.width),
+            "LAYER":self.layer,
+            "ANGLE":parser.strFloat(self.angle)
+            })
+
+# GrText justify is the text for the template, e.g. ' (justify left) '
+class GrText(BoardItem):
+    __slots__=("template","justify","angle","x","y","size","thickness","layer","text")
+
+    def __init__(self,template,justify,angle,x,y,size,thickness,layer,text):
+        self.template=template
+        self.justify=justify
+        self.angle=angle
+        self.x=x
+        self.y=y
+        self.size=size
+        self.thickness=thickness
+        self.layer=layer
+        self.text=text
+
+    def render(self,parser):
+        return self.template.render({
+            "JUSTIFY":self.justify,
+            "ANGLE":parser.strFloat(self.angle),
+            "XPOS":parser.strFloat(self.x),
+            "YPOS":parser.strFloat(self.y),
+            "SIZE":parser.strFloat(self.size),
+            "THICKNESS":parser.strFloat(self.thickness),
+            "LAYER":self.layer,
+            "TEXT":self.text
+            })
+
+# Zone is a zone or keepout, depending on the template. The outline
+# is held as arrays of x and y which can be very long so it is
+# written out a piece at a time by stream rather than render
+class Zone(BoardItem):
+    __slots__=("template","net","netName","layer","hatchType","hatchEdge","clearance","minThickness",
+               "arcSegments","thermalGap","thermalBridgeWidth","xs","ys")
+
+    def __init__(self,template,net,netName,layer,hatchType,hatchEdge,clearance,minThickness,
+                 arcSegments,thermalGap,thermalBridgeWidth,xs,ys):
+        self.template=template
+        self.net=net
+        self.netName=netName
+        self.layer=layer
+        self.hatchType=hatchType
+        self.hatchEdge=hatchEdge
+        self.clearance=clearance
+        self.minThickness=minThickness
+        self.arcSegments=arcSegments
+        self.thermalGap=thermalGap
+        self.thermalBridgeWidth=thermalBridgeWidth
+        self.xs=xs
+        self.ys=ys
+
+    def stream(self,parser):
+        HatchEdge,Clearance,MinThickness,ThermalGap,ThermalBridgeWidth=parser.strFloats(
+            self.hatchEdge,self.clearance,self.minThickness,self.thermalGap,self.thermalBridgeWidth)
+
+        # the XY points are a series of coords like this: (xy 1.25 5.76)
+        return self.template.stream({
+            "NET":str(self.net),
+            "NETNAME":self.netName,
+            "LAYER":self.layer,
+            "HATCHTYPE":self.hatchType,
+            "HATCHEDGE":HatchEdge,
+            "CLEARANCE":Clearance,
+            "MINTHICKNESS":MinThickness,
+            "ARCSEGMENTS":parser.strInt(self.arcSegments),
+            "THERMALGAP":ThermalGap,
+            "THERMALBRIDGEWIDTH":ThermalBridgeWidth,
+            "XYPOINTS":parser.xyPointsItems(self.xs,self.ys)
+            })
+
+    def render(self,parser):
+        return "".join(self.stream(parser))
+
+#
+# SegmentMerge tidies up the track segments, see KiCadParser.enableSegmentMerge
+#
+# collect holds back the Segments written by output() and items() gives
+# them back, once the board is finished, with
+#   zero length segments dropped
+#   exact duplicates dropped, either way round
+#   collinear segments which touch or overlap joined into one
+# segments are only joined if they have the same layer, width and net.
+#
+# everything is compared as it will be written out, so two ends are the
+# same point if their coordinates are written the same. The written
+# coordinates are taken as whole numbers of the last decimal place, which
+# lets the lines segments lie on be hashed exactly by their direction and
+# offset. Segments which can't be handled this way, say because a
+# coordinate isn't a number, are only checked for duplicates and come
+# last.
+#
+# segments not joined to anything are written as they were. The order is
+# that of the first segment on each line.
+#
+
+class SegmentMerge():
+
+    def __init__(self):
+        self.clear()
+        self.received=0
+        self.zeroLength=0
+        self.duplicates=0
+        self.joined=0
+        self.written=0
+
+    # clear empties the store of segments held back. There is a column
+    # for each end and the index in groups of their (width,layer,net) so
+    # a million of them take about 36MB rather than the 190MB of the
+    # Segments themselves
+    def clear(self):
+        self.x1=array("d")
+        self.y1=array("d")
+        self.x2=array("d")
+        self.y2=array("d")
+        self.group=array("i")
+        self.groups=[]          # (width,layer,net)
+        self.groupIndex={}      # (width,layer,net):index in groups
+        self.others=[]          # Segments with ends which aren't numbers
+
+    # collect
+    # generator which passes on everything but the Segments. The line
+    # break before each Segment is dropped with it. The profile is told
+    # the Segments won't be written as they are
+    def collect(self,items,profile=None):
+        pending=False   # a line break waiting to see what follows it
+        for x in items:
+            if type(x) is Segment:
+                self.hold(x)
+                if profile is not None: profile.written(x,0)
+                pending=False
+            elif type(x) is str and x=="\n":
+                if pending: yield x
+                pending=True
+            else:
+                if pending: yield "\n"
+                pending=False
+                yield x
+        if pending: yield "\n"
+
+    def hold(self,s):
+        for v in (s.x1,s.y1,s.x2,s.y2):
+            if type(v) is not float and type(v) is not int:
+                self.others.append(s)
+                return
+        key=(s.width,s.layer,s.net)
+        g=self.groupIndex.get(key)
+        if g is None:
+            g=self.groupIndex[key]=len(self.groups)
+            self.groups.append(key)
+        self.x1.append(s.x1)
+        self.y1.append(s.y1)
+        self.x2.append(s.x2)
+        self.y2.append(s.y2)
+        self.group.append(g)
+
+    # items
+    #
+    # generator for the merged segments, each after a line break
+    #
+    # segments are compared as they will be written. Those on the same
+    # line are kept as spans (t0,t1,k) where t0 and t1 are how far along
+    # the line the ends are and k is twice the index of the segment, plus
+    # one if it runs the other way. Sorted, a duplicate follows the first
+    # segment it copies
+    def items(self,parser):
+        x1,y1,x2,y2,group,groups,others=self.x1,self.y1,self.x2,self.y2,self.group,self.groups,self.others
+        self.clear()
+        self.received=self.received+len(group)+len(others)
+
+        # segments with the same written width, layer and net can be merged
+        groupText={}
+        groupKey=[]
+        for width,layer,net in groups:
+            key=(layer,parser.strFloat(width),parser.strInt(net))
+            groupKey.append(groupText.setdefault(key,key))
+
+        lines={}    # line key:[(t0,t1,k)]
+        for i in range(len(group)):
+            X1,Y1,X2,Y2=parser.strFloats(x1[i],y1[i],x2[i],y2[i])
+            if X1==X2 and Y1==Y2:
+                self.zeroLength=self.zeroLength+1
+                continue
+            try:
+                ax,ay,bx,by=[int(v.replace(".","")) for v in (X1,Y1,X2,Y2)]
+            except ValueError:
+                others.append(Segment(x1[i],y1[i],x2[i],y2[i],*groups[group[i]]))
+                continue
+
+            # the direction, made as small as it will go and pointing
+            # right or up, and the offset of the line from 0,0
+            dx,dy=bx-ax,by-ay
+            g=self.gcd(abs(dx),abs(dy))
+            dx,dy=dx//g,dy//g
+            if dx<0 or (dx==0 and dy<0): dx,dy=-dx,-dy
+            line=(groupKey[group[i]],dx,dy,dy*ax-dx*ay)
+
+            # how far along the line each end is
+            ta,tb=ax*dx+ay*dy,bx*dx+by*dy
+            span=(ta,tb,2*i) if ta<=tb else (tb,ta,2*i+1)
+            if line in lines:
+                lines[line].append(span)
+            else:
+                lines[line]=[span]
+
+        for spans in lines.values():
+            spans.sort()
+            t0,t1,k0=spans[0]
+            k1=k0       # the segment which reaches furthest
+            count=1
+            previous=spans[0]
+            for span in spans[1:]:
+                if span[0]==previous[0] and span[1]==previous[1]:
+                    self.duplicates=self.duplicates+1
+                    continue
+                previous=span
+                if span[0]<=t1:
+                    # touches or overlaps the one before
+                    if span[1]>t1: t1,k1=span[1],span[2]
+                    count=count+1
+                    continue
+                for x in self.span(k0,k1,count,x1,y1,x2,y2,groups[group[k0>>1]]): yield x
+                t0,t1,k0=span
+                k1=k0
+                count=1
+            for x in self.span(k0,k1,count,x1,y1,x2,y2,groups[group[k0>>1]]): yield x
+
+        # these are written as they are, less any duplicates
+        seen=set()
+        for s in others:
+            key=tuple(parser.strFloats(s.x1,s.y1,s.x2,s.y2,s.width))+(s.layer,parser.strInt(s.net))
+            if key[0:2]==key[2:4]:
+                self.zeroLength=self.zeroLength+1
+                continue
+            end0,end1=key[0:2],key[2:4]
+            key=key[4:]+((end0,end1) if end0<end1 else (end1,end0))
+            if key in seen:
+                self.duplicates=self.duplicates+1
+                continue
+            seen.add(key)
+            self.written=self.written+1
+            yield "\n"
+            yield s
+
+    # span gives a segment from the start of span k0 to the end of span
+    # k1, made from count segments, with the width, layer and net of k0
+    def span(self,k0,k1,count,x1,y1,x2,y2,widthLayerNet):
+        self.written=self.written+1
+        yield "\n"
+        i,j=k0>>1,k1>>1
+        if count==1:
+            yield Segment(x1[i],y1[i],x2[i],y2[i],*widthLayerNet)
+            return
+        self.joined=self.joined+count-1
+        end0=(x2[i],y2[i]) if k0&1 else (x1[i],y1[i])
+        end1=(x1[j],y1[j]) if k1&1 else (x2[j],y2[j])
+        yield Segment(end0[0],end0[1],end1[0],end1[1],*widthLayerNet)
+    def gcd(self,a,b):
+        while b: a,b=b,a%b
+        return a
+
+    def report(self):
+        return ("Segments: "+str(self.received)+" in, "+str(self.written)+" out, "+
+                str(self.zeroLength)+" zero length, "+str(self.duplicates)+" duplicates, "+
+                str(self.joined)+" joined")
+
+#
+# UseListLine is a USELIST body line compiled for substitution
+#
+# each argument is broken into literal parts and %n% slots once, when the
+# USELIST is run, so each row of the list only has to be bound into the
+# slots. Placeholders for columns the row doesn't have are left as they are.
+#
+# this gives the same result as useListHelper unless the line has other %
+# characters, placeholders with only digits between them (replacing one
+# can make another, e.g. %1%0%) or the values contain % or commas. exact
+# is False for such lines and useListItems falls back to useListHelper.
+#
+
+class UseListLine():
+    __slots__=("cmd","args","exact")
+
+    rePlaceholder=re.compile('%(0|[1-9][0-9]*)%')
+
+    def __init__(self,cmd):
+        self.cmd=cmd
+        self.args=[self.compileArg(arg) for arg in cmd.args]
+        self.exact=self.isExact(cmd.params)
+
+    def isExact(self,params):
+        if "%" in self.rePlaceholder.sub("",params): return False
+        end=None
+        for m in self.rePlaceholder.finditer(params):
+            if end is not None:
+                gap=params[end:m.start()]
+                if gap=="" or gap.isdigit(): return False
+            end=m.end()
+        return True
+
+    # compileArg returns the argument unchanged if it has no placeholders
+    # otherwise a tuple (parts,slots) like a Template
+    def compileArg(self,arg):
+        parts=[]
+        slots=[]
+        pos=0
+        for m in self.rePlaceholder.finditer(arg):
+            parts.append(arg[pos:m.start()])
+            slots.append((len(parts),int(m.group(1))))
+            parts.append(m.group(0))
+            pos=m.end()
+        if len(slots)==0: return arg
+        parts.append(arg[pos:])
+        return parts,slots
+
+    # bind returns the arguments for one row of the list
+    def bind(self,row):
+        n=len(row)
+        args=[]
+        for arg in self.args:
+            if type(arg) is str:
+                args.append(arg)
+                continue
+            parts,slots=arg
+            parts=parts[:]
+            for i,x in slots:
+                if x<n: parts[i]=row[x]
+            args.append("".join(parts))
+        return args
+
+#
+# FloatFormat formats numbers for the kicad_pcb file
+#
+# the text is exactly what '{:.4f}'.format() gives (or whatever the
+# precision is) but many values can be formatted by a single % operation.
+# Renderers which need several values pass them all to formatMany
+#
+# fill is for longer layouts, like zone outlines, built with slot in
+# place of each number
+#
+
+class FloatFormat():
+    __slots__=("precision","fmtFloat","pctFloat","slot","many")
+
+    def __init__(self,precision=4):
+        self.precision=precision
+        self.fmtFloat="{:."+str(precision)+"f}"  # for str.format
+        self.pctFloat="%."+str(precision)+"f"    # same text using %
+        self.slot=self.pctFloat                  # see fill
+        self.many={}                             # format strings for formatMany by count
+
+    def format(self,value):
+        return self.pctFloat % value
+
+    # formatMany returns a list of strings. values is a tuple of floats or ints
+    def formatMany(self,values):
+        fmt=self.many.get(len(values))
+        if fmt is None:
+            fmt="|".join([self.pctFloat]*len(values))
+            self.many[len(values)]=fmt
+        return (fmt % values).split("|")
+
+    def fill(self,layout,values):
+        return layout % tuple(values)
+
+#
+# NanometreFormat is used instead of FloatFormat in nanometre mode
+#
+# each value is rounded to a whole number of nanometres, as KiCad holds
+# them, and that integer is written out with the decimal point put in.
+# Halves are rounded away from zero when the precision is less than 6
+# decimal places and -0 is written without the sign.
+#
+
+NM_PER_MM=1000000
+
+class NanometreFormat(FloatFormat):
+    __slots__=()
+
+    def __init__(self,precision=4):
+        FloatFormat.__init__(self,precision)
+        self.slot="%s"
+
+    def format(self,value):
+        try:
+            nm=int(round(value*NM_PER_MM))
+        except (OverflowError,ValueError):
+            # inf or nan
+            return self.pctFloat % value
+
+        # number of units of the last decimal place
+        if self.precision>=6:
+            units=abs(nm)*10**(self.precision-6)
+        else:
+            div=10**(6-self.precision)
+            units,rem=divmod(abs(nm),div)
+            if 2*rem>=div: units=units+1
+
+        sign="-" if nm<0 and units>0 else ""
+        if self.precision==0: return sign+str(units)
+        whole,frac=divmod(units,10**self.precision)
+        return sign+str(whole)+"."+str(frac).zfill(self.precision)
+
+    def formatMany(self,values):
+        return [self.format(x) for x in values]
+
+    def fill(self,layout,values):
+        return layout % tuple(self.formatMany(values))
+
+#
+# ListFile is a list loaded by the LIST command
+#
+# the file isn't read when the LIST command is processed. Each time the
+# list is used the file is memory mapped and the rows are split one at a
+# time as they are needed, then the mapping is closed again, so even very
+# large lists don't have to be held in memory.
+#
+# iterating gives each row as a list of strings, numericColumns gives
+# whole columns as array('d')
+#
+
+class ListFile():
+    __slots__=("filename","sep","encoding")
+
+    def __init__(self,filename,sep):
+        if sep=="": raise ValueError("empty separator")
+        if not os.path.isfile(filename): raise IOError("No such file",filename)
+        self.filename=filename
+        self.sep=sep
+        self.encoding=locale.getpreferredencoding(False) # same as open()
+
+    def __iter__(self):
+        with open(self.filename,"rb") as file:
+            size=os.fstat(file.fileno()).st_size
+            if size==0: return  # can't map an empty file
+            data=mmap.mmap(file.fileno(),0,access=mmap.ACCESS_READ)
+            try:
+                start=0
+                while start<size:
+                    end=data.find(b"\n",start)
+                    if end<0: end=size
+                    text=data[start:end].decode(self.encoding)
+                    start=end+1
+
+                    # a lone \r also ends a line, as it does for open()
+                    for line in text.split("\r"):
+                        # clean up input
+                        line = line.strip()
+                        # ignore comments and blank lines
+                        # ORDER MATTERS !
+                        if (line == "") or (line[0] == "#"): continue
+                        yield [x.strip() for x in line.split(self.sep)]
+            finally:
+                data.close()
+
+    # numericColumns
+    # returns n arrays of floats, one for each column. Every row must
+    # have exactly n columns
+    def numericColumns(self,n):
+        columns=[array("d") for x in range(n)]
+        for row in self:
+            if len(row)!=n:
+                raise ValueError("expected "+str(n)+" values in list row, got "+str(len(row)))
+            for column,x in zip(columns,row):
+                column.append(float(x))
+        return columns
+
+    # stamp changes if the file is changed
+    def stamp(self):
+        st=os.stat(self.filename)
+        return os.path.abspath(self.filename),st.st_size,st.st_mtime
+
+#
+# CommandCache holds the output of top level drawing commands between runs
+#
+# see KiCadParser.executeCached. Each entry is keyed by a fingerprint of
+# the command and is only replayed if the templates and lists it used
+# and the reference numbers it started from are unchanged.
+#
+# entries not used during a run are dropped when the cache is saved
+#
+
+class CommandCache():
+
+    def __init__(self,filename):
+        self.filename=filename
+        self.entries={}
+        self.used={}
+        self.hits=0
+        self.misses=0
+        try:
+            with open(filename,"r") as file:
+                self.entries=json.load(file)
+        except (IOError,OSError,ValueError):
+            # no cache yet or it is unreadable - start again
+            self.entries={}
+
+    def get(self,key):
+        return self.entries.get(key)
+
+    def put(self,key,entry):
+        self.used[key]=entry
+
+    def save(self):
+        with open(self.filename,"w") as file:
+            json.dump(self.used,file)
+
+#
+# CommandProfile collects timings for KiCadParser.enableProfile
+#
+# stats are kept for each command id and for each GROUP, REPEAT, RING
+# and USELIST instance, keyed like 'RING RING1 line 42'. For each key
+#   calls       number of times the command was executed
+#   cumulative  seconds spent in it including the commands it ran
+#   self        the same excluding the commands it ran
+#   items       strings and BoardItems it produced, not counting line breaks
+#   bytes       length of the text it produced. BoardItems become text
+#               when they are written so are counted then, against every
+#               command they came through, see KiCadParser.serialise.
+#               Segments joined up by --merge aren't counted
+#
+# the output of blocks like RING is produced as it is written so their
+# generators are timed each time they are resumed
+#
+
+class CommandProfile():
+
+    # perf_counter isn't in python 2
+    clock=getattr(time,"perf_counter",time.time)
+
+    def __init__(self):
+        self.stats={}
+        self.stack=[]   # time used by the commands run by each active command
+        self.unwritten={}   # id of a BoardItem:(BoardItem,keys it came through)
+
+    def begin(self):
+        self.stack.append(0.0)
+        return self.clock()
+
+    def end(self,keys,start,calls=0,items=0,nbytes=0):
+        elapsed=self.clock()-start
+        child=self.stack.pop()
+        if len(self.stack)>0: self.stack[-1]=self.stack[-1]+elapsed
+
+        for key in keys:
+            s=self.stats.get(key)
+            if s is None:
+                s=self.stats[key]=[0,0.0,0.0,0,0]
+            s[0]=s[0]+calls
+            s[1]=s[1]+elapsed
+            s[2]=s[2]+elapsed-child
+            s[3]=s[3]+items
+            s[4]=s[4]+nbytes
+
+    # items wraps the generator returned by a handler
+    def items(self,result,keys):
+        result=iter(result)
+        while True:
+            start=self.begin()
+            try:
+                x=next(result)
+            except StopIteration:
+                self.end(keys,start)
+                return
+            except Exception:
+                self.end(keys,start)
+                raise
+            if type(x) is str:
+                self.end(keys,start,0,0 if x=="\n" else 1,len(x))
+            else:
+                self.end(keys,start,0,1)
+                entry=self.unwritten.get(id(x))
+                if entry is None:
+                    self.unwritten[id(x)]=(x,list(keys))
+                else:
+                    entry[1].extend(keys)
+            yield x
+
+    # written adds the length of a BoardItem's text to the commands it
+    # came through. The item is kept in unwritten until then so its id
+    # can't be reused
+    def written(self,x,nbytes):
+        entry=self.unwritten.pop(id(x),None)
+        if entry is None: return
+        for key in entry[1]:
+            s=self.stats[key]
+            s[4]=s[4]+nbytes
+
+    # getStats returns {key:{"calls":..,"cumulative":..,"self":..,"items":..,"bytes":..}}
+    def getStats(self):
+        stats={}
+        for key,s in self.stats.items():
+            stats[key]={"calls":s[0],"cumulative":s[1],"self":s[2],"items":s[3],"bytes":s[4]}
+        return stats
+
+    # report returns the stats as a table, most self time first
+    def report(self):
+        keys=sorted(self.stats,key=lambda k:-self.stats[k][2])
+        width=max([len(k) for k in keys]+[7])
+        lines=["Command".ljust(width)+"    Calls  Cumulative        Self     Items       Bytes"]
+        for key in keys:
+            calls,cumulative,own,items,nbytes=self.stats[key]
+            lines.append(key.ljust(width)+" "+str(calls).rjust(8)+" "+("%.4fs" % cumulative).rjust(11)+" "+
+                         ("%.4fs" % own).rjust(11)+" "+str(items).rjust(9)+" "+str(nbytes).rjust(11))
+        return "\n".join(lines)
+
+#
+# TraceRecorder records a Chrome trace-event file, see KiCadParser.enableTrace
+#
+# there is a span for every command executed and for every iteration of
+# a GROUP, REPEAT, RING or USELIST. Spans are tagged with the .pos line,
+# the block id and the iteration they ran in. The events are kept in
+# memory and written once by write() so recording them costs little.
+# Load the file in chrome://tracing or https://ui.perfetto.dev
+#
+
+class TraceRecorder():
+
+    # perf_counter isn't in python 2
+    clock=getattr(time,"perf_counter",time.time)
+
+    def __init__(self):
+        self.events=[]      # (name,category,start,duration,args)
+        self.blocks=[]      # (blockId,iteration) of the iterations running
+        self.origin=self.clock()
+
+    def now(self):
+        return self.clock()
+
+    def span(self,name,category,start,args):
+        self.events.append((name,category,start,self.clock()-start,args))
+
+    # args for a command span
+    def commandArgs(self,cmd):
+        args={"line":cmd.srcLine}
+        if len(self.blocks)>0:
+            args["block"],args["iteration"]=self.blocks[-1]
+        return args
+
+    # items wraps the generator returned by a handler, the span covers
+    # the whole time the output is being produced
+    def items(self,result,name,start,args):
+        try:
+            for x in result: yield x
+        finally:
+            self.span(name,"command",start,args)
+
+    def beginIteration(self,blockId,index):
+        self.blocks.append((blockId,index))
+        return self.clock()
+
+    def endIteration(self,kind,line,start):
+        blockId,index=self.blocks.pop()
+        self.span(kind+" "+blockId+" #"+str(index),"iteration",start,
+                  {"line":line,"block":blockId,"iteration":index})
+
+    def write(self,filename):
+        pid=os.getpid()
+        events=[]
+        for name,category,start,duration,args in self.events:
+            events.append({"name":name,"cat":category,"ph":"X","pid":pid,"tid":0,
+                           "ts":(start-self.origin)*1e6,"dur":duration*1e6,"args":args})
+        with open(filename,"w") as file:
+            json.dump({"traceEvents":events,"displayTimeUnit":"ms"},file)
+
+#
+# MemoryProfile measures memory use for KiCadParser.enableMemoryProfile
+#
+# tracemalloc is read before and after every command executed, including
+# the commands run inside a GROUP, REPEAT, RING or USELIST. Stats are kept
+# for each .pos line, keyed like 'line 42 SEGMENT', and for each block
+# instance, keyed like 'RING RING1 line 42'. For each key
+#   calls   number of times the command was executed
+#   peak    most memory in use above what it started with, bytes
+#   net     memory still in use when it finished, bytes, added up
+#           over all the calls
+#
+# blocks are generators so they are measured each time they are resumed.
+# Memory kept between commands, the templates, lists and stored block
+# bodies, is reported separately by resident()
+#
+
+class MemoryProfile():
+
+    def __init__(self):
+        self.stats={}
+        self.stack=[]   # [start,peak] for each active command
+        self.started=not tracemalloc.is_tracing()
+        if self.started: tracemalloc.start()
+
+    def stop(self):
+        if self.started: tracemalloc.stop()
+        self.started=False
+
+    # the peak seen so far is passed up to the enclosing command before
+    # tracemalloc's peak is reset for this one. Returns the memory in use
+    def begin(self):
+        current,peak=tracemalloc.get_traced_memory()
+        if len(self.stack)>0 and peak>self.stack[-1][1]: self.stack[-1][1]=peak
+        tracemalloc.reset_peak()
+        self.stack.append([current,current])
+        return current
+
+    # end returns the memory in use and the peak since begin
+    def end(self):
+        current,peak=tracemalloc.get_traced_memory()
+        highest=self.stack.pop()[1]
+        if highest>peak: peak=highest
+        if len(self.stack)>0 and peak>self.stack[-1][1]: self.stack[-1][1]=peak
+        tracemalloc.reset_peak()
+        return current,peak
+
+    def record(self,keys,calls,peak,net):
+        for key in keys:
+            s=self.stats.get(key)
+            if s is None:
+                s=self.stats[key]=[0,0,0]
+            s[0]=s[0]+calls
+            if peak>s[1]: s[1]=peak
+            s[2]=s[2]+net
+
+    # items wraps the generator returned by a handler. Its net is taken
+    # from when it is first resumed to when it finishes, by which time
+    # the strings it produced have been written and freed
+    def items(self,result,keys):
+        result=iter(result)
+        first=None
+        highest=0
+        while True:
+            start=self.begin()
+            if first is None: first=start
+            try:
+                x=next(result)
+            except StopIteration:
+                current,peak=self.end()
+                self.record(keys,0,max(highest,peak)-first,current-first)
+                return
+            except Exception:
+                current,peak=self.end()
+                self.record(keys,0,max(highest,peak)-first,current-first)
+                raise
+            current,peak=self.end()
+            if peak>highest: highest=peak
+            yield x
+
+    # resident returns [(name,bytes)] for the data a parser keeps between commands
+    def resident(self,parser):
+        return [("templates",sizeOf(parser.template)),
+                ("asis",sizeOf(parser.asis)),
+                ("lists",sizeOf(parser.list)),
+                ("GROUP bodies",sizeOf(parser.group)),
+                ("REPEAT bodies",sizeOf(parser.repeat)),
+                ("RING bodies",sizeOf(parser.ring))]
+
+    # getStats returns {key:{"calls":..,"peak":..,"net":..}}
+    def getStats(self):
+        stats={}
+        for key,s in self.stats.items():
+            stats[key]={"calls":s[0],"peak":s[1],"net":s[2]}
+        return stats
+
+    # report returns the stats as a table, highest peak first, followed
+    # by the resident data of the parser
+    def report(self,parser):
+        keys=sorted(self.stats,key=lambda k:-self.stats[k][1])
+        width=max([len(k) for k in keys]+[13])
+        lines=["Command".ljust(width)+"    Calls     Peak KB      Net KB"]
+        for key in keys:
+            calls,peak,net=self.stats[key]
+            lines.append(key.ljust(width)+" "+str(calls).rjust(8)+" "+("%.1f" % (peak/1024.0)).rjust(11)+" "+
+                         ("%.1f" % (net/1024.0)).rjust(11))
+        lines.append("")
+        lines.append("Resident data".ljust(width)+"              Size KB")
+        for name,size in self.resident(parser):
+            lines.append(name.ljust(width)+" "+("%.1f" % (size/1024.0)).rjust(20))
+        return "\n".join(lines)
+
+# sizeOf
+#
+# rough size in bytes of an object and everything it refers to, counting
+# shared objects once. Used for the resident data of a MemoryProfile
+
+def sizeOf(obj,seen=None):
+    if seen is None: seen=set()
+    if id(obj) in seen: return 0
+    seen.add(id(obj))
+
+    size=sys.getsizeof(obj)
+    if isinstance(obj,dict):
+        for k,v in obj.items():
+            size=size+sizeOf(k,seen)+sizeOf(v,seen)
+    elif isinstance(obj,(list,tuple,set,frozenset)):
+        for x in obj:
+            size=size+sizeOf(x,seen)
+    elif isinstance(obj,(str,bytes,int,float,array)) or callable(obj):
+        pass
+    else:
+        for name in getattr(type(obj),"__slots__",()):
+            size=size+sizeOf(getattr(obj,name,None),seen)
+        if hasattr(obj,"__dict__"):
+            size=size+sizeOf(obj.__dict__,seen)
+    return size
+
 #
 # KiCadParser class
 #
@@ -58,9 +1252,26 @@ class StateVars():
 class KiCadParser():
 
 
-    def __init__(self):
+    # fileCache can be a dictionary shared by a number of parsers, for
+    # example when building several boards one after another, so the
+    # template files are only read from disk once. See readFile
+
+    def __init__(self,fileCache=None):
 
+        self.fileCache=fileCache
+        self.profile=None       # see enableProfile
+        self.trace=None         # see enableTrace
+        self.memory=None        # see enableMemoryProfile
+        self.segmentMerge=None  # see enableSegmentMerge
+        self.arcTracks=False    # see setArcTracks
+        self.arcTrackMaxStep=10.0       # degrees, see setArcTracks
+        self.arcTrackVersion=20211014   # KiCad 6.0, the first with arc tracks
+        self.arcTrackFallback=False     # warned that segments are used instead
+        self.boardVersion=None  # file version of the kicad_pcb header, see noteBoardVersion
+        self.instrument=False   # any of them is on
         self.template={}        # dictionary holds the templates
+        self.resourceHashes={}  # content hash of each template and list, see executeCached
+        self.resourcesUsed=None # set of resources used by the command being cached
         self.asis={}            # dictionary for static stuff
         self.srcLine=0          # for reporting where something went wrong
 
@@ -68,6 +1279,11 @@ class KiCadParser():
         self.group={}           # group definitions
         self.makingGroup=False
         self.processingGroup=False
+        self.instanceGroups=True    # see groupInstance
+        self.groupInstances={}      # groupId:(groupList,floatFormat,items)
+
+        self.mouseBiteDrill=0.5     # size and spacing of the mouse bite holes
+        self.mouseBitePitch=0.8
 
         # rings of components
         self.makingRing=False
@@ -99,8 +1315,13 @@ class KiCadParser():
         self.globalVars["yOrigin"]=0
         #
         self.saveXYVars={}      # used for linking segments in rings etc
+        self.reSaveXYVars=None  # matches any saveXYVars name, rebuilt when a name is added
         # formatting strings
-        self.fmtFloat="{:.4f}"  # used for building X,Y coords strings
+        self.nanometres=False   # see setNanometres
+        self.floatFormat=FloatFormat(4)
+        self.fmtFloat=self.floatFormat.fmtFloat  # used for building X,Y coords strings
+
+        self.useNumpy=numpy is not None     # see scaleOffset
 
         self.directionX=1       # Kicad X direction is left to right
         self.directionY=-1      # Kicad Y direction is top down
@@ -115,9 +1336,46 @@ class KiCadParser():
         self.reFloat=re.compile('[+-]?\d*\.\d+')            # could be like .5  but 99. is not acceptable
         self.reItem=re.compile('[+-]?[0-9A-Za-z_.]*')       # almost anything - used to dissect an expression
         self.reVarName=re.compile('[A-Za-z]+[0-9A-Za-z_]*') # var named MUST start with a letter for the sake of sanity
+        self.reBoardVersion=re.compile('^\s*\(?\s*kicad_pcb\s+\(version\s+([0-9]+)\s*\)')  # see noteBoardVersion
+        #
+        # compiled numeric parameters, see compileNumericParam
+        self.exprCache={}
+        self.exprCacheSize=4096  # oldest entries are dropped beyond this
+        self.exprCacheHits=0
+        self.exprCacheMisses=0
         #
         self.zoneTemplate="ZONE" # changes if KEEPOUT is called
 
+        # placeholders each template can use - checked by loadTemplate
+        # the standard templates are known by Id, anything else by
+        # its type e.g. a user component is a (module
+        self.templatePlaceholders={}
+        self.templatePlaceholders["SEGMENT"]=("XPOS1","YPOS1","XPOS2","YPOS2","LAYER","WIDTH","NET")
+        self.templatePlaceholders["ARCTRACK"]=("XPOS1","YPOS1","XPOSMID","YPOSMID","XPOS2","YPOS2","LAYER","WIDTH","NET")
+        self.templatePlaceholders["VIA"]=("XPOS","YPOS","SIZE","DRILL","LAYERF","LAYERB","NET")
+        self.templatePlaceholders["TARGET"]=("XPOS","YPOS","SHAPE","SIZE","WIDTH","LAYER")
+        self.templatePlaceholders["FIDUCIAL"]=("REF","XPOS","YPOS","CLEARANCE","WIDTH","LAYER")
+        self.templatePlaceholders["MOUNT"]=("REF","XPOS","YPOS","DRILL","INNERWIDTH","OUTERWIDTH","OUTERRADIUS")
+        self.templatePlaceholders["GRLINE"]=("XPOS1","YPOS1","XPOS2","YPOS2","WIDTH","LAYER")
+        self.templatePlaceholders["GRCIRCLE"]=("XPOS1","YPOS1","XPOS2","YPOS2","WIDTH","LAYER")
+        self.templatePlaceholders["GRARC"]=("XPOS1","YPOS1","XPOS2","YPOS2","WIDTH","LAYER","ANGLE")
+        self.templatePlaceholders["GRTEXT"]=("JUSTIFY","ANGLE","XPOS","YPOS","SIZE","THICKNESS","LAYER","TEXT")
+        self.templatePlaceholders["ZONE"]=("NET","NETNAME","LAYER","HATCHTYPE","HATCHEDGE","CLEARANCE","MINTHICKNESS",
+                                           "ARCSEGMENTS","THERMALGAP","THERMALBRIDGEWIDTH","XYPOINTS")
+        self.templatePlaceholders["KEEPOUT"]=self.templatePlaceholders["ZONE"]
+
+        self.typePlaceholders={}
+        self.typePlaceholders["module"]=("REF","XPOS","YPOS","ANGLE","LAYER")
+        self.typePlaceholders["segment"]=self.templatePlaceholders["SEGMENT"]
+        self.typePlaceholders["arc"]=self.templatePlaceholders["ARCTRACK"]
+        self.typePlaceholders["via"]=self.templatePlaceholders["VIA"]
+        self.typePlaceholders["target"]=self.templatePlaceholders["TARGET"]
+        self.typePlaceholders["gr_line"]=self.templatePlaceholders["GRLINE"]
+        self.typePlaceholders["gr_circle"]=self.templatePlaceholders["GRCIRCLE"]
+        self.typePlaceholders["gr_arc"]=self.templatePlaceholders["GRARC"]
+        self.typePlaceholders["gr_text"]=self.templatePlaceholders["GRTEXT"]
+        self.typePlaceholders["zone"]=self.templatePlaceholders["ZONE"]
+
         # action jump table - gets rid of a long if-elif chain
         self.actions={}
         self.actions["TEMPLATE"]=self.loadTemplate
@@ -132,6 +1390,7 @@ class KiCadParser():
         self.actions["DEFRING"]=self.defRing
         self.actions["ENDRING"]=self.endRing
         self.actions["RING"] = self.processRing
+        self.actions["PANEL"] = self.processPanel
         self.actions["TRACK"]=self.segment
         self.actions["SEGMENT"]=self.segment
         self.actions["GRAPHIC"]=self.graphic
@@ -155,35 +1414,421 @@ class KiCadParser():
         self.actions["SHOWVARS"]=self.showVars
         self.actions["KICADPCB"]=self.loadKicadPcb
 
+        # drawing commands which executeCached can replay from the cache
+        # user defined components are also cached
+        self.cacheableIds=set(("TRACK","SEGMENT","GRAPHIC","TARGET","VIA","FIDUCIAL","MOUNT","ZONE","KEEPOUT"))
+
+        # commands which start or end collecting a block body
+        self.blockIds=set(("DEFGROUP","ENDGROUP","DEFREPEAT","ENDREPEAT","DEFRING","ENDRING","USELIST","ENDUSELIST"))
+
+
+
+
+
+    # compile
+    #
+    # turns one line of the position data file into a Command
+    # the handler is resolved from the jump table here, anything
+    # not in the table is a user defined component
+
+    def compile(self,srcLine,id,params):
+        id=id.strip()
+        action=self.actions.get(id,self.component)
+        return Command(srcLine,id,params,params.split(","),action)
+
+    # compileLines
+    #
+    # generator which compiles the lines of a position data file
+    # comments and blank lines are dropped and STOP ends the file
+
+    def compileLines(self,lines):
+        srcLine=0
+        for line in lines:
+            srcLine=srcLine+1
 
+            # clean up input
+            line=line.strip()
 
+            # ignore comments and blank lines
+            # ORDER MATTERS !
+            if (line=="") or (line[0]=="#"): continue
 
+            # split(",",1) throws a wobbly
+            # but partition is happy
+            D=line.partition(",")
+            if D[0].upper().strip()=="STOP": return
 
-    # parse routes the data to the appropriate routine
-    # using the jump table all calls go through here first
+            yield self.compile(srcLine,D[0],D[2])
+
+    # parse compiles a single line and executes it
+    # kept for callers which don't use compileLines
+    # the output is always returned as a single string (or None)
 
     def parse(self,srcLine,id,params):
+        cmd=self.compile(srcLine,id,params)
+        result=self.execute(cmd)
+        if result is None or type(result) is str: return result
+        return "".join(self.output(result,cmd))
+
+    # execute routes a compiled command to the appropriate routine
+    # all calls go through here first
+    #
+    # handlers return None if there is nothing to write, a string, a
+    # BoardItem or, for things like RING which can produce a lot of
+    # output, a list or generator of them. Use output() to write the
+    # result.
+
+    def execute(self,cmd):
+        if self.instrument: return self.instrumentedExecute(cmd)
+
         # wrapper so we can catch errors from in here
         try:
-            return self._parse(srcLine,id,params)
+            return self._execute(cmd)
 
         except Exception as e:
-            self.numErrors=self.numErrors+1
-            print("Error in KicadParser.py :-")
-            print(e.args)
-            exc_type, exc_value, exc_traceback = sys.exc_info()
-            traceback.print_tb(exc_traceback)
-            traceback.print_exception(exc_type, exc_value, exc_traceback,
-                                      limit=10, file=sys.stdout)
-            print("Caused by source line ",srcLine)
-
-    def _parse(self,srcLine,id,params):
-
-        # clean up
-        id=id.strip()
+            self.reportException(e,cmd)
+
+    # instrumentedExecute
+    # execute with timings and/or tracing, see enableProfile and enableTrace
+
+    def instrumentedExecute(self,cmd):
+        profile,trace,memory=self.profile,self.trace,self.memory
+
+        keys=[cmd.id]
+        if not (self.makingGroup or self.makingRepeat or self.makingRing or self.makingUseList):
+            if cmd.id in ("GROUP","REPEAT","RING","PANEL"):
+                keys.append(cmd.id+" "+cmd.args[0].strip()+" line "+str(cmd.srcLine))
+            elif cmd.id=="ENDUSELIST":
+                keys.append("USELIST "+self.useListId+" line "+str(cmd.srcLine))
+
+        if trace is not None:
+            traceArgs=trace.commandArgs(cmd)
+            traceStart=trace.now()
+        if profile is not None:
+            start=profile.begin()
+        if memory is not None:
+            memoryKeys=["line "+str(cmd.srcLine)+" "+cmd.id]+keys[1:]
+            memoryStart=memory.begin()
+
+        try:
+            result=self._execute(cmd)
+        except Exception as e:
+            result=None
+            self.reportException(e,cmd)
+
+        # handlers can return nested lists, the instruments see each
+        # string and BoardItem on its own
+        if result is not None and type(result) is not str: result=self.items(result,cmd)
+
+        if memory is not None:
+            current,peak=memory.end()
+            net=current-memoryStart
+            # the string returned is output, not kept, unless it is ASIS
+            if type(result) is str and cmd.id not in self.asis:
+                net=net-sys.getsizeof(result)
+            memory.record(memoryKeys,1,peak-memoryStart,net)
+            if result is not None and type(result) is not str:
+                result=memory.items(result,memoryKeys)
+
+        if profile is not None:
+            if result is None:
+                profile.end(keys,start,1)
+            elif type(result) is str:
+                profile.end(keys,start,1,1,len(result))
+            else:
+                profile.end(keys,start,1)
+                result=profile.items(result,keys)
+
+        if trace is not None:
+            if result is None or type(result) is str:
+                trace.span(keys[-1],"command",traceStart,traceArgs)
+            else:
+                result=trace.items(result,keys[-1],traceStart,traceArgs)
+
+        return result
+
+    # enableProfile
+    #
+    # starts collecting per command timings and counts, see
+    # CommandProfile. When it isn't enabled the only cost is a test in
+    # execute. getProfile returns the stats and profileReport a table
+
+    def enableProfile(self):
+        if self.profile is None: self.profile=CommandProfile()
+        self.instrument=True
+
+    def getProfile(self):
+        if self.profile is None: return {}
+        return self.profile.getStats()
+
+    def profileReport(self):
+        if self.profile is None: return ""
+        return self.profile.report()
+
+    # enableTrace
+    #
+    # starts recording a trace of the commands and block iterations, see
+    # TraceRecorder. writeTrace saves it as Chrome trace-event JSON
+
+    def enableTrace(self):
+        if self.trace is None: self.trace=TraceRecorder()
+        self.instrument=True
+
+    def writeTrace(self,filename):
+        if self.trace is not None: self.trace.write(filename)
+
+    # enableMemoryProfile
+    #
+    # starts measuring the memory used by each command and block with
+    # tracemalloc, see MemoryProfile. Everything runs a lot slower while
+    # it is on. memoryReport returns a table of the results and
+    # stopMemoryProfile stops tracemalloc, keeping the results
+
+    def enableMemoryProfile(self):
+        if tracemalloc is None or not hasattr(tracemalloc,"reset_peak"):
+            self.Warning("Memory profiling needs python 3.9 or later.")
+            return
+        if self.memory is None: self.memory=MemoryProfile()
+        self.instrument=True
+
+    def getMemoryProfile(self):
+        if self.memory is None: return {}
+        return self.memory.getStats()
+
+    def memoryReport(self):
+        if self.memory is None: return ""
+        return self.memory.report(self)
+
+    def stopMemoryProfile(self):
+        if self.memory is not None: self.memory.stop()
+
+    # enableSegmentMerge
+    #
+    # from now on output() holds back the track segments instead of
+    # writing them. flushSegments gives them back, without duplicates or
+    # zero length segments and with collinear segments which touch joined
+    # up, see SegmentMerge. Call it once everything else has been written.
+    #
+    # this is off by default as the tracks come out in a different order
+    # and a track which ended where two others met now ends part way
+    # along the joined one. SEGMENT and TRACK aren't cached while it is on
+
+    def enableSegmentMerge(self):
+        if self.segmentMerge is None: self.segmentMerge=SegmentMerge()
+
+    def flushSegments(self):
+        if self.segmentMerge is None: return ()
+        return self.serialise(self.segmentMerge.items(self))
+
+    def segmentMergeReport(self):
+        if self.segmentMerge is None: return ""
+        return self.segmentMerge.report()
+
+    # output
+    #
+    # turns the result of execute() into an iterable of strings
+    # BoardItems are rendered with their templates here, as they are
+    # written, see serialise
+
+    def output(self,result,cmd):
+        if result is None: return ()
+        if type(result) is str: return (result,)
+        if self.segmentMerge is None: return self.serialise(result,cmd)
+        return self.serialise(self.segmentMerge.collect(self.items(result,cmd),self.profile))
+
+    # items
+    #
+    # generator which flattens the result of execute() into strings and
+    # BoardItems, as blocks like RING pass them on. Errors raised while a
+    # generator runs are reported against the command which produced it,
+    # as execute does, and its output stops
+
+    def items(self,result,cmd):
+        if result is None: return
+        if type(result) is str or isinstance(result,BoardItem):
+            yield result
+            return
+        try:
+            for x in result:
+                if type(x) is str or isinstance(x,BoardItem):
+                    yield x
+                elif x is not None:
+                    for y in self.flatten(x): yield y
+        except Exception as e:
+            self.reportException(e,cmd)
+
+    # flatten
+    # handlers can return lists of strings, BoardItems and more lists
+    def flatten(self,result):
+        for x in result:
+            if x is None: continue
+            if type(x) is str or isinstance(x,BoardItem):
+                yield x
+            else:
+                for y in self.flatten(x): yield y
+
+    # serialise
+    #
+    # generator which renders the BoardItems in items, strings are passed
+    # on unchanged. Like items() it takes what a handler returned, doing
+    # both in one pass as that is what most output goes through, and
+    # reports an exception against cmd. The length of each BoardItem's
+    # text goes to the profile, if there is one, see CommandProfile.written
+
+    def serialise(self,items,cmd=None):
+        profile=self.profile
+        if isinstance(items,BoardItem): items=(items,)
+        try:
+            for x in items:
+                if type(x) is str:
+                    yield x
+                elif type(x) is Zone:
+                    if profile is None:
+                        for y in x.stream(self): yield y
+                    else:
+                        nbytes=0
+                        for y in x.stream(self):
+                            nbytes=nbytes+len(y)
+                            yield y
+                        profile.written(x,nbytes)
+                elif isinstance(x,BoardItem):
+                    text=x.render(self)
+                    if profile is not None: profile.written(x,len(text))
+                    yield text
+                elif x is not None:
+                    for y in self.serialise(self.flatten(x)): yield y
+        except Exception as e:
+            if cmd is None: raise
+            self.reportException(e,cmd)
+
+    # reportException
+    # prints the details of an exception caught while running cmd
+
+    def reportException(self,e,cmd):
+        self.numErrors=self.numErrors+1
+        print("Error in KicadParser.py :-")
+        print(e.args)
+        exc_type, exc_value, exc_traceback = sys.exc_info()
+        traceback.print_tb(exc_traceback)
+        traceback.print_exception(exc_type, exc_value, exc_traceback,
+                                  limit=10, file=sys.stdout)
+        print("Caused by source line ",cmd.srcLine)
+
+    # executeCached
+    #
+    # used instead of execute for incremental builds. Drawing commands
+    # whose fingerprint (see commandKey) is in the cache replay the
+    # cached output, anything else is executed. Blocks, variables and
+    # the like always run because of their side effects.
+    #
+    # the result is None or a string
+
+    def executeCached(self,cmd,cache):
+        if not self.isCacheable(cmd):
+            result=self.execute(cmd)
+            if result is None or type(result) is str: return result
+            return "".join(self.output(result,cmd))
+
+        key=self.commandKey(cmd)
+        entry=cache.get(key)
+        if entry is not None and self.cacheEntryValid(entry):
+            for id,before,after in entry["refs"]:
+                self.ref[id]=after
+            cache.hits=cache.hits+1
+            cache.put(key,entry)
+            return entry["output"]
+
+        cache.misses=cache.misses+1
+
+        refs=dict(self.ref)
+        numWarnings,numErrors=self.numWarnings,self.numErrors
+        self.resourcesUsed=set()
+        try:
+            result=self.execute(cmd)
+            if result is not None and type(result) is not str:
+                result="".join(self.output(result,cmd))
+            used=self.resourcesUsed
+        finally:
+            self.resourcesUsed=None
+
+        # anything which needed a message is done again next time
+        # so the message isn't lost
+        if self.numWarnings!=numWarnings or self.numErrors!=numErrors:
+            return result
+
+        cache.put(key,{
+            "output":result,
+            "refs":[(id,refs.get(id,0),n) for id,n in self.ref.items() if refs.get(id,0)!=n],
+            "uses":[(kind,id,self.resourceHashes.get((kind,id))) for kind,id in sorted(used)]
+            })
+        return result
+
+    # isCacheable
+    # only top level drawing commands which have no side effects other
+    # than their output and reference numbers are cached
+
+    def isCacheable(self,cmd):
+        if self.makingGroup or self.makingRepeat or self.makingRing or self.makingUseList: return False
+        if self.processingGroup or self.processingRepeat or self.processingRing: return False
+        if cmd.id in self.asis: return False
+        # the segments are written at the end, see enableSegmentMerge
+        if self.segmentMerge is not None and cmd.action==self.segment: return False
+        return cmd.id in self.cacheableIds or cmd.action==self.component
+
+    # commandKey
+    #
+    # fingerprint of everything a drawing command depends on apart from
+    # the templates and lists, which are checked by cacheEntryValid
+
+    def commandKey(self,cmd):
+        names=set()
+        for arg in cmd.args:
+            names.add(arg.strip())
+            for token in self.reItem.findall(arg):
+                if token[:1] in "+-": token=token[1:]
+                if token[:1].isalpha(): names.add(token)
+
+        st=self.state
+        key=[cmd.id,cmd.params,
+             st.transform or self.updateTransform(),
+             self.directionX,self.directionY,st.xOrigin,st.yOrigin,
+             self.fmtFloat,self.nanometres,self.zoneTemplate,self.arcTracks,self.arcTrackMaxStep,self.boardVersion,
+             [self.varContainsSaveXYVar(arg) for arg in cmd.args]]
+        for name in sorted(names):
+            key.append((name,self.getVariable(name)))
+
+        return hashlib.sha1(repr(key).encode("utf-8")).hexdigest()
+
+    # cacheEntryValid
+    # true if the templates and lists the entry used haven't changed and
+    # the reference numbers carry on from the same place
+
+    def cacheEntryValid(self,entry):
+        for kind,id,digest in entry["uses"]:
+            if self.resourceHashes.get((kind,id))!=digest: return False
+        for id,before,after in entry["refs"]:
+            if self.ref.get(id,0)!=before: return False
+        return True
+
+    # usesResource
+    # records that the command being cached depends on a template or list
+
+    def usesResource(self,kind,id):
+        if self.resourcesUsed is not None:
+            self.resourcesUsed.add((kind,id))
+
+    # resourceHash
+    # content hash used to tell if a template or list has changed
+
+    def resourceHash(self,data):
+        return hashlib.sha1(repr(data).encode("utf-8")).hexdigest()
+
+    def _execute(self,cmd):
+
+        id=cmd.id
 
         # for status messages
-        self.srcLine=srcLine
+        self.srcLine=cmd.srcLine
 
         # if the item is in the asis lists just return it unchanged
         if id in self.asis: return self.asis[id]
@@ -192,36 +1837,29 @@ class KiCadParser():
         # till the END tag is seen
         if self.makingGroup:
             if id!="ENDGROUP":
-                # add the data as a tuple
-                self.state.groupList.append((srcLine,id,params))
+                self.state.own("groupList").append(cmd)
                 return None
 
         if self.makingRepeat:
             if id!="ENDREPEAT":
-                self.state.repeatList.append((srcLine,id,params))
+                self.state.own("repeatList").append(cmd)
                 return None
 
         if self.makingRing:
             if id != "ENDRING":
-                self.state.ringList.append((srcLine,id,params))
+                self.state.own("ringList").append(cmd)
                 return None
 
         if self.makingUseList:
             if id!="ENDUSELIST":
                 # not nestable
-                self.useList.append((srcLine,id,params))
+                self.useList.append(cmd)
                 return None
 
 
-        # check for defined actions first
-
-        if id in self.actions:
-            return self.actions[id](id,params)
-
-        # user defined components all have the same parameters
-        else:
-            # otherwise process as a user defined template
-            return self.component(id,params)
+        # the handler was resolved when the command was compiled
+        # user defined components all go to self.component
+        return cmd.action(id,cmd.args)
     ########################################################################
     #
     # Error
@@ -317,9 +1955,6 @@ class KiCadParser():
 
 
     def evalNumericParam(self,param):
-        # have we been passed an expression or a numeric value
-        mathSign=""
-        result=None
 
         # first check if param is simply a number already
 
@@ -330,19 +1965,86 @@ class KiCadParser():
             # a single number format
             return float(param)
 
+        # the same strings turn up on every iteration of a ring or
+        # repeat so each one is only tokenised once
+        expr=self.exprCache.get(param)
+        if expr is None:
+            self.exprCacheMisses=self.exprCacheMisses+1
+            expr=self.compileNumericParam(param)
+            if len(self.exprCache)>=self.exprCacheSize:
+                # drop the oldest entry
+                del self.exprCache[next(iter(self.exprCache))]
+            self.exprCache[param]=expr
+        else:
+            self.exprCacheHits=self.exprCacheHits+1
+
+        kind=expr.kind
+
+        if kind==NumericExpr.CONST:
+            return expr.value
+
+        if kind==NumericExpr.VAR:
+            varName,negate=expr.value
+            val=self.getVariable(varName)
+            if val is None or type(val) is str:
+                self.Warning("Unable to evaluate variable "+varName+" perhaps you haven't defined it yet.")
+                return None
+            if type(val) is float or type(val) is int:
+                if negate: val=-1*val
+                return 0.0+val
+            return None
+
+        # a sum of terms - added left to right as they were written
+        result=expr.value
+        for termKind,value in expr.terms:
+            if termKind==NumericExpr.NUMBER:
+                if result is None: result=0.0
+                result=result+value
+
+            elif termKind==NumericExpr.VAR:
+                varName,negate=value
+                val=self.getVariable(varName)
+
+                # if a variable contains a string it isn't useable in
+                # the context of a numeric expression
+                if val is None or type(val) is str:
+                    # can this be deliberate?
+                    self.Warning("Unable to evaluate variable "+varName+" perhaps you haven't defined it yet.")
+                    return None
+
+                if type(val) is float or type(val) is int:
+                    if negate: val = -1 * val  # precaution in case text
+                    if result is None: result=0.0
+                    result=result+val
+
+            elif termKind==NumericExpr.BADNUMBER:
+                float(value)    # raises ValueError for the caller
+
+            else:
+                self.Warning("Unable to resolve expression "+value)
+
+        # final result
+        return result
+
+    # compileNumericParam
+    #
+    # tokenises a parameter string and returns a NumericExpr
+    # numbers are converted and signed here, variable names are
+    # looked up each time the expression is evaluated
+
+    def compileNumericParam(self,param):
         param=param.strip() # the expressions may come in as strings
 
         # tokenise the parameters
         itemList=self.reItem.findall(param)
 
-        # scan all the parameters
-        # try to get values for variables
-
+        terms=[]
         for x in itemList:
 
             if x=="":
                 # empty string can occur at end of the list
-                return result
+                # anything after it is ignored
+                break
 
             if x[0] in "-+":
                 mathSign=x[0]
@@ -352,31 +2054,40 @@ class KiCadParser():
 
             # check if it's a number first - mostly likely case
             if self.isNumber(x):
-                x=float(x)
+                try:
+                    x=float(x)
+                except ValueError:
+                    # something like 1.5.3 - fails when evaluated
+                    terms.append((NumericExpr.BADNUMBER,x))
+                    continue
                 if mathSign=="-": x=-1*x
-                if result is None: result = 0.0
-                result=result+x
-
+                terms.append((NumericExpr.NUMBER,x))
             elif self.reVarName.match(x):
+                terms.append((NumericExpr.VAR,(x,mathSign=="-")))
+            else:
+                terms.append((NumericExpr.BAD,x))
 
-                val=self.getVariable(x)
+        # fold the leading numbers - they are added first anyway
+        const=None
+        n=0
+        while n<len(terms) and terms[n][0]==NumericExpr.NUMBER:
+            if const is None: const=0.0
+            const=const+terms[n][1]
+            n=n+1
+        terms=terms[n:]
 
-                # if a variable contains a string it isn't useable in
-                # the context of a numeric expression
-                if val is None or type(val) is str:
-                    # can this be deliberate?
-                    self.Warning("Unable to evaluate variable "+x+" perhaps you haven't defined it yet.")
-                    return None
+        if len(terms)==0:
+            return NumericExpr(NumericExpr.CONST,const)
 
-                if type(val) is float or type(val) is int:
-                    if mathSign == "-": val = -1 * val  # precaution in case text
-                    if result is None: result=0.0
-                    result=result+val
-            else:
-                self.Warning("Unable to resolve expression "+x)
+        if const is None and len(terms)==1 and terms[0][0]==NumericExpr.VAR:
+            return NumericExpr(NumericExpr.VAR,terms[0][1])
 
-        # final result
-        return result
+        return NumericExpr(NumericExpr.SUM,const,terms)
+
+    # getExprCacheStats returns (entries,hits,misses) for the
+    # numeric parameter cache
+    def getExprCacheStats(self):
+        return len(self.exprCache),self.exprCacheHits,self.exprCacheMisses
 
 
     # eval string parameter is called when a parameter is expected to be a string
@@ -415,8 +2126,8 @@ class KiCadParser():
 # setGlobal
     # can set a string or numerical value
 
-    def setGlobal(self,id,params):
-        varName,strValue=params.split(",")
+    def setGlobal(self,id,args):
+        varName,strValue=args
 
         if type(varName) is not str:
             self.Warning("Variable names should be strings. Ignored")
@@ -441,8 +2152,8 @@ class KiCadParser():
         except KeyError:
             return None
 
-    def setLocal(self,id,params):
-        varName,strValue=params.split(",")
+    def setLocal(self,id,args):
+        varName,strValue=args
         varName=varName.strip()
 
         if type(varName) is not str:
@@ -452,12 +2163,13 @@ class KiCadParser():
         varName=varName.strip()
         strValue=strValue.strip()
 
-        self.state.localVars[varName] = self.getValue(strValue)
+        self.state.own("localVars")[varName] = self.getValue(strValue)
 
         return None
 
 
-    def clrGlobal(self,unused,varName):
+    def clrGlobal(self,unused,args):
+        varName=args[0]
         if type(varName) is not str:
             self.Warning("Variable names should be strings. Ignored")
         else:
@@ -466,12 +2178,13 @@ class KiCadParser():
 
         return None
 
-    def clrLocal(self,unused,varName):
+    def clrLocal(self,unused,args):
+        varName=args[0]
         if type(varName) is not str:
             self.Warning("Variable names should be strings. Ignored")
         else:
             varName=varName.strip()
-            del self.state.localVars[varName]
+            del self.state.own("localVars")[varName]
 
         return None
 
@@ -483,8 +2196,8 @@ class KiCadParser():
     #######################################################################
 
     # loadList
-    def loadList(self,unused,params):
-        Id,Sep,Filename=params.split(",")
+    def loadList(self,unused,args):
+        Id,Sep,Filename=args
         # line format is TEMPLATE,id,filename
         Id=Id.strip().upper()
         Sep=Sep.strip()
@@ -496,45 +2209,29 @@ class KiCadParser():
             return None
 
         try:
-            file = open(Filename, "r")
-
-            theList=[]  # start clean
-
-            # load each line and split it into a list of params
-            # append each line to the
-            lines = file.readlines()
-            for line in lines:
-                # split the line into separate parameters
-                # and lose any white space
-                # clean up input
-                line = line.strip()
-                # ignore comments and blank lines
-                # ORDER MATTERS !
-                if (line == "") or (line[0] == "#"): continue
-                entry=line.split(Sep)
-                entry=[x.strip() for x in entry]
-                theList.append(entry)
-            file.close()
+            # the rows are read from the file when the list is used
+            theList=ListFile(Filename,Sep)
 
             self.list[Id]=theList
+            self.resourceHashes[("LIST",Id)]=self.resourceHash(theList.stamp())
 
             self.Info("LIST ID=[" + Id + "]. Loaded ok.")
 
         except Exception as e:
-            self.Error("Cannot load list [" + id + "]\n" + e.args)
+            self.Error("Cannot load list [" + Id + "]\n" + str(e.args))
         finally:
             return None
 
     # useList simply triggers the building of a list
-    def beginUseList(self,unused,params):
+    def beginUseList(self,unused,args):
         self.makingUseList=True
         self.useList=[]
-        self.useListId=params.strip()
+        self.useListId=args[0].strip()
         pass
 
     # endlist - executes the commands from a list
     # and substitues placeholders with parameters
-    def endUseList(self,id,params):
+    def endUseList(self,id,args):
         if not self.makingUseList:
             self.Warning("Orphaned ENDUSELIST encountered.")
             return
@@ -544,16 +2241,43 @@ class KiCadParser():
         # retrieve the list of parameters
         thisList=self.list[self.useListId]
 
-        result=""
+        return self.useListItems(thisList,self.useList,self.useListId,self.srcLine)
+
+    # useListItems
+    # generator which runs the USELIST commands for each list entry
+    # useListId and srcLine are only used for tracing
+    def useListItems(self,thisList,useList,useListId,srcLine):
+        # the placeholders are found once, not for every row
+        plans=[UseListLine(c) for c in useList]
+        trace=self.trace
+
         # foreach parameter
-        for p in thisList:
+        for i,p in enumerate(thisList):
+            if trace is not None: start=trace.beginIteration(useListId,i)
+
+            # values containing commas add parameters so the line
+            # has to be compiled again for that row
+            split=False
+            for x in p:
+                if "," in x or "%" in x: split=True
+
             # do these commands
-            for l in self.useList:
-                srcLine,id,params=l
-                r=self.parse(srcLine,id,self.useListHelper(params,p))
-                if r is not None:
-                    result=result+"\n"+r
-        return result
+            for plan in plans:
+                c=plan.cmd
+                if split or not plan.exact:
+                    c=self.compile(c.srcLine,c.id,self.useListHelper(c.params,p))
+                else:
+                    args=plan.bind(p)
+                    c=Command(c.srcLine,c.id,",".join(args),args,c.action)
+                r=self.execute(c)
+                if r is None: continue
+                yield "\n"
+                if isinstance(r,BoardItem):
+                    yield r
+                else:
+                    for x in self.items(r,c): yield x
+
+            if trace is not None: trace.endIteration("USELIST",srcLine,start)
 
     # useListHelper replaces %0%,%1% with corresponding parameters from the list
     def useListHelper(self,line,p):
@@ -570,10 +2294,10 @@ class KiCadParser():
     #DEFRING
     #
     # id is 'DEFRING' - not used
-    def defRing(self,unused,params):
+    def defRing(self,unused,args):
         self.makingRing=True
 
-        self.state.ringId = params.strip()  # should only be one
+        self.state.ringId = args[0].strip()  # should only be one
 
         if self.state.ringId in self.repeat:
             self.Warning("Ring with Id " + self.state.ringId + " will be redefined.")
@@ -596,10 +2320,10 @@ class KiCadParser():
     #
     # Id is 'REPEAT' - not used
 
-    def processRing(self, unused, params):
+    def processRing(self, unused, args):
         # X,Y and Angle are the co-ords and rotation angle for the group
         # Counter is how many time to iterate the block
-        ringId, Xpos, Ypos, Radius,Mode,startAngle,Counter,stepAngle= params.split(",")
+        ringId, Xpos, Ypos, Radius,Mode,startAngle,Counter,stepAngle=args
 
         ringId=ringId.strip()
         # make sure numeric params have variables subsituted and are float
@@ -625,44 +2349,51 @@ class KiCadParser():
             self.Warning("Ring ID " + ringId + " has no step angle. Ring ignored.")
             return None
 
-        if ringId in self.ring:
-            self.state.ringList = self.ring[ringId]
-        else:
+        if ringId not in self.ring:
             self.Warning("Ring ID " + ringId + " hasn't been defined. Ring ignored.")
             return None
 
+        return self.ringItems(ringId,Xpos,Ypos,Radius,Mode,startAngle,Counter,stepAngle,self.srcLine)
+
+    # ringItems
+    # generator which places the ring body Counter times
+    # srcLine is only used for tracing
+    def ringItems(self,ringId,Xpos,Ypos,Radius,Mode,startAngle,Counter,stepAngle,srcLine):
+        ringList = self.ring[ringId]
+        trace=self.trace
+
         self.processingRing = True
 
         self.pushState()
+        try:
+            # tarnsformXY may need to know this
+            self.state.ringCx=Xpos
+            self.state.ringCy=Ypos
+            self.state.ringRad=Radius
 
-        # tarnsformXY may need to know this
-        self.state.ringCx=Xpos
-        self.state.ringCy=Ypos
-        self.state.ringRad=Radius
+            thisAngle = startAngle
+            self.state.ringId = ringId
 
-        thisAngle = startAngle
-        self.state.ringId = ringId
+            for i in range(int(Counter)):
+                if trace is not None: start=trace.beginIteration(ringId,i)
 
-        result = ""
+                # get 0,0 position of the component/group
+                self.state.ringX,self.state.ringY=self.getCircleXY(self.state.ringCx,self.state.ringCy,self.state.ringRad,thisAngle)
+                self.state.ringAngle=thisAngle
 
-        for i in range(int(Counter)):
-            # get 0,0 position of the component/group
-            self.state.ringX,self.state.ringY=self.getCircleXY(self.state.ringCx,self.state.ringCy,self.state.ringRad,thisAngle)
-            self.state.ringAngle=thisAngle
+                # do we want the components rotated?
+                if Mode is None: self.state.ringAngle=0
+                else: self.state.ringAngle=thisAngle+Mode
+                self.invalidateTransform()
 
-            # do we want the components rotated?
-            if Mode is None: self.state.ringAngle=0
-            else: self.state.ringAngle=thisAngle+Mode
+                for c in ringList:
+                    for r in self.items(self.execute(c),c): yield r
+                thisAngle=thisAngle+stepAngle
 
-            for c in self.state.ringList:
-                (lineNum, id, params) = c
-                r = self.parse(lineNum, id, params)
-                if r is None: continue
-                result = result + r
-            thisAngle=thisAngle+stepAngle
-        self.popState()
-        self.processingRing = False
-        return result
+                if trace is not None: trace.endIteration("RING",srcLine,start)
+        finally:
+            self.popState()
+            self.processingRing = False
 
     #########################################################################################
     #
@@ -675,10 +2406,10 @@ class KiCadParser():
     #DEFREPEAT
     #
     # id is 'DEFGROUP' - not used
-    def defRepeat(self,unused,params):
+    def defRepeat(self,unused,args):
         self.makingRepeat=True
 
-        self.state.repeatId = params.strip()  # should only be one
+        self.state.repeatId = args[0].strip()  # should only be one
 
         if self.state.repeatId in self.repeat:
             self.Warning("Repeat with Id " + self.state.repeatId + " will be redefined.")
@@ -699,10 +2430,10 @@ class KiCadParser():
     # deals with the REPEAT call
     #
     # Id is 'REPEAT' - not used
-    def processRepeat(self,unused,params):
+    def processRepeat(self,unused,args):
         # X,Y and Angle are the co-ords and rotation angle for the group
         # Counter is how many time to iterate the block
-        repeatId, Xpos,Ypos,startAngle,Counter,stepX,stepY, stepAngle = params.split(",")
+        repeatId, Xpos,Ypos,startAngle,Counter,stepX,stepY, stepAngle =args
 
         repeatId=repeatId.strip()
         # resolve numeric values
@@ -714,39 +2445,64 @@ class KiCadParser():
         stepY=self.evalNumericParam(stepY)
         stepAngle=self.evalNumericParam(stepAngle)
 
-        if repeatId in self.repeat:
-            self.state.repeatList= self.repeat[repeatId]
-        else:
+        if repeatId not in self.repeat:
             self.Warning("Repeat ID " + repeatId + " hasn't been defined. Repeat ignored.")
             return None
 
+        return self.repeatItems(repeatId,Xpos,Ypos,startAngle,Counter,stepX,stepY,stepAngle,self.srcLine)
+
+    # repeatItems
+    # generator which places the repeat body Counter times
+    # srcLine is only used for tracing
+    def repeatItems(self,repeatId,Xpos,Ypos,startAngle,Counter,stepX,stepY,stepAngle,srcLine):
+        repeatList= self.repeat[repeatId]
+        trace=self.trace
+
         self.processingRepeat=True
 
         self.pushState()
+        try:
+            self.state.repeatId=repeatId
 
-        self.state.repeatX=Xpos
-        self.state.repeatY=Ypos
-        self.state.repeatAngle=startAngle
-        self.state.repeatId=repeatId
+            steps=self.repeatSteps(Xpos,Ypos,startAngle,int(Counter),stepX,stepY,stepAngle)
 
-        result=""
+            for i,(repeatX,repeatY,repeatAngle) in enumerate(steps):
+                if trace is not None: start=trace.beginIteration(repeatId,i)
 
-        for i in range(int(Counter)):
-            # update the repeat counter here
-            for c in self.state.repeatList:
-                (lineNum, id, params) = c
-                r = self.parse(lineNum, id, params)
-                if r is None: continue
-                result = result + r
-            # move the X/Y and Angle forward
-            # at the end of the repeat list
-            self.state.repeatX=self.state.repeatX+stepX
-            self.state.repeatY=self.state.repeatY+stepY
-            self.state.repeatAngle=self.state.repeatAngle+stepAngle
-
-        self.popState()
-        self.processingRepeat=False
-        return result
+                self.state.repeatX=repeatX
+                self.state.repeatY=repeatY
+                self.state.repeatAngle=repeatAngle
+                self.invalidateTransform()
+
+                for c in repeatList:
+                    for r in self.items(self.execute(c),c): yield r
+
+                if trace is not None: trace.endIteration("REPEAT",srcLine,start)
+        finally:
+            self.popState()
+            self.processingRepeat=False
+
+    # repeatSteps
+    #
+    # generator for the (X,Y,Angle) of each step of a REPEAT. The step is
+    # added on each time, except in nanometre mode where the positions are
+    # start+i*step worked out in integer nanometres so step 10000 is
+    # exactly 10000 steps from the start. The angles are added up either way
+
+    def repeatSteps(self,Xpos,Ypos,startAngle,Counter,stepX,stepY,stepAngle):
+        if self.nanometres:
+            x0,y0=int(round(Xpos*NM_PER_MM)),int(round(Ypos*NM_PER_MM))
+            dx,dy=int(round(stepX*NM_PER_MM)),int(round(stepY*NM_PER_MM))
+
+        for i in range(Counter):
+            if self.nanometres:
+                yield (x0+i*dx)/float(NM_PER_MM),(y0+i*dy)/float(NM_PER_MM),startAngle
+            else:
+                yield Xpos,Ypos,startAngle
+                # move the X/Y and Angle forward
+                Xpos=Xpos+stepX
+                Ypos=Ypos+stepY
+            startAngle=startAngle+stepAngle
 
     ##################################################################################################
     #
@@ -758,7 +2514,7 @@ class KiCadParser():
     # DEFGROUP
     #
     # id is 'DEFGROUP' - we don't use it
-    def defGroup(self,unused,params):
+    def defGroup(self,unused,args):
         if self.makingGroup:
             self.Warning("You cannot use DEFGROUP within a DEFGROUP. Previous ENDGROUP may be missing.")
             return None
@@ -767,7 +2523,7 @@ class KiCadParser():
             return None
 
         self.makingGroup = True
-        self.state.groupId = params.strip()  # should only be one
+        self.state.groupId = args[0].strip()  # should only be one
 
         if self.state.groupId in self.group:
             self.Warning("Group with Id " + self.state.groupId + " will be redefined.")
@@ -790,10 +2546,10 @@ class KiCadParser():
     #
     # id passed in is just 'GROUP' - we don't use it
 
-    def processGroup(self, unused, params):
+    def processGroup(self, unused, args):
 
         # X,Y and Angle are the co-ords and rotaion angle for the group
-        groupId, Xpos, Ypos, Angle = params.split(",")
+        groupId, Xpos, Ypos, Angle =args
 
         # clean it up
         groupId=groupId.strip()
@@ -802,38 +2558,303 @@ class KiCadParser():
         Angle=self.evalNumericParam(Angle)
 
 
-        if groupId in self.group:
-            # remember these so we can restore them later
-            self.pushState()
-            groupList = self.group[groupId]
-        else:
+        if groupId not in self.group:
             self.Warning("Group ID " + groupId + " hasn't been defined. Group ignored.")
             return None
 
-        # flag used to amend references
-        self.processingGroup = True;
-        self.state.groupId = groupId  # used by others to get the reference postfix
-
-        # set the new offsets for this group
-        self.state.groupX = Xpos
-        self.state.groupY = Ypos
-        self.state.groupAngle = Angle
-
-        result = ""
-        for x in groupList:
-            # lineNum will be the line number from the position data file
-            # this helps to identify which line within a group failed (if any)
-            (lineNum, id, params) = x
-            r = self.parse(lineNum, id, params)
-            if r is None: continue
-            # add linefeeds for tidy output
-            result = result + "\n"+ r
-
-        # restore offsets
-        self.popState()
-
-        self.processingGroup = False
-        return result
+        return self.groupItems(groupId,Xpos,Ypos,Angle,self.srcLine)
+
+    # groupItems
+    # generator which places one copy of the group
+    # srcLine is only used for tracing
+    def groupItems(self,groupId,Xpos,Ypos,Angle,srcLine):
+        # remember these so we can restore them later
+        self.pushState()
+        trace=self.trace
+        if trace is not None: start=trace.beginIteration(groupId,0)
+        try:
+            # flag used to amend references
+            self.processingGroup = True;
+            self.state.groupId = groupId  # used by others to get the reference postfix
+
+            # set the new offsets for this group
+            self.state.groupX = Xpos
+            self.state.groupY = Ypos
+            self.state.groupAngle = Angle
+            self.invalidateTransform()
+
+            for x in self.groupInstance(groupId):
+                # each command keeps the line number from the position data file
+                # this helps to identify which line within a group failed (if any)
+                if type(x) is InstanceItem:
+                    r = self.renderInstance(x)
+                else:
+                    r = self.execute(x)
+                if r is None: continue
+                # add linefeeds for tidy output
+                yield "\n"
+                if isinstance(r,BoardItem):
+                    yield r
+                else:
+                    for y in self.items(r,x): yield y
+        finally:
+            if trace is not None: trace.endIteration("GROUP",srcLine,start)
+
+            # restore offsets
+            self.popState()
+
+            self.processingGroup = False
+
+    # groupInstance
+    #
+    # returns the group body with the components and SEGMENT,LINEs whose
+    # numbers are all constants rendered once as InstanceItems, everything
+    # else is left as a Command to be executed as usual. Only the position
+    # dependent parts of an InstanceItem are worked out for each copy of
+    # the group, by renderInstance. InstanceItems don't go through execute
+    # so they are counted as part of the GROUP by the profile and trace.
+    #
+    # the result is kept until the group is redefined or the number format
+    # changes. Templates can't change once loaded. Bodies which start or
+    # end a definition are never instanced because their commands would
+    # be collected rather than run
+
+    def groupInstance(self,groupId):
+        groupList=self.group[groupId]
+        if not self.instanceGroups: return groupList
+
+        entry=self.groupInstances.get(groupId)
+        if entry is not None and entry[0] is groupList and entry[1] is self.floatFormat:
+            return entry[2]
+
+        if any(cmd.id in self.blockIds for cmd in groupList):
+            items=groupList
+        else:
+            items=[self.instanceItem(cmd) for cmd in groupList]
+        self.groupInstances[groupId]=(groupList,self.floatFormat,items)
+        return items
+
+    # instanceItem
+    # returns an InstanceItem for cmd or cmd itself if it can't be instanced
+
+    def instanceItem(self,cmd):
+        if cmd.id in self.asis: return cmd
+
+        if cmd.action==self.component and len(cmd.args)==5:
+            template=self.template.get(cmd.id)
+            if template is None or template.type.upper()!="MODULE": return cmd
+            Ref,Angle,Xpos,Ypos,Layer=cmd.args
+            values=self.constantParams(Xpos,Ypos,Angle)
+            if values is None: return cmd
+            x,y,angle=values
+            template=template.bind({},("REF","XPOS","YPOS","ANGLE","LAYER"))
+            return InstanceItem(cmd,InstanceItem.MODULE,template,(cmd.id,Ref,x,y,angle,Layer))
+
+        if cmd.action==self.segment and len(cmd.args)==8 and cmd.args[0].strip().upper()=="LINE":
+            template=self.template.get("SEGMENT")
+            if template is None or template.type.upper()!="SEGMENT": return cmd
+            X0,Y0,X1,Y1,Width,Layer,Net=cmd.args[1:]
+            values=self.constantParams(X0,Y0,X1,Y1,Width,Net)
+            if values is None: return cmd
+            x0,y0,x1,y1,width,net=values
+            return InstanceItem(cmd,InstanceItem.SEGMENT,None,(x0,y0,x1,y1,self.strFloat(width),Layer,self.strInt(net)))
+
+        return cmd
+
+    # constantParams
+    # returns the values of numeric parameters which don't use
+    # variables or None if any of them do. An empty parameter is also
+    # left to execute so that it is reported the usual way
+
+    def constantParams(self,*params):
+        values=[]
+        for param in params:
+            expr=self.compileNumericParam(param)
+            if expr.kind!=NumericExpr.CONST or expr.value is None: return None
+            values.append(expr.value)
+        return values
+
+    # renderInstance
+    #
+    # produces one copy of an InstanceItem in the current transform,
+    # the same as executing its command would
+
+    def renderInstance(self,item):
+        cmd=item.cmd
+        # an ASIS loaded since the group was instanced takes over the id
+        if cmd.id in self.asis: return self.execute(cmd)
+
+        self.srcLine=cmd.srcLine
+        try:
+            if item.kind==InstanceItem.MODULE:
+                id,Ref,x,y,angle,Layer=item.values
+                Ref=self.getRef(id,Ref)
+                x,y=self.transformXY(x,y)
+                Layer=self.evalStringParam(Layer)
+                angle=self.transformAngle(angle)
+                return Module(item.template,Ref,x,y,angle,Layer)
+
+            x0,y0,x1,y1,width,Layer,net=item.values
+            x0,y0=self.transformXY(x0,y0)
+            x1,y1=self.transformXY(x1,y1)
+            Layer=self.evalStringParam(Layer)
+            # no line to draw?
+            if (x0==x1) and (y0==y1): return None
+            return Segment(x0,y0,x1,y1,width,Layer,net)
+
+        except Exception as e:
+            self.reportException(e,cmd)
+
+    #####################################################################################
+    #
+    # panels
+    #
+    # PANEL,groupId,Xpos,Ypos,Angle,Columns,Rows,Width,Height,Gap,Rail,RailWidth,LineWidth,Layer
+    #
+    # places Columns x Rows copies of the board defined as group groupId,
+    # each Width x Height with its bottom left corner at the group's 0,0.
+    # The copies are turned by Angle and laid out Gap apart with the bottom
+    # left of the panel at Xpos,Ypos. Each copy is exactly what
+    # GROUP,groupId would give there, see panelItems.
+    #
+    # Rail is NONE, VSCORE or MOUSEBITE. With a RailWidth above 0 rails are
+    # added above and below the boards and the outline of the panel is
+    # drawn. VSCORE draws a line along the middle of every gap, right
+    # across the panel, MOUSEBITE a row of holes between the boards. They
+    # are drawn LineWidth wide on Layer using the GRLINE and GRCIRCLE
+    # templates.
+    #
+    #####################################################################################
+
+    def processPanel(self,unused,args):
+        groupId,Xpos,Ypos,Angle,Columns,Rows,Width,Height,Gap,Rail,RailWidth,LineWidth,Layer=args
+
+        groupId=groupId.strip()
+        Xpos=self.evalNumericParam(Xpos)
+        Ypos=self.evalNumericParam(Ypos)
+        Angle=self.evalNumericParam(Angle)
+        Columns=self.evalNumericParam(Columns)
+        Rows=self.evalNumericParam(Rows)
+        Width=self.evalNumericParam(Width)
+        Height=self.evalNumericParam(Height)
+        Gap=self.evalNumericParam(Gap)
+        Rail=self.evalStringParam(Rail).upper()
+        RailWidth=self.evalNumericParam(RailWidth)
+        LineWidth=self.evalNumericParam(LineWidth)
+        Layer=self.evalStringParam(Layer)
+
+        if self.anyIsNone(Xpos,Ypos,Angle,Columns,Rows,Width,Height,Gap,RailWidth,LineWidth,Layer):
+            self.cannotAdd("PANEL")
+            return None
+
+        if groupId not in self.group:
+            self.Warning("Group ID " + groupId + " hasn't been defined. Panel ignored.")
+            return None
+
+        if Rail not in ("NONE","VSCORE","MOUSEBITE"):
+            self.Warning("Unsupported panel rail "+Rail+". Use NONE, VSCORE or MOUSEBITE.")
+            return None
+
+        return self.panelItems(groupId,Xpos,Ypos,Angle,int(Columns),int(Rows),Width,Height,Gap,
+                               Rail,RailWidth,LineWidth,Layer,self.srcLine)
+
+    # panelItems
+    #
+    # generator for the copies of the board and then the rails. Each copy
+    # is a GROUP,groupId with the copy's own position, so the references
+    # are numbered and anything the board prints or changes happens for
+    # every copy as it would with GROUP. The board's constant components
+    # and SEGMENT LINEs are only worked out once, see groupInstance, and
+    # each copy puts them through its own transform
+    # srcLine is only used for tracing
+
+    def panelItems(self,groupId,Xpos,Ypos,Angle,Columns,Rows,Width,Height,Gap,Rail,RailWidth,LineWidth,Layer,srcLine):
+        # the size of a turned board and where its 0,0 ends up
+        cosR,sinR=math.cos(Angle*math.pi/180),math.sin(Angle*math.pi/180)
+        corners=[(cosR*x-sinR*y,sinR*x+cosR*y) for x,y in ((0.0,0.0),(Width,0.0),(0.0,Height),(Width,Height))]
+        minX=min(x for x,y in corners)
+        minY=min(y for x,y in corners)
+        cellWidth=max(x for x,y in corners)-minX
+        cellHeight=max(y for x,y in corners)-minY
+
+        for row in range(Rows):
+            for column in range(Columns):
+                # blank line between the copies, as between GROUP lines
+                if row>0 or column>0: yield "\n"
+                for x in self.groupItems(groupId,Xpos+column*(cellWidth+Gap)-minX,Ypos+row*(cellHeight+Gap)-minY,Angle,srcLine):
+                    yield x
+
+        for x in self.panelRails(Xpos,Ypos,Columns,Rows,cellWidth,cellHeight,Gap,Rail,RailWidth,LineWidth,Layer):
+            yield x
+
+    # panelRails
+    # generator for the rails, outline and v-score or mouse bite marks
+    # of a panel. The boards are cellWidth x cellHeight
+
+    def panelRails(self,Xpos,Ypos,Columns,Rows,cellWidth,cellHeight,Gap,Rail,RailWidth,LineWidth,Layer):
+        right=Xpos+Columns*cellWidth+(Columns-1)*Gap
+        top=Ypos+Rows*cellHeight+(Rows-1)*Gap
+        bottom=Ypos
+        if RailWidth>0:
+            bottom=Ypos-Gap-RailWidth
+            top=top+Gap+RailWidth
+
+        # the middle of the gaps between the columns and between the rows,
+        # and between the boards and the rails
+        columnGaps=[Xpos+i*(cellWidth+Gap)-Gap/2 for i in range(1,Columns)]
+        rowGaps=[Ypos+i*(cellHeight+Gap)-Gap/2 for i in range(1,Rows)]
+        if RailWidth>0:
+            rowGaps=[Ypos-Gap/2]+rowGaps+[Ypos+Rows*(cellHeight+Gap)-Gap/2]
+
+        lines=[]
+        if RailWidth>0:
+            lines.extend([(Xpos,bottom,right,bottom),(right,bottom,right,top),
+                          (right,top,Xpos,top),(Xpos,top,Xpos,bottom)])
+
+        if Rail=="VSCORE":
+            lines.extend((x,bottom,x,top) for x in columnGaps)
+            lines.extend((Xpos,y,right,y) for y in rowGaps)
+
+        for x0,y0,x1,y1 in lines:
+            x0,y0=self.transformXY(x0,y0)
+            x1,y1=self.transformXY(x1,y1)
+            yield "\n"
+            yield self.graphic_line_helper(x0,y0,x1,y1,LineWidth,Layer)
+
+        if Rail=="MOUSEBITE":
+            # holes along each gap where it runs between two boards or a board and a rail
+            for x in columnGaps:
+                for row in range(Rows):
+                    y=Ypos+row*(cellHeight+Gap)
+                    for y in self.mouseBites(y,y+cellHeight):
+                        yield "\n"+self.panelHole(x,y,LineWidth,Layer)
+            for y in rowGaps:
+                for column in range(Columns):
+                    x=Xpos+column*(cellWidth+Gap)
+                    for x in self.mouseBites(x,x+cellWidth):
+                        yield "\n"+self.panelHole(x,y,LineWidth,Layer)
+
+    # mouseBites returns the positions of the holes along a board edge
+    # from start to end, spaced mouseBitePitch apart and centred
+    def mouseBites(self,start,end):
+        count=int((end-start)/self.mouseBitePitch)+1
+        first=(start+end)/2-(count-1)*self.mouseBitePitch/2
+        return [first+i*self.mouseBitePitch for i in range(count)]
+
+    # panelHole renders a mouse bite hole as a GRCIRCLE
+    def panelHole(self,X,Y,LineWidth,Layer):
+        template = self.validateTemplate("GRCIRCLE", "gr_circle")
+        if template is None: return ""
+
+        X,Y=self.transformXY(X,Y)
+        return template.render({
+            "XPOS1":self.strFloat(X),
+            "YPOS1":self.strFloat(Y),
+            "XPOS2":self.strFloat(X+self.mouseBiteDrill/2),
+            "YPOS2":self.strFloat(Y),
+            "WIDTH":self.strFloat(LineWidth),
+            "LAYER":Layer
+            })
 
     #####################################################################################
     #
@@ -847,6 +2868,7 @@ class KiCadParser():
     # strFloat - used to create coordinates limited to dp decimal places
     # defaults to 4dp which give an accuracy of (1/10000) units (mm/in?)
     def strFloat(self,value):
+        if type(value) is float: return self.floatFormat.format(value)
         if value is None:
             self.Warning("strFloat was passed a None value. This will show up in the kicad_pcb file as 'NONE'. pcb_new will complain if you try to open it!")
             return "NONE"
@@ -854,6 +2876,53 @@ class KiCadParser():
             return value
         return self.fmtFloat.format(value)
 
+    # strFloats
+    # formats several values at once, gives a list of the same strings
+    # strFloat would return for each one
+    def strFloats(self,*values):
+        for value in values:
+            if type(value) is not float and type(value) is not int:
+                return [self.strFloat(x) for x in values]
+        return self.floatFormat.formatMany(values)
+
+    # setPrecision
+    # changes the number of decimal places written to the kicad_pcb file
+    def setPrecision(self,precision):
+        if self.nanometres:
+            self.floatFormat=NanometreFormat(precision)
+        else:
+            self.floatFormat=FloatFormat(precision)
+        self.fmtFloat=self.floatFormat.fmtFloat
+
+    # setNanometres
+    #
+    # nanometre mode snaps positions to whole nanometres, as KiCad holds
+    # them. Transformed coordinates and the ORIGIN are rounded once, REPEAT
+    # positions are worked out as start+i*step in integer nanometres rather
+    # than adding the step each time so they don't drift, and the output is
+    # written from the integer nanometres. It is off by default as the
+    # output can differ from the float version in the last decimal place.
+    def setNanometres(self,on):
+        self.nanometres=on
+        self.setPrecision(self.floatFormat.precision)
+
+    # setArcTracks
+    #
+    # with arc tracks on SEGMENT,ARC and SEGMENT,CIRCLE are drawn as true
+    # arcs, see track_arc_items, instead of NumSegments straight segments,
+    # where NumSegments makes a smooth curve: each segment would turn
+    # through at most maxStepAngle degrees, 10 unless it is given, so a
+    # circle needs 36 or more. Fewer segments are taken to mean the shape
+    # is wanted, like a 12 sided polygon, and are drawn as before.
+    # It is off by default as only KiCad 6 and later can read them
+    def setArcTracks(self,on,maxStepAngle=None):
+        self.arcTracks=on
+        if maxStepAngle is not None: self.arcTrackMaxStep=maxStepAngle
+
+    # snapNm rounds a position in mm to the nearest nanometre
+    def snapNm(self,value):
+        return round(value*NM_PER_MM)/float(NM_PER_MM)
+
     #strInt
     def strInt(self,value):
         if type(value) is str: return value
@@ -864,8 +2933,8 @@ class KiCadParser():
     # prints XY coordintes adjusted for transforms
     # useful for getting coords when an track is rotated
 
-    def echo(self,unused,params):
-        userTag,X,Y=params.split(",")
+    def echo(self,unused,args):
+        userTag,X,Y=args
         userTag=userTag.strip()
         X=self.evalNumericParam(X)
         Y=self.evalNumericParam(Y)
@@ -949,20 +3018,18 @@ class KiCadParser():
         if param in self.saveXYVars:
             return True
 
-        # see if the expression contains the svaeXY vars
-        for v in self.saveXYVars:
-            p=re.compile(v)
-            if p.match(param):
-                return True
+        # see if the expression starts with one of the saveXY vars
+        if self.reSaveXYVars is None:
+            return False
 
-        return False
+        return self.reSaveXYVars.match(param) is not None
 
     # saveXY
     # saves the current real-world coordinates
 
-    def saveXY(self,unused,params):
+    def saveXY(self,unused,args):
 
-        varName,X,Y=params.split(",")
+        varName,X,Y=args
 
         varName=varName.strip()
 
@@ -974,16 +3041,21 @@ class KiCadParser():
 
         varX=varName + "_X" # cannot use an expression for the key, apparently
         varY=varName + "_Y"
+        newNames=varX not in self.saveXYVars or varY not in self.saveXYVars
         self.saveXYVars[varX] = x
         self.saveXYVars[varY] = y
+
+        # SAVEXY in a ring is run every step but only the first adds names
+        if newNames:
+            self.reSaveXYVars=re.compile("|".join(re.escape(v) for v in self.saveXYVars))
         return None
 
     # saveOnceXy
     # used to remember XY coords at the START of a repeat or ring
     #
-    def saveOnceXY(self,unused,params):
+    def saveOnceXY(self,unused,args):
 
-        varName, X, Y = params.split(",")
+        varName, X, Y =args
 
         varName = varName.strip()
 
@@ -993,7 +3065,7 @@ class KiCadParser():
         if varName in self.saveXYVars:
             return None
 
-        return self.saveXY(unused,params)
+        return self.saveXY(unused,args)
 
     # getCircleXY returns the co-ords of a point on a circle
     # just a useful routine to help with Altzheimer's
@@ -1058,62 +3130,96 @@ class KiCadParser():
     #
 
     # final transformation of XY to real world coordinates based on originX,originY and angleOrigin
-    # getXY returns the XY co-ords of a point at an Angle assuming X/Y lie
-    # on a circle centred at 0,0.
+    # the group, repeat and ring rotations and offsets, the plotting direction
+    # and the origin are composed into one affine matrix by updateTransform
+    # so each point only costs four multiplies and four additions
     # this is called to transform coords about to be written to the output
 
     def transformXY(self, X, Y):
         assert type(X) is float, "transformXY() X must be a float."
         assert type(Y) is float, "transformXY() Y must be a float."
 
-        # deal with translation and compound rotation
-        if self.processingGroup or self.processingRepeat or self.processingRing:
-            # components XY values are offsets from zero
-            angle,radius=self.getAngleRadiusXY(X,Y)
+        m=self.state.transform
+        if m is None: m=self.updateTransform()
+
+        if self.nanometres:
+            return self.snapNm(m[0]*X + m[1]*Y + m[2]), self.snapNm(m[3]*X + m[4]*Y + m[5])
+
+        return m[0]*X + m[1]*Y + m[2], m[3]*X + m[4]*Y + m[5]
+
+    # transformAngle
+    #
+    # all components design coordinates are based on an unrotated shape
+    # this returns the new angle allowing for changes to the origin, group, repeat or ring
+    # angleOrigin is no longer changeable by the user
+
+    def transformAngle(self, Angle):
+        assert type(Angle) is float, "getComponentAngle() Angle must be a float (degrees)."
+
+        m=self.state.transform
+        if m is None: m=self.updateTransform()
+
+        return Angle + m[6]
 
-            # the group centre is at 0,0
-            # we only need to change components in the group if not at 0,0
-            if radius != 0:
+    # updateTransform
+    #
+    # builds the matrix (a,b,c,d,e,f) used by transformXY where
+    #
+    #   X' = a*X + b*Y + c
+    #   Y' = d*X + e*Y + f
+    #
+    # in the order the transforms are applied:
+    #   rotate by the group+repeat+ring angles (only inside one of those)
+    #   add the group, repeat and ring offsets
+    #   adjust for the plotting direction
+    #   rotate by angleOrigin
+    #   add the origin
+    #
+    # the total rotation for transformAngle is kept as a seventh value.
+    # The result is kept in the state frame until invalidateTransform
+    # is called because something it depends on has changed
 
-                combinedRotation=angle+self.state.groupAngle+self.state.repeatAngle+self.state.ringAngle
-                X, Y = self.getCircleXY(0.0, 0.0, radius,combinedRotation )
+    def updateTransform(self):
+        st=self.state
+
+        # deal with translation and compound rotation
+        if self.processingGroup or self.processingRepeat or self.processingRing:
+            angle=(st.groupAngle+st.repeatAngle+st.ringAngle)*math.pi/180
+            cosR,sinR=math.cos(angle),math.sin(angle)
+        else:
+            cosR,sinR=1.0,0.0
 
         # a group in a ring will be at groupX=ringX etc - must not add twice
+        tx,ty=0.0,0.0
         if self.processingGroup:
-            X, Y = X + self.state.groupX, Y + self.state.groupY
+            tx,ty=tx+st.groupX,ty+st.groupY
         if self.processingRepeat:
-            X, Y = X + self.state.repeatX, Y + self.state.repeatY
+            tx,ty=tx+st.repeatX,ty+st.repeatY
         if self.processingRing:
-            X, Y = X + self.state.ringX, Y + self.state.ringY
+            tx,ty=tx+st.ringX,ty+st.ringY
 
         # adjust for plotting direction
-        X=X*self.directionX
-        Y=Y*self.directionY
+        dx,dy=self.directionX,self.directionY
+        a,b,d,e=dx*cosR,-dx*sinR,dy*sinR,dy*cosR
+        tx,ty=dx*tx,dy*ty
 
         # has the origin been turned?
-        rotAngle=self.state.angleOrigin
+        if st.angleOrigin:
+            cosA = math.cos(st.angleOrigin * math.pi / 180)
+            sinA = math.sin(st.angleOrigin * math.pi / 180)
+            a,b,d,e=a*cosA+d*sinA, b*cosA+e*sinA, -a*sinA+d*cosA, -b*sinA+e*cosA
+            tx,ty=tx*cosA+ty*sinA, -tx*sinA+ty*cosA
 
-        if rotAngle:
-            cosA = math.cos(rotAngle * math.pi / 180)
-            sinA = math.sin(rotAngle * math.pi / 180)
-            X1,Y1= X * cosA + Y * sinA, -X * sinA + Y * cosA
-        else:
-            X1,Y1=X,Y
         # now compensate for the origin being somewhere whacky
-        X1 = X1 + self.state.xOrigin #
-        Y1 = Y1 + self.state.yOrigin #
-        return X1, Y1
+        st.transform=(a,b,tx+st.xOrigin,d,e,ty+st.yOrigin,
+                      st.angleOrigin+st.groupAngle+st.repeatAngle+st.ringAngle)
+        return st.transform
 
-    # transformAngle
-    #
-    # all components design coordinates are based on an unrotated shape
-    # this returns the new angle allowing for changes to the origin, group, repeat or ring
-    # angleOrigin is no longer changeable by the user
-
-    def transformAngle(self, Angle):
-        assert type(Angle) is float, "getComponentAngle() Angle must be a float (degrees)."
-        r= Angle + self.state.angleOrigin + self.state.groupAngle + self.state.repeatAngle + self.state.ringAngle
-        return r
+    # invalidateTransform
+    # called whenever the origin, direction or a group/repeat/ring
+    # position changes. The matrix is rebuilt when next needed
+    def invalidateTransform(self):
+        self.state.transform=None
 
 
     # get the XY coords of a point on an ellipse
@@ -1136,17 +3242,23 @@ class KiCadParser():
     # pushState
     #
     # saves current state variables on the stateStack
-    # since the state variables are in an object I use deepcopy()
-    # otherwise it'll just push a pointer to the object
+    # the saved frame is left alone and a copy becomes the current
+    # state. StateVars.copy() shares the lists and local variables
+    # so this costs the same however big the stored bodies are
 
     def pushState(self):
-        self.stateStack.append(copy.deepcopy(self.state))
+        self.stateStack.append(self.state)
+        self.state=self.state.copy()
+        self.invalidateTransform()
 
     # popState
     #
     # restores state variables object
     def popState(self):
         self.state=self.stateStack.pop()
+        # the processing flags or direction may have changed since
+        # the saved frame built its matrix
+        self.invalidateTransform()
 
     # getTemplate
     #
@@ -1154,6 +3266,7 @@ class KiCadParser():
     # datafile
     def getTemplate(self,id):
         id=id.strip()
+        self.usesResource("TEMPLATE",id)
         if id in self.template: return self.template[id]
         self.Warning("No template loaded for ID="+id+" check your data file")
         return None
@@ -1181,11 +3294,8 @@ class KiCadParser():
         template = self.getTemplate(id)
         if template is None: return None
 
-        # templates start (type .... so grab the text
-        # after the first (
-        lst=re.findall('^\s*\((\S+)[\s\(]', template)
-
-        if lst[0].upper()==typeWanted.upper(): return template
+        # the type was found when the template was loaded
+        if template.type.upper()==typeWanted.upper(): return template
 
         self.Warning("Requested template "+id+" doesn't appear to be of type "+typeWanted+". Ignored.")
         return None
@@ -1199,60 +3309,107 @@ class KiCadParser():
     # not used but to simplify coding it is passed anyway and if not used
     # the parameter name will be 'unused'
     #
-    # The methods should return a template string with placeholders
-    # substituted or None. If None is returned the loop in makePCB.py
-    # will not write anything to the output file.
+    # The methods should return a BoardItem, a template string with
+    # placeholders substituted or None. If None is returned the loop in
+    # makePCB.py will not write anything to the output file.
     #
     # ######################################################################
 
+    # readFile
+    #
+    # returns the contents of a template file. If the parser was given
+    # a fileCache the file is only read again if it has been changed
+
+    def readFile(self,filename):
+        if self.fileCache is None:
+            with open(filename, "r") as file:
+                return file.read()
+
+        path=os.path.abspath(filename)
+        mtime=os.path.getmtime(path)
+        if path in self.fileCache and self.fileCache[path][0]==mtime:
+            return self.fileCache[path][1]
+
+        with open(path, "r") as file:
+            data=file.read()
+        self.fileCache[path]=(mtime,data)
+        return data
+
     # TEMPLATE,Id,filename
     # loads a specified template from disk
-    def loadTemplate(self,unused,params):
+    def loadTemplate(self,unused,args):
         # line format is TEMPLATE,id,filename
-        id,filename=params.split(",")
+        id,filename=args
         # attempt to load the designated template
         id=id.strip()
         try:
             # already loaded?
             if id in self.template: return None
 
-            file = open(filename, "r")
-            self.template[id] = file.read()
-            file.close()
+            self.template[id] = Template(id,self.readFile(filename))
+            self.resourceHashes[("TEMPLATE",id)]=self.resourceHash(self.template[id].text)
             self.Info("TEMPLATE ID=["+id+"]. Loaded ok.")
+            self.checkPlaceholders(self.template[id])
         except Exception as e:
-            self.Error("Cannot load template [" + id + "]\n" + e.args)
+            self.Error("Cannot load template [" + id + "]\n" + str(e.args))
         finally:
             return None
 
 
+    # checkPlaceholders
+    #
+    # reports placeholders which the template uses but nothing will
+    # fill (they would be left empty) and ones it doesn't use
+    def checkPlaceholders(self,template):
+        if template.id in self.templatePlaceholders:
+            wanted=self.templatePlaceholders[template.id]
+        elif template.type in self.typePlaceholders:
+            wanted=self.typePlaceholders[template.type]
+        else:
+            # don't know how it will be used
+            return
+
+        unknown=[x for x in sorted(template.names) if x not in wanted]
+        unused=[x for x in wanted if x not in template.names]
+
+        if len(unknown)>0:
+            self.Warning("TEMPLATE ID=["+template.id+"] has unknown placeholders %"+"%, %".join(unknown)+"%. They will be left empty.")
+        if len(unused)>0:
+            self.Info("TEMPLATE ID=["+template.id+"] doesn't use placeholders %"+"%, %".join(unused)+"%.")
+
     # ASIS,templateId,filename
     # loads a specified AS-IS template from disk
     # these template have no placeholders so require no processing
-    def loadAsis(self,unused,params):
+    def loadAsis(self,unused,args):
         # line format is TEMPLATE,id,filename
-        id,filename=params.split(",")
+        id,filename=args
         # attempt to load the designated template
 
         try:
             # already loaded?
             if id in self.asis: return None
 
-            file = open(filename, "r")
-            self.asis[id] = file.read()
-            file.close()
+            self.asis[id] = self.readFile(filename)
+            self.noteBoardVersion(self.asis[id])
             self.Info("ASIS ID=["+id+"]. Loaded ok.")
         except Exception as e:
-            self.Error("Cannot load asis template [" + id + "]\n" + e.args)
+            self.Error("Cannot load asis template [" + id + "]\n" + str(e.args))
         finally:
             return None
 
+    # noteBoardVersion
+    # keeps the file version if text is the start of a kicad_pcb file,
+    # with or without the opening bracket, see arcTrackTemplate
+    def noteBoardVersion(self,text):
+        result=self.reBoardVersion.match(text)
+        if result: self.boardVersion=int(result.group(1))
+
     # a kiCad_pcb file has opening and closing brackets we need to get rid of
     # they don't include place holders so they are added to the self.asis dictionary
 
-    def loadKicadPcb(self,unused,params):
+    def loadKicadPcb(self,unused,args):
         # line format is TEMPLATE,id,filename
-        id, filename = params.split(",")
+        id, filename =args
         # attempt to load the designated template
 
         try:
@@ -1261,9 +3418,7 @@ class KiCadParser():
                 self.Warning("KICADPCB id=",id)
                 return None
 
-            file = open(filename, "r")
-            data= file.read()
-            file.close()
+            data=self.readFile(filename)
 
             # does the document begin with '(kicad_pcb'?
             # note that there could be white space before and after the bracket
@@ -1284,19 +3439,20 @@ class KiCadParser():
             # just store what's in between - makePCB will add the starting and ending
             # brackets to the output file
             self.asis[id]=data[x+1:y-1]
+            self.noteBoardVersion(self.asis[id])
 
             self.Info("KiCad pcb id=[" + id + "]. Loaded ok.")
 
         except Exception as e:
-            self.Error("Cannot load KiCad pcb document template [" + id + "]\n" + e.args)
+            self.Error("Cannot load KiCad pcb document template [" + id + "]\n" + str(e.args))
         finally:
             return None
 
 
 
     # SETDIRECTION,X,Y
-    def setDirection(self,unused,params):
-        X,Y=params.split(",")
+    def setDirection(self,unused,args):
+        X,Y=args
 
         # evalNumericParam does variable gathering
         X=self.evalNumericParam(X)
@@ -1314,6 +3470,8 @@ class KiCadParser():
         if Y<0:     self.directionY=-1
         elif Y>0:   self.directionY=1
 
+        self.invalidateTransform()
+
         self.Info("Co-ordinate directions set to X="+str(self.directionX)+" Y="+str(self.directionY))
         return None
 
@@ -1329,8 +3487,8 @@ class KiCadParser():
     # KiCad's drawing origin is somewhere just outside the top-left of the drawing
     #
 
-    def origin(self,unused,params):
-        xOrigin,yOrigin=params.split(",")
+    def origin(self,unused,args):
+        xOrigin,yOrigin=args
 
         xOrigin=self.evalNumericParam(xOrigin)
         yOrigin=self.evalNumericParam(yOrigin)
@@ -1339,8 +3497,12 @@ class KiCadParser():
             self.Warning("Unable to set the ORIGIN because X or Y is unresolved. Ignored.")
             return None
 
+        if self.nanometres:
+            xOrigin,yOrigin=self.snapNm(xOrigin),self.snapNm(yOrigin)
+
         self.state.xOrigin=xOrigin
         self.state.yOrigin=yOrigin
+        self.invalidateTransform()
 
         # also make this available globally
         self.globalVars["xOrigin"]=xOrigin
@@ -1354,12 +3516,12 @@ class KiCadParser():
     # places a via where specified
     #
 
-    def via(self, id, params):
+    def via(self, id, args):
         id=id.strip()
         template = self.validateTemplate(id,"via")
         if template is None: return None
 
-        Xpos, Ypos, Size, Drill, LayerF, LayerB, Net=params.split(",")
+        Xpos, Ypos, Size, Drill, LayerF, LayerB, Net=args
 
         Xpos,Ypos=self.resolveCoords(Xpos,Ypos)
 
@@ -1373,15 +3535,7 @@ class KiCadParser():
             self.cannotAdd("VIA")
             return None
 
-        template = template.replace("%XPOS%", self.strFloat(Xpos))
-        template = template.replace("%YPOS%", self.strFloat(Ypos))
-        template = template.replace("%SIZE%", self.strFloat(Size))
-        template = template.replace("%DRILL%", self.strFloat(Drill))
-        template = template.replace("%LAYERF%", LayerF)
-        template = template.replace("%LAYERB%", LayerB)
-        template = template.replace("%NET%", self.strInt(Net))
-
-        return template
+        return Via(template,Xpos,Ypos,Size,Drill,LayerF,LayerB,Net)
 
     # FIDUCIAL,Ref,Xpos,Ypos,Clearance,Width,Layer
     #
@@ -1389,11 +3543,11 @@ class KiCadParser():
     # normally put in three corners of the layout (even though PCB may not be rectangular
     #
 
-    def fiducial(self,id,params):
+    def fiducial(self,id,args):
         template = self.getTemplate(id)
         if template is None: return None
 
-        Ref, Xpos, Ypos, Clearance, Width, Layer = params.split(",")
+        Ref, Xpos, Ypos, Clearance, Width, Layer =args
         Ref=Ref.strip()
 
         Xpos,Ypos=self.resolveCoords(Xpos,Ypos)
@@ -1407,12 +3561,14 @@ class KiCadParser():
 
         #(Xpos,Ypos) = self.transformXY(Xpos,Ypos) done by resolveCoords
 
-        template = template.replace("%REF%", self.getRef(id,Ref))
-        template = template.replace("%XPOS%", self.strFloat(Xpos))
-        template = template.replace("%YPOS%", self.strFloat(Ypos))
-        template = template.replace("%CLEARANCE%", self.strFloat(Clearance))
-        template = template.replace("%WIDTH%", self.strFloat(Width))
-        template = template.replace("%LAYER%", Layer)
+        template = template.render({
+            "REF":self.getRef(id,Ref),
+            "XPOS":self.strFloat(Xpos),
+            "YPOS":self.strFloat(Ypos),
+            "CLEARANCE":self.strFloat(Clearance),
+            "WIDTH":self.strFloat(Width),
+            "LAYER":Layer
+            })
 
         return template
 
@@ -1420,12 +3576,12 @@ class KiCadParser():
     # place a target at X/Y
     # shape can be 'plus' or 'x' - without the quotes
 
-    def target(self,id,params):
+    def target(self,id,args):
 
         template = self.getTemplate(id)
         if template is None: return None
 
-        Shape, Xpos, Ypos, Size, Width, Layer = params.split(",")
+        Shape, Xpos, Ypos, Size, Width, Layer =args
         Shape=Shape.strip()
 
         Xpos,Ypos=self.resolveCoords(Xpos,Ypos) # does 2D transform too
@@ -1437,12 +3593,14 @@ class KiCadParser():
             self.cannotAdd("TARGET")
             return None
 
-        template = template.replace("%XPOS%", self.strFloat(Xpos))
-        template = template.replace("%YPOS%", self.strFloat(Ypos))
-        template = template.replace("%SHAPE%", Shape)
-        template = template.replace("%SIZE%", self.strFloat(Size))
-        template = template.replace("%WIDTH%", self.strFloat(Width))
-        template = template.replace("%LAYER%", Layer)
+        template = template.render({
+            "XPOS":self.strFloat(Xpos),
+            "YPOS":self.strFloat(Ypos),
+            "SHAPE":Shape,
+            "SIZE":self.strFloat(Size),
+            "WIDTH":self.strFloat(Width),
+            "LAYER":Layer
+            })
 
         return template
 
@@ -1452,12 +3610,12 @@ class KiCadParser():
     # Drill and OuterRadius, InnerWidtha dn OuterWidth are line dimensions
     # Mounting holes can have references.
     #
-    def mounting(self,id,params):
+    def mounting(self,id,args):
 
         template = self.getTemplate(id)
         if template is None: return None
         
-        Ref, Xpos, Ypos, Drill, OuterRadius, InnerWidth, OuterWidth = params.split(",")
+        Ref, Xpos, Ypos, Drill, OuterRadius, InnerWidth, OuterWidth =args
 
         Ref=Ref.strip()
 
@@ -1471,13 +3629,15 @@ class KiCadParser():
             self.cannotAdd("MOUNTING HOLE")
             return None
 
-        template = template.replace("%REF%", self.getRef(id,Ref))
-        template = template.replace("%XPOS%", self.strFloat(Xpos))
-        template = template.replace("%YPOS%", self.strFloat(Ypos))
-        template = template.replace("%DRILL%", self.strFloat(Drill))
-        template = template.replace("%INNERWIDTH%", self.strFloat(InnerWidth))
-        template = template.replace("%OUTERWIDTH%", self.strFloat(OuterWidth))
-        template = template.replace("%OUTERRADIUS%", self.strFloat(OuterRadius))
+        template = template.render({
+            "REF":self.getRef(id,Ref),
+            "XPOS":self.strFloat(Xpos),
+            "YPOS":self.strFloat(Ypos),
+            "DRILL":self.strFloat(Drill),
+            "INNERWIDTH":self.strFloat(InnerWidth),
+            "OUTERWIDTH":self.strFloat(OuterWidth),
+            "OUTERRADIUS":self.strFloat(OuterRadius)
+            })
 
         return template
 
@@ -1488,9 +3648,9 @@ class KiCadParser():
     #
     #################################################
 
-    def graphic(self,id,params):
+    def graphic(self,id,args):
 
-        Shape,Remainder=params.split(",",1)
+        Shape,Remainder=args[0],args[1:]
         Shape=Shape.strip().upper()
 
         if Shape=="LINE":           return self.graphic_line(Remainder)
@@ -1505,9 +3665,9 @@ class KiCadParser():
         self.Warning("Unsupported graphics "+Shape+". Ignored")
         return None
 
-    def graphic_rounded_rect(self,params):
+    def graphic_rounded_rect(self,args):
         # uses GRLINE and GRARC
-        x,y,width,height,radius,LineWidth,Layer=params.split(",")
+        x,y,width,height,radius,LineWidth,Layer=args
 
         x,y=self.resolveCoords(x,y) # bottom left corenr of the rectangle
 
@@ -1526,41 +3686,41 @@ class KiCadParser():
         X1=x+self.directionX*r
         X2=x+self.directionX*(w-r)
         Y2=Y1=y
-        result=self.graphic_line_helper(X1,Y1,X2,Y2,LineWidth,Layer)
+        result=[self.graphic_line_helper(X1,Y1,X2,Y2,LineWidth,Layer)]
         # top line - just Y changes
         Y2=Y1=y+self.directionY*h
-        result = result + "\n" + self.graphic_line_helper(X1,Y1,X2,Y2, LineWidth, Layer)
+        result = result + ["\n", self.graphic_line_helper(X1,Y1,X2,Y2, LineWidth, Layer)]
         # left side top to bottom
         X1=X2=x
         Y1=y+self.directionY*r
         Y2=y+self.directionY*(h-r)
-        result = result + self.graphic_line_helper(X1,Y1,X2,Y2, LineWidth, Layer)
+        result = result + [self.graphic_line_helper(X1,Y1,X2,Y2, LineWidth, Layer)]
         # right hand side - just X changes
         X2=X1=x+self.directionX*w
-        result = result + "\n" + self.graphic_line_helper(X1,Y1,X2, Y2, LineWidth, Layer)
+        result = result + ["\n", self.graphic_line_helper(X1,Y1,X2, Y2, LineWidth, Layer)]
 
         # rounded corners
         #bottom left
         XC=x+self.directionX*r
         YC=y+self.directionY*r
-        result = result +  "\n" +self.graphic_arc_helper(XC, YC,r, 180, 270, LineWidth, Layer, False)
+        result = result + ["\n", self.graphic_arc_helper(XC, YC,r, 180, 270, LineWidth, Layer, False)]
         # bottom right - only X and angle changes
         XC=x+self.directionX*(w-r)
-        result=result +  "\n"  + self.graphic_arc_helper(XC,YC,r,270,360, LineWidth, Layer, False)
+        result=result + ["\n", self.graphic_arc_helper(XC,YC,r,270,360, LineWidth, Layer, False)]
         # top right - only Y changes
         YC=y+self.directionY*(h-r)
-        result = result +  "\n" +self.graphic_arc_helper(XC,YC, r,0, 90, LineWidth, Layer, False)
+        result = result + ["\n", self.graphic_arc_helper(XC,YC, r,0, 90, LineWidth, Layer, False)]
         #top-left - only X changes
         XC = x + self.directionX * r
-        result = result +  "\n" +self.graphic_arc_helper(XC,YC ,r, 90, 180, LineWidth, Layer, False)
+        result = result + ["\n", self.graphic_arc_helper(XC,YC ,r, 90, 180, LineWidth, Layer, False)]
 
         return result
 
 
 
-    def graphic_arc_angle(self,params):
+    def graphic_arc_angle(self,args):
         # don't create a pie
-        Xc, Yc, Radius, startAngle, stopAngle, Width, Layer = params.split(",")
+        Xc, Yc, Radius, startAngle, stopAngle, Width, Layer =args
 
         Xc,Yc=self.resolveCoords(Xc,Yc)
         Radius=self.evalNumericParam(Radius)
@@ -1571,9 +3731,9 @@ class KiCadParser():
 
         return self.graphic_arc_helper(Xc, Yc, Radius, startAngle, stopAngle, Width, Layer, False)
 
-    def graphic_pie(self,params):
+    def graphic_pie(self,args):
         # tell the helper to draw in the radial lines
-        Xc, Yc, Radius, startAngle, stopAngle, Width, Layer = params.split(",")
+        Xc, Yc, Radius, startAngle, stopAngle, Width, Layer =args
         Xc,Yc=self.resolveCoords(Xc,Yc)
         Radius=self.evalNumericParam(Radius)
 
@@ -1621,13 +3781,7 @@ class KiCadParser():
         Xstart, Ystart = self.getCircleXY(Xc, Yc, Radius, startAngle)
         Xend, Yend = self.getCircleXY(Xc, Yc, Radius, stopAngle)
 
-        template = template.replace("%XPOS1%", self.strFloat(Xc))
-        template = template.replace("%YPOS1%", self.strFloat(Yc))
-        template = template.replace("%XPOS2%", self.strFloat(Xstart))
-        template = template.replace("%YPOS2%", self.strFloat(Ystart))
-        template = template.replace("%WIDTH%", self.strFloat(Width))
-        template = template.replace("%LAYER%", Layer)
-        template = template.replace("%ANGLE%", self.strFloat(ArcAngle))
+        result=["\n",GrArc(template,Xc,Yc,Xstart,Ystart,Width,Layer,ArcAngle)]
 
         if makePie:
             # graphic_line will transform lines
@@ -1639,16 +3793,16 @@ class KiCadParser():
             Xend, Yend = self.transformXY(Xend, Yend)
             Xc,Yc=self.transformXY(Xc,Yc)
 
-            params=fmtString.format(Xc,Yc,Xstart,Ystart,Width,Layer)
-            template=template+self.graphic_line(params)
-            params=fmtString.format(Xc,Yc,Xend,Yend,Width,Layer)
-            template=template+self.graphic_line(params)
+            args=fmtString.format(Xc,Yc,Xstart,Ystart,Width,Layer).split(",")
+            result.append(self.graphic_line(args))
+            args=fmtString.format(Xc,Yc,Xend,Yend,Width,Layer).split(",")
+            result.append(self.graphic_line(args))
 
-        return "\n"+template
+        return result
 
-    def graphic_rectangle(self, params):
+    def graphic_rectangle(self, args):
 
-        X, Y, Width, Height, LineWidth, Layer = params.split(",")
+        X, Y, Width, Height, LineWidth, Layer =args
 
         X, Y = self.resolveCoords(X, Y)
         Width = self.directionX * self.evalNumericParam(Width)
@@ -1667,12 +3821,10 @@ class KiCadParser():
     def graphic_rect_helper(self, X, Y, Width, Height, LineWidth, Layer):
         # 4 lines - uses graphic_line_helper
 
-        result = self.graphic_line_helper(X, Y, X + Width, Y, LineWidth, Layer)
-        result = result + self.graphic_line_helper(X + Width, Y, X + Width, Y + Height, LineWidth, Layer)
-        result = result + self.graphic_line_helper(X + Width, Y + Height, X, Y + Height, LineWidth, Layer)
-        result = result + self.graphic_line_helper(X, Y + Height, X, Y, LineWidth, Layer)
-
-        return result
+        return [self.graphic_line_helper(X, Y, X + Width, Y, LineWidth, Layer),
+                self.graphic_line_helper(X + Width, Y, X + Width, Y + Height, LineWidth, Layer),
+                self.graphic_line_helper(X + Width, Y + Height, X, Y + Height, LineWidth, Layer),
+                self.graphic_line_helper(X, Y + Height, X, Y, LineWidth, Layer)]
 
 
     # graphic_text X,Y,Size,Thickness,Layer,text-to-write
@@ -1680,14 +3832,15 @@ class KiCadParser():
     # draws text at the given position. text-to-write MUST not contain
     # double quotes
 
-    def graphic_text(self,params):
+    def graphic_text(self,args):
 
         template = self.validateTemplate("GRTEXT", "gr_text")
         if template is None: return None
 
         # X,Y,Size,Thickness,Layer,the text to display
         # txt is the remainder of the line whatever it contains
-        Justify,Xpos,Ypos,Angle,Size,Thickness,Layer,Text=params.split(",",7)
+        Justify,Xpos,Ypos,Angle,Size,Thickness,Layer=args[:7]
+        Text=",".join(args[7:])
 
         Xpos,Ypos=self.resolveCoords(Xpos,Ypos)
 
@@ -1717,28 +3870,19 @@ class KiCadParser():
 
         Angle=self.transformAngle(Angle)
 
-        template = template.replace("%JUSTIFY%", Justify)
-        template = template.replace("%ANGLE%", self.strFloat(Angle))
-        template = template.replace("%XPOS%", self.strFloat(Xpos))
-        template = template.replace("%YPOS%", self.strFloat(Ypos))
-        template = template.replace("%SIZE%", self.strFloat(Size))
-        template = template.replace("%THICKNESS%", self.strFloat(Thickness))
-        template = template.replace("%LAYER%", Layer)
-        template = template.replace("%TEXT%", Text)
-
-        return template
+        return GrText(template,Justify,Angle,Xpos,Ypos,Size,Thickness,Layer,Text)
 
 
     # graphics_circle,X,Y,Radius,Width,Layer
     # create a graphics circle at X,Y of given radius
     #
-    def graphic_circle(self,params):
+    def graphic_circle(self,args):
 
         template = self.validateTemplate("GRCIRCLE", "gr_circle")
         if template is None: return None
 
         # KiCad requires both X1/Y1 and X2/Y2
-        Xpos1, Ypos1, Radius, Width, Layer = params.split(",")
+        Xpos1, Ypos1, Radius, Width, Layer =args
 
         Xpos1,Ypos1=self.resolveCoords(Xpos1,Ypos1)
         Radius=self.evalNumericParam(Radius)
@@ -1752,20 +3896,22 @@ class KiCadParser():
         Xpos2 = Xpos1 + Radius
         Ypos2 = Ypos1
 
-        template = template.replace("%XPOS1%", self.strFloat(Xpos1))
-        template = template.replace("%YPOS1%", self.strFloat(Ypos1))
-        template = template.replace("%XPOS2%", self.strFloat(Xpos2))
-        template = template.replace("%YPOS2%", self.strFloat(Ypos2))
-        template = template.replace("%WIDTH%", self.strFloat(Width))
-        template = template.replace("%LAYER%", Layer)
+        template = template.render({
+            "XPOS1":self.strFloat(Xpos1),
+            "YPOS1":self.strFloat(Ypos1),
+            "XPOS2":self.strFloat(Xpos2),
+            "YPOS2":self.strFloat(Ypos2),
+            "WIDTH":self.strFloat(Width),
+            "LAYER":Layer
+            })
 
         return template
 
     # graphics_line,Xpos1, Ypos1, Xpos2, Ypos2, Width, Layer
 
-    def graphic_line(self,params):
+    def graphic_line(self,args):
 
-        Xpos1, Ypos1, Xpos2, Ypos2, Width,Layer = params.split(",")
+        Xpos1, Ypos1, Xpos2, Ypos2, Width,Layer =args
 
         Xpos1, Ypos1 = self.resolveCoords(Xpos1, Ypos1)
         Xpos2, Ypos2 = self.resolveCoords(Xpos2, Ypos2)
@@ -1792,19 +3938,12 @@ class KiCadParser():
         template = self.validateTemplate("GRLINE", "gr_line")
         if template is None: return None
 
-        template = template.replace("%XPOS1%", self.strFloat(X1))
-        template = template.replace("%YPOS1%", self.strFloat(Y1))
-        template = template.replace("%XPOS2%", self.strFloat(X2))
-        template = template.replace("%YPOS2%", self.strFloat(Y2))
-        template = template.replace("%WIDTH%", self.strFloat(Width))
-        template = template.replace("%LAYER%", Layer)
-
-        return template
+        return GrLine(template,X1,Y1,X2,Y2,Width,Layer)
 
     # graphic_grid
     # uses graphic_line_helper and graphic_rect_helper
-    def graphic_grid(self, params):
-        Xpos, Ypos, Width, Height, Hgaps, Vgaps, BorderWidth, LineWidth, Layer = params.split(",")
+    def graphic_grid(self, args):
+        Xpos, Ypos, Width, Height, Hgaps, Vgaps, BorderWidth, LineWidth, Layer =args
 
         Xpos, Ypos = self.resolveCoords(Xpos, Ypos)
         Width = self.evalNumericParam(Width)
@@ -1819,9 +3958,14 @@ class KiCadParser():
             self.cannotAdd("GRAPHIC GRID")
             return None
 
+        return self.graphic_grid_items(Xpos, Ypos, Width, Height, Hgaps, Vgaps, BorderWidth, LineWidth, Layer)
+
+    # generator which draws the grid one line at a time
+    def graphic_grid_items(self, Xpos, Ypos, Width, Height, Hgaps, Vgaps, BorderWidth, LineWidth, Layer):
+
         # draw the border first
 
-        result = self.graphic_rect_helper(Xpos, Ypos, self.directionX*Width, self.directionY*Height, BorderWidth, Layer)
+        yield self.graphic_rect_helper(Xpos, Ypos, self.directionX*Width, self.directionY*Height, BorderWidth, Layer)
 
         # grid is drawn INSIDE the border to prevent the
         # border bloating if the gridlines are very thick
@@ -1845,13 +3989,14 @@ class KiCadParser():
         if drawVertical:
             for x in range(Hgaps - 1):
                 X = Xpos + self.directionX*hGapSize * (x + 1)
-                result = result + "\n" + self.graphic_line_helper(X, Ypos, X, Ypos + self.directionY*Height, LineWidth, Layer)
+                yield "\n"
+                yield self.graphic_line_helper(X, Ypos, X, Ypos + self.directionY*Height, LineWidth, Layer)
         if drawHorizontal:
             # now the horizontal lines
             for y in range(Vgaps - 1):
                 Y = Ypos + self.directionY*vGapSize * (y + 1)
-                result = result + "\n" + self.graphic_line_helper(Xpos, Y, Xpos + self.directionX*Width, Y, LineWidth, Layer)
-        return result
+                yield "\n"
+                yield self.graphic_line_helper(Xpos, Y, Xpos + self.directionX*Width, Y, LineWidth, Layer)
 
     ###############################################################
     # Zones and Keepouts
@@ -1860,14 +4005,14 @@ class KiCadParser():
     #
     # used to route calls
 
-    def zone(self,id,params):
+    def zone(self,id,args):
 
         self.ZoneTemplate=id.strip().upper()
 
         # zone_poly is called by each alternative
         # and checks the template exists
 
-        Shape,Remainder=params.split(",",1)
+        Shape,Remainder=args[0],args[1:]
         Shape=Shape.strip().upper()
 
         if   Shape=="RECT":         return self.zone_rect(Remainder)
@@ -1890,8 +4035,8 @@ class KiCadParser():
     #
     ######################################
 
-    def zone_rect(self,params):
-        X, Y, Width, Height, Net, NetName, Layer, HatchType, HatchEdge, Clearance, MinThickness, FillArcSegment, ThermalGap,FillThermalBridge=params.split(",")
+    def zone_rect(self,args):
+        X, Y, Width, Height, Net, NetName, Layer, HatchType, HatchEdge, Clearance, MinThickness, FillArcSegment, ThermalGap,FillThermalBridge=args
 
         # build a  list of co-ords for corners and pass to zone_poly
 
@@ -1917,8 +4062,9 @@ class KiCadParser():
         return self.zone_poly_helper(Net, NetName, Layer, HatchType, HatchEdge, Clearance, MinThickness, FillArcSegment,ThermalGap, FillThermalBridge,coords)
 
     # create a zone based on a list of coordinates
-    def zone_polylist(self,params):
-        ListName,X,Y,Net, NetName, Layer, HatchType, HatchEdge, Clearance, MinThickness, FillArcSegment, ThermalGap,FillThermalBridge=params.split(",")
+    def zone_polylist(self,args):
+        ListName,X,Y,Net, NetName, Layer, HatchType, HatchEdge, Clearance, MinThickness, FillArcSegment, ThermalGap,FillThermalBridge=args
+        self.usesResource("LIST",ListName)
         if ListName not in self.list:
             self.Warning("Named list "+ListName+" hasn't been loaded for zone polylist. Zone ignored.")
 
@@ -1927,18 +4073,23 @@ class KiCadParser():
             self.cannotAdd("ZONE POLYLIST")
             return None
 
-        # list is expected to be a list of tuples
-        coords=[]
-        for xyPair in self.list[ListName]:
-            (px,py)=xyPair
-            px,py=self.directionX*float(px),self.directionY*float(py)
-            coords.append((px+Y,py+Y))
+        # list is expected to be a list of X,Y pairs
+        xs,ys=self.list[ListName].numericColumns(2)
+        xs=self.scaleOffset(xs,self.directionX,Y)
+        ys=self.scaleOffset(ys,self.directionY,Y)
 
-        return self.zone_poly_helper(Net, NetName, Layer, HatchType, HatchEdge, Clearance, MinThickness, FillArcSegment,
-                                     ThermalGap, FillThermalBridge, coords)
+        return self.zone_xy_helper(Net, NetName, Layer, HatchType, HatchEdge, Clearance, MinThickness, FillArcSegment,
+                                   ThermalGap, FillThermalBridge, xs, ys)
 
-    def zone_roundedrect(self,params):
-        X,Y,Width,Height,Radius,Smooth,Net, NetName, Layer, HatchType, HatchEdge, Clearance, MinThickness, FillArcSegment,ThermalGap, FillThermalBridge=params.split(",")
+    # scaleOffset
+    # returns an array of scale*x+offset for every x in the array values
+    def scaleOffset(self,values,scale,offset):
+        if self.useNumpy:
+            return numpy.frombuffer(values)*scale+offset
+        return array("d",[scale*x+offset for x in values])
+
+    def zone_roundedrect(self,args):
+        X,Y,Width,Height,Radius,Smooth,Net, NetName, Layer, HatchType, HatchEdge, Clearance, MinThickness, FillArcSegment,ThermalGap, FillThermalBridge=args
 
         # build a  list of co-ords for corners and pass to zone_poly
 
@@ -2033,10 +4184,10 @@ class KiCadParser():
 
 
 
-    def zone_donut(self,params):
+    def zone_donut(self,args):
         # circular donut - possibly with a cutout
 
-        cx,cy,innerRadius,outerRadius,startAngle,stopAngle,Smooth,Net, NetName, Layer, Hatch, HatchEdge, Clearance, MinThickness, ArcSegments,ThermalGap, ThermalBridgeWidths=params.split(",")
+        cx,cy,innerRadius,outerRadius,startAngle,stopAngle,Smooth,Net, NetName, Layer, Hatch, HatchEdge, Clearance, MinThickness, ArcSegments,ThermalGap, ThermalBridgeWidths=args
 
         #cx,cy=self.evalNumericParam(cx),self.evalNumericParam(cy)
         cx, cy = self.resolveCoords(cx, cy)
@@ -2056,8 +4207,8 @@ class KiCadParser():
 
         stepAngle = abs(stopAngle - startAngle) / Smooth
 
-        # build the coordinate list - must follow in correct order
-        coords=[]
+        # build the coordinate arrays - must follow in correct order
+        xs,ys=array("d"),array("d")
 
         # remember this so we can close the poly at the end to stop leaking
         startX, startY = self.getCircleXY(cx, cy, innerR, startAngle)
@@ -2067,7 +4218,8 @@ class KiCadParser():
         stepAngle=(stopAngle-startAngle)/Smooth
         for step in range(Smooth+1):
             X,Y=self.getCircleXY(cx,cy,innerR,angle)
-            coords.append((X,Y))
+            xs.append(X)
+            ys.append(Y)
             angle = angle + stepAngle
 
         # add the outer circle
@@ -2075,16 +4227,18 @@ class KiCadParser():
         angle=stopAngle
         for step in range(Smooth+1):
             X,Y=self.getCircleXY(cx, cy, outerR, angle)
-            coords.append((X,Y))
+            xs.append(X)
+            ys.append(Y)
             angle=angle-stepAngle
 
-        coords.append((startX, startY)) # close the shape
+        xs.append(startX) # close the shape
+        ys.append(startY)
 
 
-        return self.zone_poly_helper(Net, NetName, Layer, Hatch, HatchEdge, Clearance, MinThickness, ArcSegments,ThermalGap, ThermalBridgeWidths, coords)
+        return self.zone_xy_helper(Net, NetName, Layer, Hatch, HatchEdge, Clearance, MinThickness, ArcSegments,ThermalGap, ThermalBridgeWidths, xs, ys)
 
-    def zone_cross(self,params):
-        X, Y, Width, Height, Thickness,Net, NetName, Layer, HatchType, HatchEdge, Clearance, MinThickness, ArcSegments, ThermalGap,ThermalBridgeWidths = params.split(",")
+    def zone_cross(self,args):
+        X, Y, Width, Height, Thickness,Net, NetName, Layer, HatchType, HatchEdge, Clearance, MinThickness, ArcSegments, ThermalGap,ThermalBridgeWidths =args
 
         # for a cross whose bars are Thickness thick LOL
 
@@ -2130,8 +4284,8 @@ class KiCadParser():
                                      ThermalGap, ThermalBridgeWidths, coords)
 
 
-    def zone_hollow_rect_centred(self,params):
-        X, Y, outerW,outerH,innerW,innerH,Net, NetName, Layer, Hatch, HatchEdge, Clearance, MinThickness, ArcSegments, ThermalGap,ThermalBridgeWidths = params.split(",")
+    def zone_hollow_rect_centred(self,args):
+        X, Y, outerW,outerH,innerW,innerH,Net, NetName, Layer, Hatch, HatchEdge, Clearance, MinThickness, ArcSegments, ThermalGap,ThermalBridgeWidths =args
 
         X, Y = self.resolveCoords(X, Y)
         outerW,outerH=self.evalNumericParam(outerW),self.evalNumericParam(outerH)
@@ -2171,8 +4325,8 @@ class KiCadParser():
         return self.zone_poly_helper(Net, NetName, Layer, Hatch, HatchEdge, Clearance, MinThickness, ArcSegments, ThermalGap,ThermalBridgeWidths,coords)
 
 
-    def zone_circle(self,params):
-        X,Y,Radius,Smooth,Net, NetName, Layer, Hatch, HatchEdge, Clearance, MinThickness, ArcSegments, ThermalGap,ThermalBridgeWidths=params.split(",")
+    def zone_circle(self,args):
+        X,Y,Radius,Smooth,Net, NetName, Layer, Hatch, HatchEdge, Clearance, MinThickness, ArcSegments, ThermalGap,ThermalBridgeWidths=args
 
         # build a  list of co-ords for corners and pass to zone_poly_helper (checks Net and other params)
         X, Y = self.resolveCoords(X, Y)
@@ -2184,18 +4338,19 @@ class KiCadParser():
             self.cannotAdd("ZONE CIRCLE")
             return None
 
-        coordList=[]
+        xs,ys=array("d"),array("d")
         for step in range(Smooth):
             angle=step*stepAngle
             x,y=self.getCircleXY(X, Y, Radius, angle)
-            coordList.append((x,y))
+            xs.append(x)
+            ys.append(y)
 
-        return self.zone_poly_helper(Net, NetName, Layer, Hatch, HatchEdge, Clearance, MinThickness, ArcSegments, ThermalGap,ThermalBridgeWidths,coordList)
+        return self.zone_xy_helper(Net, NetName, Layer, Hatch, HatchEdge, Clearance, MinThickness, ArcSegments, ThermalGap,ThermalBridgeWidths,xs,ys)
 
     # zone_pie
 
-    def zone_pie(self,params):
-        X,Y,Radius,startAngle,stopAngle,Smooth, Net, NetName, Layer, Hatch, HatchEdge, Clearance, MinThickness, ArcSegments, ThermalGap,ThermalBridgeWidths=params.split(",")
+    def zone_pie(self,args):
+        X,Y,Radius,startAngle,stopAngle,Smooth, Net, NetName, Layer, Hatch, HatchEdge, Clearance, MinThickness, ArcSegments, ThermalGap,ThermalBridgeWidths=args
 
         # build a  list of co-ords for corners and pass to zone_poly
         Cx=self.evalNumericParam(X)
@@ -2232,14 +4387,14 @@ class KiCadParser():
     # zone_poly
     # checks params, bulds an XY point list and hands off to zone_poly_helper
 
-    def zone_poly(self,params):
+    def zone_poly(self,args):
 
         # there can be a variable number of XY coords
-        Net, NetName, Layer, HatchType, HatchEdge, Clearance, MinThickness, ArcSegments, ThermalGap,ThermalBridgeWidth,Coords = params.split(",")
+        Net, NetName, Layer, HatchType, HatchEdge, Clearance, MinThickness, ArcSegments, ThermalGap,ThermalBridgeWidth =args[:10]
 
         # zone_poly_helper resolves all params, coords are tansformed here
 
-        coordList=Coords.split(",")
+        coordList=args[10:]
 
         # process the XY pairs
         if len(coordList)%2!=0:
@@ -2265,6 +4420,16 @@ class KiCadParser():
     # parameters
 
     def zone_poly_helper(self,Net,NetName,Layer,HatchType,HatchEdge,Clearance,MinThickness,ArcSegments,ThermalGap,ThermalBridgeWidth,CoordList):
+        xs=array("d",[x for x,y in CoordList])
+        ys=array("d",[y for x,y in CoordList])
+        return self.zone_xy_helper(Net,NetName,Layer,HatchType,HatchEdge,Clearance,MinThickness,ArcSegments,ThermalGap,ThermalBridgeWidth,xs,ys)
+
+    # zone_xy_helper
+    #
+    # does the work for zone_poly_helper. The X and Y coordinates are
+    # passed as separate arrays, shapes with a lot of points build these
+    # directly rather than a list of (x,y) pairs
+    def zone_xy_helper(self,Net,NetName,Layer,HatchType,HatchEdge,Clearance,MinThickness,ArcSegments,ThermalGap,ThermalBridgeWidth,xs,ys):
 
         # could be ZONE or KEEPOUT being used as the template
         template = self.getTemplate(self.zoneTemplate)
@@ -2293,31 +4458,35 @@ class KiCadParser():
             self.Warning("Zone ArcSegments must be 16 or 32 - using 16")
             ArcSegments=16
 
-        template = template.replace("%NET%", str(Net))
-        template = template.replace("%NETNAME%", NetName)
-        template = template.replace("%LAYER%", Layer)
-        template = template.replace("%HATCHTYPE%", HatchType)
-        template = template.replace("%HATCHEDGE%", self.strFloat(HatchEdge))
-        template = template.replace("%CLEARANCE%", self.strFloat(Clearance))
-        template = template.replace("%MINTHICKNESS%", self.strFloat(MinThickness))
-        template = template.replace("%ARCSEGMENTS%", self.strInt(ArcSegments))
-        template = template.replace("%THERMALGAP%", self.strFloat(ThermalGap))
-        template = template.replace("%THERMALBRIDGEWIDTH%", self.strFloat(ThermalBridgeWidth))
-
-        # build the XY points in a string which is a series of coords like this: (xy 1.25 5.76)
-        # the coordinate have not yet been transformed so we have to do it
-        fmtCoords="(xy "+self.fmtFloat+" "+self.fmtFloat+") "
-        XYpoints=""
-        Counter=0
-        for (x,y) in CoordList:
-            XYpoints=XYpoints+fmtCoords.format(x,y)
-            Counter=(Counter+1)%5
-            if Counter==0:
-                XYpoints=XYpoints+"\n"
-
-        template = template.replace("%XYPOINTS%", XYpoints)
+        # the points are formatted as the zone is written out, see xyPointsItems
+        return Zone(template,Net,NetName,Layer,HatchType,HatchEdge,Clearance,MinThickness,
+                    ArcSegments,ThermalGap,ThermalBridgeWidth,xs,ys)
 
-        return template
+    # xyPointsItems
+    #
+    # generator which formats the zone points five to a line. Each
+    # chunk of lines is formatted by a single % operation
+    def xyPointsItems(self,xs,ys,linesPerChunk=200):
+        fmt=self.floatFormat.slot
+        fmtCoords="(xy "+fmt+" "+fmt+") "
+        fmtLine=fmtCoords*5+"\n"
+        fmtChunk=fmtLine*linesPerChunk
+        points=5*linesPerChunk
+
+        n=len(xs)
+        for start in range(0,n,points):
+            end=min(n,start+points)
+
+            # x0,y0,x1,y1...
+            values=[0.0]*(2*(end-start))
+            values[0::2]=xs[start:end].tolist()
+            values[1::2]=ys[start:end].tolist()
+
+            if end-start==points:
+                yield self.floatFormat.fill(fmtChunk,values)
+            else:
+                count=end-start
+                yield self.floatFormat.fill(fmtLine*(count//5)+fmtCoords*(count%5),values)
 
 
     ##################################################################
@@ -2327,14 +4496,14 @@ class KiCadParser():
     # note that segment_line is called to create arc segments
     # segment_line is responsible for adjusting XY offsets
     #
-    def segment(self,id,params):
+    def segment(self,id,args):
 
         # all segment_xxx use the same template
 
         template = self.validateTemplate("SEGMENT", "segment")
         if template is None: return None
 
-        Shape,Remainder=params.split(",",1)
+        Shape,Remainder=args[0],args[1:]
         Shape=Shape.strip().upper()
 
         if Shape=="LINE":       return self.segment_line(Remainder,template)
@@ -2351,8 +4520,8 @@ class KiCadParser():
     #
     ################################################
 
-    def segment_grid(self,params,template):
-        Xpos,Ypos,Width,Height,Hgaps,Vgaps,BorderWidth,LineWidth,Layer,Net=params.split(",")
+    def segment_grid(self,args,template):
+        Xpos,Ypos,Width,Height,Hgaps,Vgaps,BorderWidth,LineWidth,Layer,Net=args
 
         Xpos,Ypos=self.resolveCoords(Xpos,Ypos) # transforms Xpos,Ypos
 
@@ -2374,10 +4543,15 @@ class KiCadParser():
         Width=self.directionX*Width
         Height=self.directionY*Height
 
+        return self.segment_grid_items(Xpos,Ypos,Width,Height,Hgaps,Vgaps,BorderWidth,LineWidth,Layer,Net,template)
+
+    # generator which draws the grid one segment at a time
+    def segment_grid_items(self,Xpos,Ypos,Width,Height,Hgaps,Vgaps,BorderWidth,LineWidth,Layer,Net,template):
+
         # draw the border first
         # segment_rect_helper doesn't do any X/Y translations
 
-        result=self.segment_rect_helper(Xpos,Ypos,Width,Height,BorderWidth,Layer,Net,template)
+        yield self.segment_rect_helper(Xpos,Ypos,Width,Height,BorderWidth,Layer,Net,template)
 
         # grid is drawn INSIDE the border to prevent the
         # border bloating if the gridlines are very thick
@@ -2403,22 +4577,23 @@ class KiCadParser():
             hGapSize=Width/Hgaps
             for x in range(Hgaps-1):
                 X=Xpos+hGapSize*(x+1)
-                result=result+"\n"+self.segment_line_helper(X,Ypos,X,Ypos+Height,LineWidth,Layer,Net,template)
+                yield "\n"
+                yield self.segment_line_helper(X,Ypos,X,Ypos+Height,LineWidth,Layer,Net,template)
         if drawHoriz:
             # now the horizontal lines
             vGapSize=Height/Vgaps
             for y in range(Vgaps-1):
                 Y=Ypos+vGapSize*(y+1)
-                result=result+"\n"+self.segment_line_helper(Xpos,Y,Xpos+Width,Y,LineWidth,Layer,Net,template)
-        return result
+                yield "\n"
+                yield self.segment_line_helper(Xpos,Y,Xpos+Width,Y,LineWidth,Layer,Net,template)
 
     # segment_circle
     # draw a circle composed of track segments
     # this will be editable in pcbnew
 
-    def segment_circle(self,params,template):
+    def segment_circle(self,args,template):
 
-        Xpos,Ypos,Radius,NumSegments,Width,Layer,Net=params.split(",")
+        Xpos,Ypos,Radius,NumSegments,Width,Layer,Net=args
 
         NumSegments=int(self.evalNumericParam(NumSegments))
         Radius=self.evalNumericParam(Radius)
@@ -2429,37 +4604,43 @@ class KiCadParser():
             self.cannotAdd("SEGMENT CIRCLE")
             return None
 
+        arcTemplate=self.arcTrackTemplate(360.0,NumSegments)
+        if arcTemplate is not None:
+            return self.track_arc_items(cx,cy,Radius,0.0,360.0,Width,Layer,Net,arcTemplate)
+
         # segments are straight tracks between X0,Y0 and X1,Y1
         # we create a circle using very short segments
         # or a spiders web using fewer segments
 
+        return self.segment_circle_items(cx,cy,Radius,NumSegments,Width,Layer,Net,template)
+
+    # generator which draws the circle one segment at a time
+    def segment_circle_items(self,cx,cy,Radius,NumSegments,Width,Layer,Net,template):
         X0=cx+Radius
         Y0=cy
         stepAngle=360/NumSegments # convert to radians
         Angle=stepAngle
-        result=""
 
         for seg in range(NumSegments):
             X1,Y1=self.getCircleXY(cx,cy,Radius,Angle)
-            result=result+"\n"+self.segment_line_helper(X0, Y0, X1, Y1, Width, Layer, Net,template)
+            yield "\n"
+            yield self.segment_line_helper(X0, Y0, X1, Y1, Width, Layer, Net,template)
             Angle=Angle+stepAngle
             X0=X1
             Y0=Y1
 
-        return result
-
 
     # segment_arc
     #
     # draw an arc composed of segments
 
-    def segment_arc(self, params,template):
+    def segment_arc(self, args,template):
 
         # XY Parameters describe two lines (X1,Y1->X2,Y2) and (X3,Y3->X4,Y4)
         # these are used in order to determine the centre and radius of an arc
         # an arc will be drawn between X2,Y2 and X3,Y3
 
-        CX,CY,Radius,startAngle,stopAngle,NumSegments,Width,Layer,Net=params.split(",")
+        CX,CY,Radius,startAngle,stopAngle,NumSegments,Width,Layer,Net=args
 
         CX,CY=self.resolveCoords(CX,CY)
         Radius=self.evalNumericParam(Radius)
@@ -2483,20 +4664,76 @@ class KiCadParser():
 
 
         NumSegments=int(self.evalNumericParam(NumSegments))
+
+        # an arc with no length is left to the segments as before
+        arcTemplate=self.arcTrackTemplate(stopAngle-startAngle,NumSegments)
+        if arcTemplate is not None and stopAngle>startAngle:
+            return self.track_arc_items(CX,CY,Radius,startAngle,stopAngle,Width,Layer,Net,arcTemplate)
+
+        return self.segment_arc_items(CX,CY,Radius,startAngle,stopAngle,NumSegments,Width,Layer,Net,template)
+
+    # generator which draws the arc one segment at a time
+    def segment_arc_items(self,CX,CY,Radius,startAngle,stopAngle,NumSegments,Width,Layer,Net,template):
         stepAngle=abs(stopAngle-startAngle)/NumSegments
 
         X0,Y0=self.getCircleXY(CX,CY,Radius,startAngle)
         Angle=startAngle+stepAngle
-        result=""
 
         for seg in range(NumSegments):
             X1,Y1 = self.getCircleXY(CX,CY, Radius,Angle)
-            result = result + "\n"+self.segment_line_helper(X0, Y0, X1, Y1, Width, Layer, Net,template)
+            yield "\n"
+            yield self.segment_line_helper(X0, Y0, X1, Y1, Width, Layer, Net,template)
             Angle = Angle + stepAngle
             X0 = X1
             Y0 = Y1
 
-        return result
+    # arcTrackTemplate
+    #
+    # returns the ARCTRACK template if an arc of sweep degrees drawn with
+    # NumSegments should be drawn as arc tracks or None if it should be
+    # drawn with segments. Arc tracks have to be turned on by setArcTracks
+    # and need an ARCTRACK template of type arc. If the board's header is
+    # from a KiCad older than 6 segments are used anyway. The first time
+    # segments are used instead there is a warning
+
+    def arcTrackTemplate(self,sweep,NumSegments):
+        if not self.arcTracks: return None
+
+        # too few segments to be meant as a curve
+        if NumSegments<=0 or abs(sweep)>NumSegments*self.arcTrackMaxStep: return None
+
+        self.usesResource("TEMPLATE","ARCTRACK")
+        template=self.template.get("ARCTRACK")
+        if template is not None and template.type.lower()!="arc": template=None
+
+        if template is not None and (self.boardVersion is None or self.boardVersion>=self.arcTrackVersion):
+            return template
+
+        if not self.arcTrackFallback:
+            self.arcTrackFallback=True
+            if template is None:
+                self.Warning("Arc tracks need an ARCTRACK template of type arc. Using segments.")
+            else:
+                self.Warning("The board is version "+str(self.boardVersion)+", arc tracks need version "+
+                             str(self.arcTrackVersion)+" (KiCad 6). Using segments.")
+        return None
+
+    # generator which draws an arc as arc tracks. Each is at most 180
+    # degrees, so a whole circle is two, as KiCad can't tell which way
+    # round an arc goes if it starts and ends at the same point
+    def track_arc_items(self,CX,CY,Radius,startAngle,stopAngle,Width,Layer,Net,template):
+        pieces=int(math.ceil((stopAngle-startAngle)/180.0))
+        stepAngle=(stopAngle-startAngle)/pieces
+
+        X0,Y0=self.getCircleXY(CX,CY,Radius,startAngle)
+        for piece in range(pieces):
+            Angle=startAngle+stepAngle*(piece+1)
+            Xm,Ym=self.getCircleXY(CX,CY,Radius,Angle-stepAngle/2)
+            X1,Y1=self.getCircleXY(CX,CY,Radius,Angle)
+            yield "\n"
+            yield TrackArc(template,X0,Y0,Xm,Ym,X1,Y1,Width,Layer,Net)
+            X0=X1
+            Y0=Y1
 
     # segment_line_helper
     # can be called from numerous places
@@ -2511,21 +4748,13 @@ class KiCadParser():
             # which may be concatenating values
             return ""
 
-        template = template.replace("%XPOS1%", self.strFloat(X0))
-        template = template.replace("%YPOS1%", self.strFloat(Y0))
-        template = template.replace("%XPOS2%", self.strFloat(X1))
-        template = template.replace("%YPOS2%", self.strFloat(Y1))
-        template = template.replace("%LAYER%", Layer)
-        template = template.replace("%WIDTH%", self.strFloat(Width))
-        template = template.replace("%NET%", self.strInt(Net))
-
-        return template
+        return Segment(X0,Y0,X1,Y1,Width,Layer,Net)
 
         # segment_line
 
-    def segment_line(self, params, template):
+    def segment_line(self, args, template):
 
-        X0, Y0, X1, Y1, Width, Layer, Net = params.split(",")
+        X0, Y0, X1, Y1, Width, Layer, Net =args
 
         X0,Y0=self.resolveCoords(X0,Y0)
         X1,Y1=self.resolveCoords(X1,Y1)
@@ -2544,38 +4773,24 @@ class KiCadParser():
         # cannot use segment_line helper because it will transform
         # saveXYVar values - which we don't want
         #
-        template = template.replace("%XPOS1%", self.strFloat(X0))
-        template = template.replace("%YPOS1%", self.strFloat(Y0))
-        template = template.replace("%XPOS2%", self.strFloat(X1))
-        template = template.replace("%YPOS2%", self.strFloat(Y1))
-
-        template = template.replace("%LAYER%", Layer)
-        template = template.replace("%WIDTH%", self.strFloat(Width))
-        template = template.replace("%NET%", self.strInt(Net))
-
-        return template
+        return Segment(X0,Y0,X1,Y1,Width,Layer,Net)
 
     # segment_rect_helper
     # used by GRID,CIRCLE,ARC,LINE and RECT
     def segment_rect_helper(self,X, Y, Width,Height,LineWidth,Layer,Net,template):
         # draw a box outline
 
-        result = self.segment_line_helper(X, Y, X + Width, Y, LineWidth, Layer, Net, template)
-        result = result + "\n" + self.segment_line_helper(X, Y+Height, X + Width, Y + Height, LineWidth, Layer, Net,
-                                                          template)
-        result = result + "\n" + self.segment_line_helper(X + Width, Y, X + Width, Y + Height, LineWidth, Layer, Net,
-                                                          template)
-
-        result = result + "\n" + self.segment_line_helper(X, Y + Height, X, Y, LineWidth, Layer, Net, template)
-
-        return result
+        return [self.segment_line_helper(X, Y, X + Width, Y, LineWidth, Layer, Net, template),
+                "\n", self.segment_line_helper(X, Y+Height, X + Width, Y + Height, LineWidth, Layer, Net, template),
+                "\n", self.segment_line_helper(X + Width, Y, X + Width, Y + Height, LineWidth, Layer, Net, template),
+                "\n", self.segment_line_helper(X, Y + Height, X, Y, LineWidth, Layer, Net, template)]
 
     # segment_rect
     #
     # creates a rectangular segment
     #
-    def segment_rect(self,params,template):
-        X, Y, Width,Height,LineWidth,Layer,Net= params.split(",")
+    def segment_rect(self,args,template):
+        X, Y, Width,Height,LineWidth,Layer,Net=args
 
         X,Y=self.resolveCoords(X,Y)
         Width=self.evalNumericParam(Width)
@@ -2602,13 +4817,13 @@ class KiCadParser():
     #
     # The components ALL have the same parameters, if not we'll have to extend this here
 
-    def component(self, id, params):
+    def component(self, id, args):
 
         # components use module templates which all begin with (module
         template=self.validateTemplate(id,"module")
         if template is None: return None
         
-        Ref, Angle, Xpos, Ypos, Layer = params.split(",")
+        Ref, Angle, Xpos, Ypos, Layer =args
 
         Ref=self.getRef(id.strip(), Ref)
         Xpos,Ypos=self.resolveCoords(Xpos,Ypos)
@@ -2621,10 +4836,4 @@ class KiCadParser():
 
         Angle = self.transformAngle(Angle)
 
-        template = template.replace("%REF%", Ref)
-        template = template.replace("%XPOS%", self.strFloat(Xpos))
-        template = template.replace("%YPOS%", self.strFloat(Ypos))
-        template = template.replace("%ANGLE%", self.strFloat(Angle))
-        template = template.replace("%LAYER%", Layer)
-
-        return template
+        return Module(template,Ref,Xpos,Ypos,Angle,Layer)
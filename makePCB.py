@@ -1,6 +1,6 @@
 # makePcb.py
 #
-# version 1.0.0 Brian Norman March 2017
+# version 1.1.0 Brian Norman March 2017
 #
 # This is free software with no warranty whatsoever
 # You may modify but you may not sell it as your own work.
@@ -10,11 +10,56 @@
 # which can easily be calculated
 #
 # requires KiCadParser.py version 1.0.0
+#
+# Usage:-
+#
+#   python makePCB.py
+#       asks for the name of the position data file
+#
+#   python makePCB.py [-j JOBS] [-m MANIFEST] [-q] [-i] [board.pos ...]
+#       builds every board named on the command line or in the manifest
+#       (one per line, # comments allowed). Names can be wildcards like
+#       boards/*.pos. Each board.pos creates board.kicad_pcb.
+#       Exits with status 1 if any board had errors.
+#
+#   -i (incremental) keeps the output of each drawing command in
+#       board.cache and reuses it next time if nothing it depends on has
+#       changed. It can be used with or without board names.
+#
+#   -p N writes numbers with N decimal places instead of 4, N is 0 to 9
+#
+#   --nm works in whole nanometres, see KiCadParser.setNanometres
+#
+#   --profile prints the time spent in each command after each board
+#
+#   --trace writes board.trace.json which can be loaded into a trace
+#       viewer such as chrome://tracing or https://ui.perfetto.dev
+#
+#   --memory prints the memory used by each .pos line and block after
+#       each board, and the size of the templates, lists and block
+#       bodies kept while it is built. Needs python 3.9 or later
+#
+#   --merge writes the track segments at the end of the board without
+#       duplicates or zero length segments and with collinear segments
+#       which touch joined into one, see KiCadParser.enableSegmentMerge
+#
+#   --arcs draws SEGMENT ARC and CIRCLE as arc tracks rather than straight
+#       segments. Needs an ARCTRACK template (templates/ArcTrack.txt) and a
+#       KiCad 6 or later board, otherwise segments are used as before.
+#       Only shapes whose segments would turn through at most 10 degrees
+#       each, or --arc-step degrees, become arcs. Coarser ones, such as a
+#       circle of 12 segments, are taken to be polygons and kept as they are
+#
+# Template and list file names in the position data files are relative to
+# the current directory in both cases.
 
 import os
 import sys
-
-print("makePCB.py Vsn 1.0.0")
+import glob
+import time
+import argparse
+import functools
+import traceback
 
 try:
     from KiCadParser import *
@@ -24,112 +69,281 @@ except Exception as e:
     print("This program requires the parser helper KiCadParser.py.")
     sys.exit(1)
 
+try:
+    from concurrent.futures import ProcessPoolExecutor
+except ImportError:
+    # python 2.x - boards are built one at a time
+    ProcessPoolExecutor=None
 
+try:
+    from io import StringIO
+except ImportError:
+    from StringIO import StringIO
 
-print("\nEnter the name of the position data file without the .pos part. This will also be used as the name of the kicad_pcb output file.")
-prompt="Position data file:-"
-
-if sys.version_info>=(3,0):
-    #python 3.x
-    PosFileName=input(prompt)
-else:
-    #python 2.x
-    PosFileName=raw_input(prompt)
-
-# input/output files
-POS_file=None
-POS_line=0  # line number of the POS file being processed
-PCB_file=None
 
-def closeFilesAndExit():
-    global PCB_file,POS_file
-    if PCB_file!=None: PCB_file.close()
-    if POS_file!=None: POS_file.close()
-    sys.exit(0)
+# buildBoard
+#
+# creates fname.kicad_pcb from fname.pos using the given parser
+# returns False if the board could not be built or an exception
+# stopped it part way through
+#
+# if a CommandCache is given unchanged drawing commands are replayed
+# from it and it is saved afterwards
 
-# open the .pos file containing the data
+def buildBoard(fname,Parser,cache=None):
 
-def openPositionData(fname):
-    global POS_file
+    # open the .pos file containing the data
+    try:
+        POS_file=open(fname+".pos")
+        print("Opened position data file",fname+".pos")
+    except Exception as e:
+        print("Unable to open Position data file ",fname+".pos"," cannot proceed.\n",e.args)
+        return False
 
-    fname=fname+".pos"
     try:
-        POS_file=open(fname)
-        POS_line=0
-        print("Opened position data file",fname)
+        PCB_file=open(fname+".kicad_pcb","w")
+        print("Created kicad_pcb file ",fname+".kicad_pcb")
+
     except Exception as e:
-        print("Unable to open Position data file ",fname," cannot proceed.\n",e.args)
-        closeFilesAndExit()
+        print ("Error creating/overwriting '"+fname+".kicad_pcb'. Cannot proceed.", "\n",e.args)
+        POS_file.close()
+        return False
 
-def createPcbFile(fname):
-    global PCB_file
+    PCB_file.write("(") # all the kicad_pcb files are enclosed in brackets
 
-    fname=fname+".kicad_pcb"
+    POS_line=0  # line number of the POS file being processed
+    exceptionCaught=False
 
     try:
-        PCB_file=open(fname,"w")
-        print("Created kicad_pcb file ",fname)
+
+        # the parser compiles each line into a Command once
+        # comments, blank lines and anything after STOP are dropped
+        for cmd in Parser.compileLines(POS_file):
+            POS_line=cmd.srcLine
+
+            # None returns just mean there's nothing to write
+            # to the output file
+            if cache is None:
+                data=Parser.execute(cmd)
+            else:
+                data=Parser.executeCached(cmd,cache)
+            if data is None: continue
+
+            # big blocks like RING come back as a generator and are
+            # written out piece by piece as they are produced
+            PCB_file.write("\n")
+            PCB_file.writelines(Parser.output(data,cmd))
+
+        # held back by --merge until everything else is done
+        PCB_file.writelines(Parser.flushSegments())
 
     except Exception as e:
-        print ("Error creating/overwriting '"+fname+".kicad_pcb'. Cannot proceed.", "\n",e.args)
-        closeFilesAndExit()
 
-# open the required files
+        print("ERROR at data file line",POS_line," error=",e.args)
+        exc_type, exc_obj, exc_tb = sys.exc_info()
+        filename,lineno,function,text = traceback.extract_tb(exc_tb)[-1]
+        print("CAUSED by file ",os.path.split(filename)[1]," at line ", lineno)
+        exceptionCaught=True
 
-openPositionData(PosFileName)
-createPcbFile(PosFileName)
+    finally:
+        PCB_file.write(")")  # all the kicad_pcb file contents are enclosed in brackets
+        if exceptionCaught:
+            print("Please check for any error messages.")
+        else:
+            print("Finished normally - please check for any warnings.")
 
-PCB_file.write("(") # all the kicad_pcb files are enclosed in brackets
+        Parser.getStatus()
 
-Parser=KiCadParser();
-exceptionCaught=False
+        if Parser.profile is not None:
+            print(Parser.profileReport())
 
-try:
+        if Parser.trace is not None:
+            Parser.writeTrace(fname+".trace.json")
+            print("Trace written to",fname+".trace.json")
 
-    for line in POS_file:
-        POS_line=POS_line+1
+        if Parser.memory is not None:
+            Parser.stopMemoryProfile()
+            print(Parser.memoryReport())
 
-        # clean up input
-        line=line.strip()
+        if Parser.segmentMerge is not None:
+            print(Parser.segmentMergeReport())
 
-        # ignore comments and blank lines
-        # ORDER MATTERS !
-        if (line=="") or (line[0]=="#"): continue
+        if cache is not None:
+            print("Cache hits: ",cache.hits,"\nCache misses: ",cache.misses)
+            cache.save()
 
-        # stop?
-        # split(",",1) throws a wobbly
-        # but partition is happy
-        D=line.partition(",")
-        if D[0].upper().strip()=="STOP": break
+        PCB_file.close()
+        POS_file.close()
 
+    return not exceptionCaught
 
-        # None returns just mean there's nothing to write
-        # to the output file
-        data=Parser.parse(POS_line,D[0],D[2])
-        if data is None: continue
 
-        PCB_file.write("\n"+data)
+# template files are kept here between the boards a worker builds
+fileCache={}
 
-except Exception as e:
+# batchBoard
+#
+# builds one board for the batch mode. The messages are captured rather
+# than printed so they don't get mixed up with those of other boards
+# returns (fname,ok,warnings,errors,seconds,cache,messages) where cache
+# is the (hits,misses) for an incremental build otherwise None
+
+def batchBoard(fname,incremental=False,precision=4,nanometres=False,profile=False,trace=False,memory=False,merge=False,arcs=False,arcStep=None):
+    messages=StringIO()
+    stdout=sys.stdout
+    sys.stdout=messages
+    start=time.time()
+    cache=CommandCache(fname+".cache") if incremental else None
+    try:
+        Parser=KiCadParser(fileCache)
+        Parser.setNanometres(nanometres)
+        Parser.setPrecision(precision)
+        Parser.setArcTracks(arcs,arcStep)
+        if profile: Parser.enableProfile()
+        if trace: Parser.enableTrace()
+        if memory: Parser.enableMemoryProfile()
+        if merge: Parser.enableSegmentMerge()
+        ok=buildBoard(fname,Parser,cache)
+    finally:
+        sys.stdout=stdout
+    if cache is not None: cache=(cache.hits,cache.misses)
+    return fname,ok,Parser.numWarnings,Parser.numErrors,time.time()-start,cache,messages.getvalue()
+
+
+# boardNames
+#
+# expands the command line and manifest names into a list of boards
+# the .pos extension is optional
+
+def boardNames(names,manifest):
+    if manifest is not None:
+        with open(manifest) as file:
+            for line in file:
+                line=line.strip()
+                if (line=="") or (line[0]=="#"): continue
+                names.append(line)
+
+    boards=[]
+    for name in names:
+        found=sorted(glob.glob(name)) if glob.has_magic(name) else [name]
+        if len(found)==0:
+            print("WARNING no files match",name)
+        for x in found:
+            if x.endswith(".pos"): x=x[:-4]
+            if x not in boards: boards.append(x)
+    return boards
+
+
+# decimalPlaces
+# checks the -p number of decimal places, 0 to 9. KiCad only keeps whole
+# nanometres, 6 places, so more than that is only padding
+
+def decimalPlaces(text):
+    try:
+        value=int(text)
+    except ValueError:
+        value=None
+    if value is None or not 0<=value<=9:
+        raise argparse.ArgumentTypeError("must be a whole number from 0 to 9")
+    return value
 
-    print("ERROR at data file line",POS_line," error=",e.args)
-    exc_type, exc_obj, exc_tb = sys.exc_info()
-    fname = os.path.split(exc_tb.tb_frame.f_code.co_filename)[1]
-    print("CAUSED by file ",fname," at line ", exc_tb.tb_lineno)
-    print("TRACEBACK",sys.exc_traceback.tb_lineno)
-    exceptionCaught=True
-
-finally:
-    PCB_file.write(")")  # all the kicad_pcb file contents are enclosed in brackets
-    if exceptionCaught:
-        print("Please check for any error messages.")
-    else:
-        print("Finished normally - please check for any warnings.")
 
-    Parser.getStatus()
+# arcStep
+# checks the --arc-step turn, it must be more than 0 and at most 180 degrees
 
-    closeFilesAndExit() # exits the process
+def arcStep(text):
+    value=float(text)
+    if not 0<value<=180:
+        raise argparse.ArgumentTypeError("must be more than 0 and at most 180 degrees")
+    return value
 
 
+def interactive(incremental,precision,nanometres,profile,trace,memory,merge,arcs,arcStep):
+    print("\nEnter the name of the position data file without the .pos part. This will also be used as the name of the kicad_pcb output file.")
+    prompt="Position data file:-"
+
+    if sys.version_info>=(3,0):
+        #python 3.x
+        PosFileName=input(prompt)
+    else:
+        #python 2.x
+        PosFileName=raw_input(prompt)
+
+    cache=CommandCache(PosFileName+".cache") if incremental else None
+    Parser=KiCadParser()
+    Parser.setNanometres(nanometres)
+    Parser.setPrecision(precision)
+    Parser.setArcTracks(arcs,arcStep)
+    if profile: Parser.enableProfile()
+    if trace: Parser.enableTrace()
+    if memory: Parser.enableMemoryProfile()
+    if merge: Parser.enableSegmentMerge()
+    buildBoard(PosFileName,Parser,cache)
+    sys.exit(0)
 
 
+def batch(args):
+    boards=boardNames(args.boards,args.manifest)
+    if len(boards)==0:
+        print("No position data files to build.")
+        sys.exit(1)
+
+    build=functools.partial(batchBoard,incremental=args.incremental,precision=args.precision,nanometres=args.nm,profile=args.profile,trace=args.trace,memory=args.memory,merge=args.merge,arcs=args.arcs,arcStep=args.arc_step)
+    if args.jobs==1 or len(boards)==1 or ProcessPoolExecutor is None:
+        results=map(build,boards)
+        pool=None
+    else:
+        pool=ProcessPoolExecutor(args.jobs)
+        results=pool.map(build,boards)
+
+    failed=0
+    summary=[]
+    try:
+        for fname,ok,warnings,errors,seconds,cache,messages in results:
+            if not args.quiet:
+                print("\n=====",fname)
+                sys.stdout.write(messages)
+            if errors>0 or not ok: failed=failed+1
+            summary.append((fname,ok,warnings,errors,seconds,cache))
+    finally:
+        if pool is not None: pool.shutdown()
+
+    width=max(len(x[0]) for x in summary)
+    heading="Board".ljust(width)+" Warnings  Errors     Time"
+    if args.incremental: heading=heading+"    Hits  Misses"
+    print("\n"+heading)
+    for fname,ok,warnings,errors,seconds,cache in summary:
+        line=fname.ljust(width)+" "+str(warnings).rjust(8)+" "+str(errors).rjust(7)+" "+("%.3fs" % seconds).rjust(8)
+        if cache is not None:
+            line=line+" "+str(cache[0]).rjust(7)+" "+str(cache[1]).rjust(7)
+        if not ok: line=line+"  FAILED"
+        print(line)
+
+    print("\nBuilt",len(summary)-failed,"of",len(summary),"boards without errors.")
+    sys.exit(1 if failed>0 else 0)
+
+
+if __name__=="__main__":
+
+    print("makePCB.py Vsn 1.1.0")
+
+    argParser=argparse.ArgumentParser(description="Create kicad_pcb files from position data files.")
+    argParser.add_argument("boards",nargs="*",help="position data files, wildcards are allowed")
+    argParser.add_argument("-m","--manifest",help="file listing the position data files, one per line")
+    argParser.add_argument("-j","--jobs",type=int,default=None,help="number of boards to build at once (default: number of CPUs)")
+    argParser.add_argument("-q","--quiet",action="store_true",help="only print the summary")
+    argParser.add_argument("-i","--incremental",action="store_true",help="reuse the output of unchanged commands from the last run")
+    argParser.add_argument("-p","--precision",type=decimalPlaces,default=4,help="decimal places for numbers, 0 to 9 (default: 4)")
+    argParser.add_argument("--nm",action="store_true",help="work in whole nanometres so long repeats don't drift")
+    argParser.add_argument("--profile",action="store_true",help="report the time spent in each command")
+    argParser.add_argument("--trace",action="store_true",help="write a trace-event file for each board")
+    argParser.add_argument("--memory",action="store_true",help="report the memory used by each line and block")
+    argParser.add_argument("--merge",action="store_true",help="remove duplicate track segments and join collinear ones")
+    argParser.add_argument("--arcs",action="store_true",help="draw SEGMENT ARC and CIRCLE as arc tracks (KiCad 6 or later)")
+    argParser.add_argument("--arc-step",type=arcStep,default=None,metavar="DEGREES",help="with --arcs, the most each segment may turn for the shape to become an arc (default: 10)")
+    args=argParser.parse_args()
+
+    if len(args.boards)==0 and args.manifest is None:
+        interactive(args.incremental,args.precision,args.nm,args.profile,args.trace,args.memory,args.merge,args.arcs,args.arc_step)
+    else:
+        batch(args)
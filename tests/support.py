@@ -0,0 +1,56 @@
+# support
+#
+# helpers shared by the tests. Boards are built from .pos lines held in
+# memory the same way makePCB builds them from a file, using the
+# templates and components which come with the repo
+
+import contextlib
+import io
+import os
+import sys
+
+ROOT=os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0,ROOT)
+
+import KiCadParser
+
+TEMPLATES={
+    "SEGMENT":  "templates/Segment.txt",
+    "ARCTRACK": "templates/ArcTrack.txt",
+    "GRLINE":   "templates/GRline.txt",
+    "GRCIRCLE": "templates/GRcircle.txt",
+    "GRTEXT":   "templates/Text.txt",
+    "VIA":      "templates/via.txt",
+    "ZONE":     "templates/Zone.txt",
+    "FIDUCIAL": "templates/Fiducial.txt",
+    "WS2812B":  "components/WS2812B.txt",
+    "CAP":      "components/Capacitors SMD.txt",
+}
+
+# templates
+# returns the TEMPLATE lines which load the named templates
+
+def templates(*ids):
+    return ["TEMPLATE,%s,%s" % (id,os.path.join(ROOT,TEMPLATES[id])) for id in ids]
+
+# build
+#
+# runs the lines through a new parser and returns the board text (without
+# the enclosing brackets), whatever was printed and the parser itself.
+# setup is called with the parser before the lines are compiled
+
+def build(lines,setup=None):
+    Parser=KiCadParser.KiCadParser()
+    if setup is not None: setup(Parser)
+
+    board=io.StringIO()
+    log=io.StringIO()
+    with contextlib.redirect_stdout(log):
+        for cmd in Parser.compileLines(line+"\n" for line in lines):
+            data=Parser.execute(cmd)
+            if data is None: continue
+            board.write("\n")
+            board.writelines(Parser.output(data,cmd))
+        board.writelines(Parser.flushSegments())
+
+    return board.getvalue(),log.getvalue(),Parser
@@ -0,0 +1,46 @@
+# test_arc_tracks
+#
+# makePCB --arcs draws SEGMENT CIRCLE and ARC as arc tracks where their
+# NumSegments makes a smooth curve, see KiCadParser.setArcTracks
+
+import os
+import unittest
+
+from support import ROOT, build, templates
+
+
+def drawn(lines,maxStepAngle=None):
+    def setup(Parser): Parser.setArcTracks(True,maxStepAngle)
+    text,log,Parser=build(templates("SEGMENT","ARCTRACK")+lines,setup)
+    return text.count("(arc "),text.count("(segment "),log
+
+
+class ArcTrackTests(unittest.TestCase):
+
+    def test_smooth_circle(self):
+        self.assertEqual(drawn(["SEGMENT,CIRCLE,100,100,25,36,1,F.Cu,0"])[:2],(2,0))
+        self.assertEqual(drawn(["SEGMENT,CIRCLE,100,100,25,360,1,F.Cu,0"])[:2],(2,0))
+
+    def test_polygon_is_kept(self):
+        self.assertEqual(drawn(["SEGMENT,CIRCLE,200,100,25,12,1,F.Cu,0"])[:2],(0,12))
+        self.assertEqual(drawn(["SEGMENT,CIRCLE,200,100,25,35,1,F.Cu,0"])[:2],(0,35))
+
+    def test_arc(self):
+        self.assertEqual(drawn(["SEGMENT,ARC,75,110,25,0,90,9,1,F.Cu,0"])[:2],(1,0))
+        self.assertEqual(drawn(["SEGMENT,ARC,75,110,25,0,90,8,1,F.Cu,0"])[:2],(0,8))
+        self.assertEqual(drawn(["SEGMENT,ARC,75,110,25,0,270,27,1,F.Cu,0"])[:2],(2,0))
+
+    def test_step_angle(self):
+        self.assertEqual(drawn(["SEGMENT,CIRCLE,200,100,25,12,1,F.Cu,0"],30.0)[:2],(2,0))
+        self.assertEqual(drawn(["SEGMENT,CIRCLE,200,100,25,360,1,F.Cu,0"],0.5)[:2],(0,360))
+
+    def test_old_board_uses_segments(self):
+        # the header which comes with the repo is from KiCad 4
+        arcs,segments,log=drawn(["ASIS,HEADER,"+os.path.join(ROOT,"templates","Header.txt"),
+                                 "SEGMENT,CIRCLE,100,100,25,36,1,F.Cu,0"])
+        self.assertEqual((arcs,segments),(0,36))
+        self.assertIn("arc tracks need version",log)
+
+
+if __name__=="__main__":
+    unittest.main()
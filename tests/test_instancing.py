@@ -0,0 +1,96 @@
+# test_instancing
+#
+# group bodies are rendered once and copied (see groupInstance). Every
+# copy must be exactly what executing the body at that position writes
+
+import unittest
+
+from support import KiCadParser, build, templates
+
+
+def buildBoth(lines):
+    def plain(Parser): Parser.instanceGroups=False
+    return build(lines),build(lines,plain)
+
+def instanced(Parser,groupId):
+    return sum(1 for item in Parser.groupInstances[groupId][2] if type(item) is KiCadParser.InstanceItem)
+
+
+class EmptyParameterTests(unittest.TestCase):
+
+    def check(self,line):
+        lines=templates("SEGMENT","WS2812B")+["DEFGROUP,G",line,"ENDGROUP","GROUP,G,10,20,0","GROUP,G,30,20,90"]
+        (text,log,Parser),(plainText,plainLog,plainParser)=buildBoth(lines)
+
+        self.assertEqual(instanced(Parser,"G"),0)
+        self.assertEqual(text,plainText)
+        self.assertEqual(log,plainLog)
+        self.assertNotIn("NONE",text)
+        self.assertEqual(Parser.numWarnings,plainParser.numWarnings)
+        self.assertEqual(log.count("Cannot add"),2)
+
+    def test_segment_empty_width(self):
+        self.check("SEGMENT,LINE,0,0,1,1,,F.Cu,0")
+
+    def test_segment_empty_net(self):
+        self.check("SEGMENT,LINE,0,0,1,1,0.2,F.Cu,")
+
+    def test_component_empty_position(self):
+        self.check("WS2812B,L,0,,0,F.Cu")
+
+    def test_component_empty_angle(self):
+        self.check("WS2812B,L,,0,0,F.Cu")
+
+
+class ParameterTests(unittest.TestCase):
+
+    body=["DEFGROUP,G",
+          "WS2812B,L,0,0,0,F.Cu",
+          "WS2812B,L,45,5,-2.5,B.Cu",
+          "SEGMENT,LINE,-2.5,2,-2.5,5,1,F.Cu,0",
+          "SEGMENT,LINE,2.5,0,7.5,0,.1,F.Cu,3",
+          "SEGMENT,LINE,X,0,X,Y,W,F.Cu,0",
+          "WS2812B,L,A,X,Y,F.Cu",
+          "ENDGROUP",
+          "DEFRING,R","GROUP,G,0,0,0","ENDRING",
+          "DEFREPEAT,P","GROUP,G,0,0,0","ENDREPEAT"]
+
+    calls=["GROUP,G,0,0,0",
+           "GROUP,G,100,50,30",
+           "GROUP,G,-12.5,7.25,-90",
+           "RING,R,100,100,30,0,0,45,8",
+           "REPEAT,P,30,35,45,5,20,10,0"]
+
+    def test_constants_are_instanced(self):
+        lines=templates("SEGMENT","WS2812B")+["SETG,X,1","SETG,Y,2","SETG,W,0.25","SETG,A,15"]+self.body
+        text,log,Parser=build(lines+["GROUP,G,0,0,0"])
+        self.assertEqual(instanced(Parser,"G"),4)
+
+    def test_copies_match_execution(self):
+        lines=templates("SEGMENT","WS2812B")+["SETG,X,1","SETG,Y,2","SETG,W,0.25","SETG,A,15"]+self.body+self.calls
+        (text,log,Parser),(plainText,plainLog,plainParser)=buildBoth(lines)
+        self.assertEqual(text,plainText)
+        self.assertEqual(log,plainLog)
+        self.assertEqual(Parser.numWarnings,0)
+
+    def test_variables_change_between_copies(self):
+        lines=templates("SEGMENT","WS2812B")+self.body
+        for n,call in enumerate(self.calls):
+            lines+=["SETG,X,%d" % n,"SETG,Y,%d" % (2*n),"SETG,W,0.%d" % (n+1),"SETG,A,%d" % (10*n),call]
+        (text,log,Parser),(plainText,plainLog,plainParser)=buildBoth(lines)
+        self.assertEqual(text,plainText)
+        self.assertIn("(width 0.5000)",text)
+
+    def test_nanometres_and_precision(self):
+        def setup(Parser,instance):
+            Parser.setNanometres(True)
+            Parser.setPrecision(3)
+            Parser.instanceGroups=instance
+        lines=templates("SEGMENT","WS2812B")+["SETG,X,1.00049","SETG,Y,2","SETG,W,0.25","SETG,A,15"]+self.body+self.calls
+        text=build(lines,lambda Parser:setup(Parser,True))[0]
+        plainText=build(lines,lambda Parser:setup(Parser,False))[0]
+        self.assertEqual(text,plainText)
+
+
+if __name__=="__main__":
+    unittest.main()
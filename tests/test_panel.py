@@ -0,0 +1,96 @@
+# test_panel
+#
+# every copy of a PANEL's board must be exactly what GROUP writes at the
+# same place, to the last digit
+
+import math
+import re
+import unittest
+
+from support import KiCadParser, build, templates
+
+
+BOARD=["DEFGROUP,BOARD",
+       "GRAPHIC,RECT,0,0,40,30,0.1,Edge.Cuts",
+       "GRAPHIC,TEXT,CENTER,20,25,0,2,.2,F.SilkS,Panel",
+       "WS2812B,L,0,10,10,F.Cu",
+       "CAP,C,90,20,10,F.Cu",
+       "SEGMENT,LINE,2.5,2,12.5,5,0.25,F.Cu,0",
+       "SEGMENT,CIRCLE,20,15,5,36,0.25,F.Cu,0",
+       "VIA,30,20,0.8,0.4,F.Cu,B.Cu,0",
+       "ZONE,RECT,2,2,10,8,0,,F.Cu,full,0.508,0.508,0.254,16,0.508,.508",
+       "DEFRING,R",
+       "WS2812B,D,0,0,0,F.Cu",
+       "ENDRING",
+       "RING,R,30,15,5,-90,0,4,90",
+       "ENDGROUP"]
+
+HEAD=templates("SEGMENT","GRLINE","GRTEXT","VIA","ZONE","FIDUCIAL","WS2812B","CAP")+["ORIGIN,20,190","SETDIRECTION,1,-1"]
+
+
+# groups returns the GROUP lines which place the boards where PANEL does
+def groups(X,Y,Angle,Columns,Rows,Width,Height,Gap):
+    c,s=math.cos(Angle*math.pi/180),math.sin(Angle*math.pi/180)
+    corners=[(c*x-s*y,s*x+c*y) for x,y in ((0,0),(Width,0),(0,Height),(Width,Height))]
+    minX=min(x for x,y in corners)
+    minY=min(y for x,y in corners)
+    cellWidth=max(x for x,y in corners)-minX
+    cellHeight=max(y for x,y in corners)-minY
+    return ["GROUP,BOARD,%r,%r,%r" % (X+column*(cellWidth+Gap)-minX,Y+row*(cellHeight+Gap)-minY,float(Angle))
+            for row in range(Rows) for column in range(Columns)]
+
+
+class PanelTests(unittest.TestCase):
+
+    def check(self,Angle,extra=[],setup=None,panel=(10,5,3,2,40,30,1)):
+        X,Y,Columns,Rows,Width,Height,Gap=panel
+        board=BOARD[:-1]+extra+BOARD[-1:]
+        text,log,Parser=build(HEAD+board+["PANEL,BOARD,%r,%r,%r,%r,%r,%r,%r,%r,NONE,0,0.1,Edge.Cuts" %
+                                          (X,Y,Angle,Columns,Rows,Width,Height,Gap)],setup)
+        group,groupLog,unused=build(HEAD+board+groups(X,Y,Angle,Columns,Rows,Width,Height,Gap),setup)
+        self.assertEqual(text,group)
+        self.assertEqual(log,groupLog)
+        return Parser
+
+    def test_copies_match_group(self):
+        for Angle in (0,90,180,30):
+            self.check(Angle)
+
+    def test_rounding_ties_match_group(self):
+        # positions worked out from another copy rather than with the
+        # copy's own transform come out a bit different, which rounds
+        # the via to 58.62 rather than 58.63 here
+        def setup(Parser): Parser.setPrecision(2)
+        self.check(270,setup=setup,panel=(-21.584,47.345,4,3,35.159,37.67,2.539))
+
+    def test_references_numbered_in_order(self):
+        panel,log,Parser=build(HEAD+BOARD+["PANEL,BOARD,0,0,0,2,2,40,30,1,NONE,0,0.1,Edge.Cuts"])
+        refs=re.findall(r"reference (\S+)",panel)
+        # the count is kept per component id, a board has L then four Ds
+        expected=[("L" if n%5==1 else "D")+str(n) for n in range(1,21)]
+        self.assertEqual([x for x in refs if x[0] in "LD"],expected)
+
+    def test_nanometres_and_merge(self):
+        def setup(Parser):
+            Parser.setNanometres(True)
+            Parser.enableSegmentMerge()
+        self.check(90,setup=setup)
+
+    def test_echo_in_every_copy(self):
+        self.check(90,["ECHO,hello,1,2"])
+
+    def test_variables_in_every_copy(self):
+        self.check(0,["SETG,ViaSize,0.6","VIA,30,25,ViaSize,0.4,F.Cu,B.Cu,0"])
+
+    def test_text_items_in_every_copy(self):
+        self.check(30,["FIDUCIAL,F,5,5,1,0.1,F.Cu"])
+
+    def test_warnings_in_every_copy(self):
+        Parser=self.check(0,["VIA,30,20,NoSize,0.4,F.Cu,B.Cu,0"])
+        self.assertEqual(Parser.numErrors,0)
+        # three for each of the six copies
+        self.assertEqual(Parser.numWarnings,18)
+
+
+if __name__=="__main__":
+    unittest.main()
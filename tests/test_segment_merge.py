@@ -0,0 +1,121 @@
+# test_segment_merge
+#
+# makePCB --merge holds the segments back until the end and writes them
+# with duplicates and zero length segments removed and collinear
+# segments which touch or overlap joined, see SegmentMerge
+
+import re
+import unittest
+
+from support import build, templates
+
+reSegment=re.compile(r'\(segment \(start (\S+) (\S+)\) \(end (\S+) (\S+)\) \(width (\S+)\) \(layer (\S+)\) \(net ([^\s)]+)\)\)')
+
+
+# merged builds the lines with --merge on. Y is set to point down, the
+# same as KiCad, so the coordinates are written as they are given
+
+def merged(*lines):
+    def setup(Parser): Parser.enableSegmentMerge()
+    text,log,Parser=build(templates("SEGMENT","GRLINE")+["SETDIRECTION,1,1"]+list(lines),setup)
+    return text,Parser
+
+# segments returns the segments in text as a sorted list of
+# ((x1,y1),(x2,y2),width,layer,net) with the ends in order
+
+def segments(text):
+    result=[]
+    for x1,y1,x2,y2,width,layer,net in reSegment.findall(text):
+        a,b=sorted(((float(x1),float(y1)),(float(x2),float(y2))))
+        result.append((a,b,width,layer,net))
+    return sorted(result)
+
+
+class SegmentMergeTests(unittest.TestCase):
+
+    def check(self,lines,expected):
+        text,Parser=merged(*lines)
+        self.assertEqual(segments(text),sorted(expected))
+        return text,Parser
+
+    def test_duplicates(self):
+        text,Parser=self.check(["SEGMENT,LINE,0,0,10,0,0.25,F.Cu,1",
+                                "SEGMENT,LINE,0,0,10,0,0.25,F.Cu,1",
+                                "SEGMENT,LINE,10,0,0,0,0.25,F.Cu,1"],
+                               [((0,0),(10,0),"0.2500","F.Cu","1")])
+        self.assertEqual(Parser.segmentMergeReport(),
+                         "Segments: 3 in, 1 out, 0 zero length, 2 duplicates, 0 joined")
+
+    def test_overlapping(self):
+        self.check(["SEGMENT,LINE,0,0,6,0,0.25,F.Cu,0",
+                    "SEGMENT,LINE,4,0,10,0,0.25,F.Cu,0"],
+                   [((0,0),(10,0),"0.2500","F.Cu","0")])
+
+    def test_contained(self):
+        self.check(["SEGMENT,LINE,0,0,10,0,0.25,F.Cu,0",
+                    "SEGMENT,LINE,3,0,7,0,0.25,F.Cu,0"],
+                   [((0,0),(10,0),"0.2500","F.Cu","0")])
+
+    def test_touching_chain(self):
+        text,Parser=self.check(["SEGMENT,LINE,2,2,3,3,0.25,F.Cu,0",
+                                "SEGMENT,LINE,0,0,1,1,0.25,F.Cu,0",
+                                "SEGMENT,LINE,2,2,1,1,0.25,F.Cu,0"],
+                               [((0,0),(3,3),"0.2500","F.Cu","0")])
+        self.assertEqual(Parser.segmentMergeReport(),
+                         "Segments: 3 in, 1 out, 0 zero length, 0 duplicates, 2 joined")
+
+    def test_gap_is_kept(self):
+        self.check(["SEGMENT,LINE,0,0,1,0,0.25,F.Cu,0",
+                    "SEGMENT,LINE,1.0001,0,2,0,0.25,F.Cu,0"],
+                   [((0,0),(1,0),"0.2500","F.Cu","0"),
+                    ((1.0001,0),(2,0),"0.2500","F.Cu","0")])
+
+    def test_parallel_and_crossing_are_kept(self):
+        self.check(["SEGMENT,LINE,0,0,2,0,0.25,F.Cu,0",
+                    "SEGMENT,LINE,0,1,2,1,0.25,F.Cu,0",
+                    "SEGMENT,LINE,1,-1,1,1,0.25,F.Cu,0",
+                    "SEGMENT,LINE,2,0,4,1,0.25,F.Cu,0"],
+                   [((0,0),(2,0),"0.2500","F.Cu","0"),
+                    ((0,1),(2,1),"0.2500","F.Cu","0"),
+                    ((1,-1),(1,1),"0.2500","F.Cu","0"),
+                    ((2,0),(4,1),"0.2500","F.Cu","0")])
+
+    def test_different_layer_width_and_net_are_kept(self):
+        self.check(["SEGMENT,LINE,0,0,6,0,0.25,F.Cu,0",
+                    "SEGMENT,LINE,4,0,10,0,0.25,B.Cu,0",
+                    "SEGMENT,LINE,4,0,10,0,0.5,F.Cu,0",
+                    "SEGMENT,LINE,4,0,10,0,0.25,F.Cu,2"],
+                   [((0,0),(6,0),"0.2500","F.Cu","0"),
+                    ((4,0),(10,0),"0.2500","B.Cu","0"),
+                    ((4,0),(10,0),"0.5000","F.Cu","0"),
+                    ((4,0),(10,0),"0.2500","F.Cu","2")])
+
+    def test_zero_length_when_written(self):
+        text,Parser=self.check(["SEGMENT,LINE,5,5,5.00001,5,0.25,F.Cu,0",
+                                "SEGMENT,LINE,0,0,1,0,0.25,F.Cu,0"],
+                               [((0,0),(1,0),"0.2500","F.Cu","0")])
+        self.assertEqual(Parser.segmentMergeReport(),
+                         "Segments: 2 in, 1 out, 1 zero length, 0 duplicates, 0 joined")
+
+    def test_shapes_and_other_items(self):
+        # the rect's bottom edge carries on along the line, the graphic
+        # lines are written where they were and aren't merged. RECT
+        # writes its line width as given
+        text,Parser=merged("GRAPHIC,LINE,0,0,10,0,0.5,Edge.Cuts",
+                           "SEGMENT,RECT,0,0,10,10,0.2500,F.Cu,0",
+                           "SEGMENT,LINE,10,0,20,0,0.25,F.Cu,0",
+                           "GRAPHIC,LINE,0,0,10,0,0.5,Edge.Cuts")
+        self.assertEqual(text.count("(gr_line"),2)
+        self.assertTrue(text.startswith("\n(gr_line"))
+        self.assertIn(((0,0),(20,0),"0.2500","F.Cu","0"),segments(text))
+        self.assertEqual(len(segments(text)),4)
+
+    def test_off_by_default(self):
+        lines=templates("SEGMENT")+["SEGMENT,LINE,0,0,10,0,0.25,F.Cu,1"]*2
+        text,log,Parser=build(lines)
+        self.assertEqual(len(segments(text)),2)
+        self.assertEqual(Parser.segmentMergeReport(),"")
+
+
+if __name__=="__main__":
+    unittest.main()